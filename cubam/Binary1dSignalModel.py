@@ -1,19 +1,12 @@
 from BinaryModel import *
-from numpy import sign
+from numpy import sign, clip, where, column_stack
+from utils import make_rng, randtn_array
 
 class Binary1dSignalModel(BinaryModel):
   def __init__(self, filename=None, data=None):
     self._mdlPrmList = ['beta', 'sigx', 'sigw', 'muw', 'sigt']
     BinaryModel.__init__(self, filename, data)
 
-  def image_objective_range(self, imgId, prm):
-    plen = len(prm)
-    pvec = (plen*c_double)(); pvec = cast(pvec, POINTER(c_double))
-    for i in range(plen): pvec[i] = prm[i]
-    vec = (plen*c_double)(); vec = cast(vec, POINTER(c_double))
-    annmodel.image_objective(self.mPtr, c_int(imgId), pvec, c_int(plen), vec)
-    return (vec[:plen], prm)
-    
   def worker_objective_range(self, wkrId, prm=None, wj=None, tj=None):
     if prm is None:
       if tj is None or wj is None:
@@ -21,35 +14,28 @@ class Binary1dSignalModel(BinaryModel):
           wj = linspace(0.05, 3.0, 30).tolist()
       # create the gird
       wjs, tjs = meshgrid(wj, tj)
-      wjs = concatenate(wjs).tolist()
-      tjs = concatenate(tjs).tolist()
-      prm = concatenate([wjs,tjs]).tolist()
-    plen = len(prm)
-    pvec = (plen*c_double)(); pvec = cast(pvec, POINTER(c_double))
-    for i in range(plen): pvec[i] = prm[i]
-    vlen = plen/2
-    vec = (vlen*c_double)(); vec = cast(vec, POINTER(c_double))
-    annmodel.worker_objective(self.mPtr, c_int(wkrId), pvec, c_int(plen), vec)
-    res = vec[:vlen]
+      wjs, tjs = wjs.ravel(), tjs.ravel()
+      prm = concatenate([wjs,tjs])
+    res = self.worker_objective_batch([wkrId], prm)[0]
     if tj is None or wj is None:
       return (res, wjs, tjs)
     else:
       return (reshape(res, (len(wj), len(tj))), wjs, tjs)
     
   def get_worker_param(self, id=None):
-    prm = self.get_worker_param_raw()
+    prm = self._param_view('worker')
     nprm = len(prm)/2
     if id is None:
-      return dict((id, [prm[id], prm[nprm+id]]) for id in range(nprm))
+      return dict(enumerate(column_stack([prm[:nprm], prm[nprm:]]).tolist()))
     else:
-      return [prm[id], prm[nprm+id]]
+      return [float(prm[id]), float(prm[nprm+id])]
 
   def get_image_param(self, id=None):
-    prm = self.get_image_param_raw()
+    prm = self._param_view('image')
     if id is None:
-      return dict((id, [prm[id]]) for id in range(len(prm)))
+      return dict(enumerate(prm.reshape((-1, 1)).tolist()))
     else:
-      return [prm[id]]
+      return [float(prm[id])]
     
   def get_worker_var(self, wkrId):
     """
@@ -112,6 +98,39 @@ class Binary1dSignalModel(BinaryModel):
     tj1, sj, wj1 = self.tw2tsw(tj, wj)
     return [bool( wj1*((xi+randn()*sj)-tj1) > 0. )]
 
+  def sample_worker_param_array(self, numWkr, tauPrior=0.8, advPrior=.01,
+                                sigPrior=[1.5, .3], sigThresh=[.05, 3.],
+                                tauThresh=[-2., 2.], rng=None):
+    """
+    Vectorized version of `sample_worker_param`, returns a numWkr x 2 array
+    of (wj, tj) rows.
+    """
+    rng = make_rng(rng)
+    sj = clip(rng.gamma(sigPrior[0], sigPrior[1], numWkr), *sigThresh)
+    wj = where(rng.rand(numWkr) < advPrior, -1., 1.)/sj
+    tj = randtn_array(numWkr, tauThresh[0], tauThresh[1], rng)*tauPrior/sj
+    return column_stack([wj, tj])
+
+  def sample_image_param_array(self, numImg, beta=.5, theta=.5, rng=None):
+    """
+    Vectorized version of `sample_image_param`, returns a numImg x 1 array.
+    """
+    rng = make_rng(rng)
+    xis = rng.randn(numImg)*theta
+    xis += where(rng.rand(numImg)<beta, 1., -1.)
+    return xis.reshape((numImg, 1))
+
+  def sample_label_array(self, wkrPrm, imgPrm, imgIdx, wkrIdx, rng=None):
+    """
+    Vectorized version of `sample_label`, samples a label for each pair of
+    image and worker indices into the parameter arrays.
+    """
+    rng = make_rng(rng)
+    wj = wkrPrm[wkrIdx,0]; tj = wkrPrm[wkrIdx,1]
+    xi = imgPrm[imgIdx,0]
+    tj1, sj, wj1 = self.tw2tsw(tj, wj)
+    return wj1*((xi+rng.randn(len(xi))*sj)-tj1) > 0.
+
   def tw2tsw(self, tj, wj):
     """
     Converts from the (tj, wj) convention to (tj, sj, wj).
@@ -125,6 +144,6 @@ class Binary1dSignalModel(BinaryModel):
     return (tj/sj, 1./sj*wj)
 
   def get_labels(self):
-    prm = self.get_image_param_raw()
-    return dict((id, int(prm[id]>0.0)) for id in range(len(prm)))
+    prm = self._param_view('image')
+    return dict(enumerate((prm > 0.0).astype(int).tolist()))
 
@@ -1,7 +1,7 @@
 from BinaryModel import *
-from numpy import ones, log10, nonzero, flipud, diag
+from numpy import ones, log10, nonzero, flipud, diag, where, bincount
 from numpy.random import multinomial
-from scipy.stats import beta
+from utils import make_rng, label_array_size
 
 class BinaryBiasModel(BinaryModel):
     def __init__(self, filename=None):
@@ -15,6 +15,7 @@ class BinaryBiasModel(BinaryModel):
         }
         self.wkrIds = {}
         self.imgIds = {}
+        self.numImgs = self.numWkrs = self.numLbls = 0
         if filename:
             self.load_data(filename)
         else:
@@ -31,15 +32,48 @@ class BinaryBiasModel(BinaryModel):
         yamlfile = "%s.yaml" % filename[:-4]
         if filename[-4:]=='.txt' and os.path.exists(yamlfile) \
           and not skipyaml:
+            import yaml
             prm = yaml.load(open(yamlfile))
             self.imgIds = prm['imgIds']
             self.wkrIds = prm['wkrIds']
         # load the text data
         filein = open(filename)
         info = filein.readline().rstrip().split(' ')
-        self.numLbls = int(info[2])
-        self.numWkrs = int(info[1])
-        self.numImgs = int(info[0])
+        rows = [[int(c) for c in line.rstrip().split(' ')] \
+                for line in filein]
+        self._index_labels(rows, int(info[0]), int(info[1]))
+
+    def load_data_array(self, labels, numImgs=None, numWkrs=None):
+        """
+        Loads the labels from an N x 3 array of (image id, worker id,
+        label) rows rather than from a data file.
+        """
+        labels = array(labels, dtype=int).reshape((-1, 3))
+        numImgs, numWkrs = label_array_size(labels, numImgs, numWkrs)
+        self._index_labels(labels.tolist(), numImgs, numWkrs)
+
+    def attach_labels(self, store):
+        """
+        Indexes the labels of a `LabelStore`, which saves reading and parsing
+        the data again (unlike the signal models, this model keeps its own
+        copy of the labels).
+        """
+        self.load_data_array(store.get_label_array(), store.get_num_imgs(),
+                             store.get_num_wkrs())
+        self.imgIds = store.imgIds
+        self.wkrIds = store.wkrIds
+
+    def get_label_array(self):
+        """
+        Returns the loaded labels as an N x 3 array of (image id, worker id,
+        label) rows.
+        """
+        return array(self.labels, dtype=int).reshape((-1, 3))
+
+    def _index_labels(self, rows, numImgs, numWkrs):
+        self.numLbls = len(rows)
+        self.numWkrs = numWkrs
+        self.numImgs = numImgs
         self.wkrPrm = zeros((self.numWkrs, 2)) # [a_1, a_0]
         self.wkrPrm[:,0] = self.mdlPrm['initAj'][0]
         self.wkrPrm[:,1] = self.mdlPrm['initAj'][1]
@@ -47,15 +81,44 @@ class BinaryBiasModel(BinaryModel):
         self.wkrLbls = dict((id, []) for id in range(self.numWkrs))
         self.imgLbls = dict((id, []) for id in range(self.numImgs))
         self.labels = []
-        for (lino, line) in enumerate(filein):
-            cols = [int(c) for c in line.rstrip().split(' ')]
+        for cols in rows:
             iId = cols[0]; wId = cols[1]; lij = cols[2]==1
             self.wkrLbls[wId].append([iId, lij])
             self.imgLbls[iId].append([wId, lij])
             self.labels.append((iId, wId, lij))
+        self._group_labels()
         self._setup_prior()
 
+    def _group_labels(self):
+        # collapses duplicate labels into counts, and groups the images with
+        # identical signatures of (worker id, label, count) triplets, which
+        # share their posterior, so that the updates go over the distinct
+        # labels of each group once
+        counts = [{} for iId in range(self.numImgs)]
+        for (iId, wId, lij) in self.labels:
+            counts[iId][(wId, lij)] = counts[iId].get((wId, lij), 0) + 1
+        groups = {}
+        self.imgGrp = zeros(self.numImgs, dtype=int)
+        self.grpLbls = [] # signature of each group
+        grpSize = []
+        for iId in range(self.numImgs):
+            sig = tuple(sorted((wId, lij, n) for ((wId, lij), n) \
+                               in counts[iId].iteritems()))
+            if not sig in groups:
+                groups[sig] = len(self.grpLbls)
+                self.grpLbls.append(sig)
+                grpSize.append(0)
+            self.imgGrp[iId] = groups[sig]
+            grpSize[groups[sig]] += 1
+        self.grpSize = array(grpSize, dtype=float)
+        # (group, label, count) triplets of each worker
+        self.wkrGrpLbls = dict((id, []) for id in range(self.numWkrs))
+        for (g, sig) in enumerate(self.grpLbls):
+            for (wId, lij, n) in sig:
+                self.wkrGrpLbls[wId].append((g, lij, n))
+
     def _setup_prior(self):
+        from scipy.stats import beta
         n = self.mdlPrm['res']
         ajs = linspace(1e-10, 1.-1e-10, n)
         aj0, aj1 = meshgrid(ajs, ajs); aj0=aj0.flatten(); aj1=aj1.flatten()
@@ -106,7 +169,7 @@ class BinaryBiasModel(BinaryModel):
         self.imgPrm = [[r] for r in raw]
 
     def get_model_param(self):
-        return {}
+        return dict(self.mdlPrm)
 
     def get_worker_param_raw(self):
         return array(self.wkrPrm).flatten().tolist()
@@ -123,20 +186,21 @@ class BinaryBiasModel(BinaryModel):
     def get_labels(self):
         return [int(p[0]>0.5) for p in self.imgPrm]
     
-    # TODO: load and save parameters
-
     def optimize_worker_param(self):
-        for (wId, labels) in self.wkrLbls.iteritems():
+        # sums of the posteriors of the images of each group
+        p1 = array([p[0] for p in self.imgPrm], dtype=float)
+        s1 = bincount(self.imgGrp, weights=p1, minlength=len(self.grpLbls))
+        s0 = self.grpSize - s1
+        for (wId, labels) in self.wkrGrpLbls.iteritems():
             n = [[0.0, 0.0], [0.0, 0.0]] # [gt, label]
             # count no. of false alarms etc
-            for (iId, lij) in self.wkrLbls[wId]:
-                p1 = self.imgPrm[iId][0]
+            for (g, lij, cnt) in labels:
                 if lij==True:
-                    n[1][1] += p1
-                    n[0][1] += (1.-p1)
+                    n[1][1] += cnt*s1[g]
+                    n[0][1] += cnt*s0[g]
                 else:
-                    n[1][0] += p1
-                    n[0][0] += (1.-p1)
+                    n[1][0] += cnt*s1[g]
+                    n[0][0] += cnt*s0[g]
             # TODO PRIOR HERE
             opt = n[0][0]*log(self.prior['aj0']) + \
               n[0][1]*log(1.-self.prior['aj0']) + \
@@ -149,15 +213,16 @@ class BinaryBiasModel(BinaryModel):
 
     def optimize_image_param(self):
         pz1 = self.mdlPrm['pz1']
-        newPrm = log10(pz1/(1-pz1))*ones(self.numImgs)
-        for (iId, wId, lij) in self.labels:
-            aj = self.wkrPrm[wId]
-            if lij==True:
-                newPrm[iId] += log10(aj[1]/(1.-aj[0]))
-            else:
-                newPrm[iId] += log10((1.-aj[1])/aj[0])
-        R = 10.**newPrm
-        newPrm = R/(1.+R)
+        grpPrm = log10(pz1/(1-pz1))*ones(len(self.grpLbls))
+        for (g, sig) in enumerate(self.grpLbls):
+            for (wId, lij, cnt) in sig:
+                aj = self.wkrPrm[wId]
+                if lij==True:
+                    grpPrm[g] += cnt*log10(aj[1]/(1.-aj[0]))
+                else:
+                    grpPrm[g] += cnt*log10((1.-aj[1])/aj[0])
+        R = 10.**grpPrm
+        newPrm = (R/(1.+R))[self.imgGrp]
         self.imgPrm = [[p] for p in newPrm]
 
     def objective(self, prm=None):
@@ -181,22 +246,48 @@ class BinaryBiasModel(BinaryModel):
     def image_gradient(self, prm=None):
         pass
 
+    def label_loglik(self, labels, numThreads=0):
+        """
+        Returns the log-likelihood of each of an N x 3 array of (image id,
+        worker id, label) rows, with the class of the image marginalized
+        over its posterior (`numThreads` is unused).
+        """
+        labels = array(labels, dtype=int).reshape((-1, 3))
+        label_array_size(labels, self.numImgs, self.numWkrs)
+        p1 = array([p[0] for p in self.imgPrm], dtype=float)[labels[:,0]]
+        # probabilities of a correct label for class 1 and class 0 images
+        a1, a0 = self.wkrPrm[labels[:,1],0], self.wkrPrm[labels[:,1],1]
+        pl1 = p1*a1 + (1.-p1)*(1.-a0)
+        return log(where(labels[:,2]==1, pl1, 1.-pl1))
+
+    def get_image_labels(self, imgId):
+        """
+        Returns the worker ids and the labels of the labels of image
+        `imgId` as two arrays.
+        """
+        lbls = array(self.imgLbls[imgId], dtype=int).reshape((-1, 2))
+        return (lbls[:,0], lbls[:,1])
+
     def get_num_wkr_lbls(self):
         return [len(self.wkrLbls[id]) for id in range(self.numWkrs)]
 
     def get_num_img_lbls(self):
         return [len(self.imgLbls[id]) for id in range(self.numImgs)]
 
+    # worker skill groups used when sampling worker parameters
+    wkrGrps =  {
+        'expert' : [.95, .95],
+        'good' : [.7, .7],
+        'bot' : [.5, .5],
+        'adversary' : [.1, .1] 
+    }
+    wkrGrpDist = [.1, .6, .29, .01]
+    sklNms = ['expert', 'good', 'bot', 'adversary']
+
     def sample_worker_param(self, numWkr, sklName=None):
         wkrPrm = []
-        wkrGrps =  {
-            'expert' : [.95, .95],
-            'good' : [.7, .7],
-            'bot' : [.5, .5],
-            'adversary' : [.1, .1] 
-        }
-        wkrGrpDist = [.1, .6, .29, .01]
-        sklNms = ['expert', 'good', 'bot', 'adversary']
+        wkrGrps, wkrGrpDist = self.wkrGrps, self.wkrGrpDist
+        sklNms = self.sklNms
         for wIdx in range(numWkr):
             if not sklName:
                 sklIdx = int(nonzero(multinomial(1, wkrGrpDist))[0])
@@ -221,3 +312,35 @@ class BinaryBiasModel(BinaryModel):
             return [rand() < wkrPrm[1]]
         else:
             return [rand() > wkrPrm[0]]
+
+    def sample_worker_param_array(self, numWkr, sklName=None, rng=None):
+        """
+        Vectorized version of `sample_worker_param`, returns a numWkr x 2
+        array.
+        """
+        rng = make_rng(rng)
+        grpPrm = array([self.wkrGrps[nm] for nm in self.sklNms])
+        if sklName:
+            sklIdx = self.sklNms.index(sklName)*ones(numWkr, int)
+        else:
+            sklIdx = rng.choice(len(self.sklNms), numWkr, p=self.wkrGrpDist)
+        return grpPrm[sklIdx]
+
+    def sample_image_param_array(self, numImg, rng=None):
+        """
+        Vectorized version of `sample_image_param`, returns a numImg x 1
+        array.
+        """
+        rng = make_rng(rng)
+        zi = (rng.rand(numImg)<self.mdlPrm['pz1']).astype(float)
+        return zi.reshape((numImg, 1))
+
+    def sample_label_array(self, wkrPrm, imgPrm, imgIdx, wkrIdx, rng=None):
+        """
+        Vectorized version of `sample_label`, samples a label for each pair
+        of image and worker indices into the parameter arrays.
+        """
+        rng = make_rng(rng)
+        r = rng.rand(len(imgIdx))
+        return where(imgPrm[imgIdx,0] > 0.5, r < wkrPrm[wkrIdx,1],
+                     r > wkrPrm[wkrIdx,0])
@@ -1,7 +1,7 @@
 from BinaryModel import *
 from Binary1dSignalModel import Binary1dSignalModel
-from numpy import sign, mod, sin, cos, dot
-from utils import tw2tsw
+from numpy import sign, mod, sin, cos, dot, where, column_stack
+from utils import tw2tsw, make_rng, randtn_array
 
 class BinaryNdSignalModel(BinaryModel):
     def __init__(self, filename=None, dim=2):
@@ -14,36 +14,27 @@ class BinaryNdSignalModel(BinaryModel):
         prm['dim'] = int(prm['dim'])
         return prm
 
-    def load_data(self, filename, skipyaml=False):
-        Model.load_data(self, filename, skipyaml)
-        self._dataFile = filename
-
-    def image_objective_range(self, imgId, prm):
-        pass
-    
-    def worker_objective_range(self, wkrId, prm=None, wj=None, tj=None):
-        pass
-
     def get_worker_param(self, id=None):
-        prm = self.get_worker_param_raw()
-        dim = self.get_model_param()['dim']
+        prm = self._param_view('worker')
+        dim = self._get_dim()
         nwkrs = len(prm)/(1+dim)
         offset = nwkrs*dim
         if id is None:
-            return dict((id, prm[dim*id:dim*(id+1)]+[prm[offset+id]]) \
-              for id in range(nwkrs))
+            return dict(enumerate(column_stack(
+              [prm[:offset].reshape((nwkrs, dim)), prm[offset:]]).tolist()))
         else:
-            return prm[dim*id:dim*(id+1)]+[prm[offset+id]]
+            return prm[dim*id:dim*(id+1)].tolist()+[float(prm[offset+id])]
 
     def get_image_param(self, id=None):
-        prm = self.get_image_param_raw()
-        dim = self.get_model_param()['dim']
-        nimgs = len(prm)/dim
+        prm = self._param_view('image')
+        dim = self._get_dim()
         if id is None:
-            return dict((id, prm[dim*id:dim*(id+1)]) \
-              for id in range(nimgs))
+            return dict(enumerate(prm.reshape((-1, dim)).tolist()))
         else:
-            return prm[dim*id:dim*(id+1)]
+            return prm[dim*id:dim*(id+1)].tolist()
+
+    def _get_dim(self):
+        return int(self._param_view('model')[self._mdlPrmList.index('dim')])
 
     def get_worker_var(self, wkrId):
         pass
@@ -94,6 +85,52 @@ class BinaryNdSignalModel(BinaryModel):
         tj1, sj, wj1 = self.tw2tsw(tj, wj)
         return [bool(dot(xi+randn(dim)*sj,wj1) > tj1)]
 
+    def sample_worker_param_array(self, numWkr, tjPrior=0.8, angle=.3,
+                                  sigPrior=[1.5, .3], sigThresh=[.05, 3.],
+                                  tjThresh=[-1.5, 1.5], wjPrior=[2.0, 1.0],
+                                  rng=None):
+        """
+        Vectorized version of `sample_worker_param`, returns a
+        numWkr x (dim+1) array of (wj, tj) rows.
+        """
+        rng = make_rng(rng)
+        dim = self.get_model_param()['dim']
+        if dim==2:
+            # sample angle centered at 45 degrees
+            sj = rng.gamma(sigPrior[0], sigPrior[1], numWkr)
+            sj = sj.clip(*sigThresh)
+            a = pi/4+rng.randn(numWkr)*angle
+            wj = column_stack([sin(a)/sj, cos(a)/sj])
+        else:
+            wj = rng.randn(numWkr, dim)*wjPrior[1]+wjPrior[0]
+        tj = randtn_array(numWkr, tjThresh[0], tjThresh[1], rng)*tjPrior \
+          * sqrt((wj**2).sum(1))
+        return column_stack([wj, tj])
+
+    def sample_image_param_array(self, numImg, beta=.5, theta=.8, rng=None):
+        """
+        Vectorized version of `sample_image_param`, returns a numImg x dim
+        array.
+        """
+        rng = make_rng(rng)
+        dim = self.get_model_param()['dim']
+        xis = rng.randn(numImg, dim)*theta
+        xis += where(rng.rand(numImg)<beta, 1., -1.).reshape((numImg, 1))
+        return xis
+
+    def sample_label_array(self, wkrPrm, imgPrm, imgIdx, wkrIdx, rng=None):
+        """
+        Vectorized version of `sample_label`, samples a label for each pair
+        of image and worker indices into the parameter arrays.
+        """
+        rng = make_rng(rng)
+        dim = imgPrm.shape[1]
+        wj = wkrPrm[wkrIdx,:dim]; tj = wkrPrm[wkrIdx,dim]
+        xi = imgPrm[imgIdx]
+        sj = 1./sqrt((wj**2).sum(1))
+        xi = xi + rng.randn(*xi.shape)*sj.reshape((len(sj), 1))
+        return (xi*wj).sum(1)*sj > tj*sj
+
     def tw2tsw(self, tj, wj):
         """
         Converts from the (tj, wj) convention to (tj, sj, wj).
@@ -107,7 +144,8 @@ class BinaryNdSignalModel(BinaryModel):
         """
         dim = self.get_model_param()['dim']
         assert dim==2, "Only works when dimension is 2."
-        m = Binary1dSignalModel(filename=self._dataFile)
+        m = Binary1dSignalModel()
+        m.attach_labels(self.get_label_store())
         m.optimize_param()
         # set image parameters
         imgPrm = m.get_image_param(); numImg = len(imgPrm)
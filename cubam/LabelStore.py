@@ -0,0 +1,102 @@
+import os
+from numpy import zeros, intc, ascontiguousarray
+from ctypes import c_char_p, c_int, POINTER
+from annmodel import annmodel
+from utils import label_array_size
+
+# label storage layouts of the C++ library (see `Model.set_label_storage`)
+LABEL_STORAGE = ['default', 'compact', 'weighted']
+
+class LabelStore:
+  """
+  Labels loaded once by the C++ library, which any number of models can be
+  attached to (see `Model.attach_labels`).
+
+  The signal models use the labels of the store in place, while the Python
+  models (`BinaryBiasModel`, `MajorityModel`) index a copy of them, so that
+  a chain of models fitted to the same data only reads it once. The
+  parameters stay with each model. The store counts its references, and
+  the labels are freed once the store and all models attached to it are
+  deleted.
+  """
+  def __init__(self, filename=None, storage='default', sPtr=None):
+    """
+    Arguments:
+      - `filename`: [None] data file to load
+      - `storage`: ['default'] label storage, see `Model.set_label_storage`
+      - `sPtr`: [None] existing store in the library to take a reference to
+    """
+    if sPtr is None:
+      assert storage in LABEL_STORAGE, \
+        "Storage must be one of %s" % ', '.join(LABEL_STORAGE)
+      sPtr = annmodel.new_label_store(LABEL_STORAGE.index(storage))
+    else:
+      annmodel.retain_label_store(sPtr)
+    self.sPtr = sPtr
+    self.wkrIds = {}
+    self.imgIds = {}
+    if filename:
+      self.load_data(filename)
+
+  def __del__(self):
+    annmodel.release_label_store(self.sPtr)
+
+  @classmethod
+  def from_model(cls, model):
+    """
+    Returns a handle to the labels of a signal model.
+    """
+    sPtr = annmodel.get_label_store(model.mPtr)
+    assert sPtr, "Model has no data loaded"
+    store = cls(sPtr=sPtr)
+    store.imgIds = model.imgIds
+    store.wkrIds = model.wkrIds
+    return store
+
+  def load_data(self, filename, skipyaml=False):
+    """
+    Loads the labels of a data file, see `Model.load_data` (which raises
+    the same errors).
+    """
+    yamlfile = "%s.yaml" % filename[:-4]
+    if filename[-4:]=='.txt' and os.path.exists(yamlfile) and not skipyaml:
+      import yaml
+      prm = yaml.load(open(yamlfile))
+      self.imgIds = prm['imgIds']
+      self.wkrIds = prm['wkrIds']
+    annmodel.label_store_load_data(self.sPtr, c_char_p(filename))
+
+  def load_data_array(self, labels, numImgs=None, numWkrs=None):
+    """
+    Loads the labels from an N x 3 array of (image id, worker id, label)
+    rows, see `Model.load_data_array`.
+    """
+    labels = ascontiguousarray(labels, dtype=intc).reshape((-1, 3))
+    numImgs, numWkrs = label_array_size(labels, numImgs, numWkrs)
+    annmodel.label_store_load_data_array(self.sPtr, numImgs, numWkrs,
+      len(labels), labels.ctypes.data_as(POINTER(c_int)))
+
+  def load_data_mapped(self, storeFile):
+    """
+    Maps the labels of a label store file, see `Model.load_data_mapped`.
+    """
+    annmodel.label_store_load_data_mapped(self.sPtr, c_char_p(storeFile))
+
+  def get_num_wkrs(self):
+    return annmodel.label_store_get_num_wkrs(self.sPtr)
+
+  def get_num_imgs(self):
+    return annmodel.label_store_get_num_imgs(self.sPtr)
+
+  def get_num_lbls(self):
+    return annmodel.label_store_get_num_lbls(self.sPtr)
+
+  def get_label_array(self):
+    """
+    Returns the labels as an N x 3 array of (image id, worker id, label)
+    rows.
+    """
+    labels = zeros((self.get_num_lbls(), 3), dtype=intc)
+    annmodel.label_store_get_label_array(self.sPtr,
+      labels.ctypes.data_as(POINTER(c_int)))
+    return labels
@@ -1,5 +1,6 @@
 from BinaryModel import *
 from numpy.random import rand
+from utils import label_array_size
 
 class MajorityModel(BinaryModel):
     def __init__(self, filename=None):
@@ -8,10 +9,9 @@ class MajorityModel(BinaryModel):
         }
         self.wkrIds = {}
         self.imgIds = {}
+        self.numImgs = self.numWkrs = self.numLbls = 0
         if filename:
             self.load_data(filename)
-        else:
-            self._setup_prior()    
     
     def __del__(self):
         pass
@@ -24,17 +24,41 @@ class MajorityModel(BinaryModel):
         # load the text data
         filein = open(filename)
         info = filein.readline().rstrip().split(' ')
-        self.numLbls = int(info[2])
-        self.numWkrs = int(info[1])
-        self.numImgs = int(info[0])
+        rows = [[int(c) for c in line.rstrip().split(' ')] \
+                for line in filein]
+        self._index_labels(rows, int(info[0]), int(info[1]))
+
+    def load_data_array(self, labels, numImgs=None, numWkrs=None):
+        """
+        Loads the labels from an N x 3 array of (image id, worker id,
+        label) rows rather than from a data file.
+        """
+        labels = array(labels, dtype=int).reshape((-1, 3))
+        numImgs, numWkrs = label_array_size(labels, numImgs, numWkrs)
+        self._index_labels(labels.tolist(), numImgs, numWkrs)
+
+    def attach_labels(self, store):
+        """
+        Indexes the labels of a `LabelStore`, which saves reading and parsing
+        the data again (unlike the signal models, this model keeps its own
+        copy of the labels).
+        """
+        self.load_data_array(store.get_label_array(), store.get_num_imgs(),
+                             store.get_num_wkrs())
+        self.imgIds = store.imgIds
+        self.wkrIds = store.wkrIds
+
+    def _index_labels(self, rows, numImgs, numWkrs):
+        self.numLbls = len(rows)
+        self.numWkrs = numWkrs
+        self.numImgs = numImgs
         self.imgPrm = []
         for i in range(self.numImgs):
             self.imgPrm.append([0, 0]) # (frac +ve votes, total n votes)
         self.wkrLbls = dict((id, []) for id in range(self.numWkrs))
         self.imgLbls = dict((id, []) for id in range(self.numImgs))
         self.labels = []
-        for (lino, line) in enumerate(filein):
-            cols = [int(c) for c in line.rstrip().split(' ')]
+        for cols in rows:
             iId = cols[0]; wId = cols[1]; lij = int(cols[2]==1)
             self.wkrLbls[wId].append([iId, lij])
             self.imgLbls[iId].append([wId, lij])
@@ -43,7 +67,8 @@ class MajorityModel(BinaryModel):
             self.imgPrm[iId][1] += 1
         # renormalize img prm
         for i in range(len(self.imgPrm)):
-            self.imgPrm[i][0] = float(self.imgPrm[i][0])/self.imgPrm[i][1]
+            if self.imgPrm[i][1] > 0:
+                self.imgPrm[i][0] = float(self.imgPrm[i][0])/self.imgPrm[i][1]
 
     def get_num_wkrs(self):
         return self.numWkrs
@@ -73,10 +98,10 @@ class MajorityModel(BinaryModel):
         self.imgPrm = [r for r in raw]
 
     def get_model_param(self):
-        return {}
+        return dict(self.mdlPrm)
 
     def get_worker_param_raw(self):
-        return {}
+        return []
 
     def get_image_param_raw(self):
         return [p for p in self.imgPrm]
@@ -95,8 +120,6 @@ class MajorityModel(BinaryModel):
             return [int(self.imgPrm[i][0]>.5) for i \
                     in range(len(self.imgPrm))]
 
-    # TODO: load and save parameters
-
     def optimize_worker_param(self):
         pass
 
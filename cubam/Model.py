@@ -1,12 +1,33 @@
-import os
-import yaml
+import os, time
 from numpy import array, linspace, meshgrid, concatenate, reshape, exp, \
-  sqrt, max, zeros, log, argmax, pi, tile, r_, ceil, floor, isnan, isinf
+  sqrt, max, zeros, log, argmax, pi, tile, r_, ceil, floor, isnan, isinf, \
+  ascontiguousarray, intc, asarray
 from numpy.random import rand, randn, gamma
-from scipy.optimize import fmin_slsqp, fmin_l_bfgs_b
 from ctypes import CDLL, c_char_p, c_void_p, c_double, c_int, cast, POINTER
 from annmodel import annmodel
-from utils import randtn, write_data_file
+from utils import randtn, write_data_file, label_array_size, \
+  save_state_file, load_state_file
+from LabelStore import LabelStore, LABEL_STORAGE
+
+# names of the kernels instrumented in the C++ library, in the order they
+# appear in the vector returned by `get_stats` in the library
+STAT_KERNELS = ['objective', 'gradient', 'worker_objective',
+                'image_objective', 'load_data', 'label_loglik']
+STAT_FIELDS = ['calls', 'labels', 'ns']
+
+def build_label_store(dataFile, storeFile):
+  """
+  Writes the labels of a data file to a label store file for
+  `Model.load_data_mapped`.
+
+  The store holds the labels sorted by image and by worker, packed as in the
+  compact label storage, and is written through a memory map in two passes
+  over the data file, so the labels never have to fit in memory.
+
+  Raises `IOError` if a file cannot be read or written, and `ValueError`
+  if the data file is malformed (see `Model.load_data`).
+  """
+  annmodel.build_label_store(c_char_p(dataFile), c_char_p(storeFile))
 
 ## main model class
 class Model:
@@ -18,6 +39,9 @@ class Model:
     self.mPtr = annmodel.setup_model(c_char_p(className))
     self.wkrIds = {}
     self.imgIds = {}
+    self._prmCache = {}
+    self._termWeights = (1.0, 1.0, 1.0)
+    self._reset_lib_stats()
     if filename:
       self.load_data(filename)
     elif not data is None:
@@ -28,15 +52,118 @@ class Model:
   def __del__(self):
     annmodel.clear_model(self.mPtr)
     
+  def set_label_storage(self, storage):
+    """
+    Sets how the labels are stored in memory, must be called before the
+    data is loaded.
+
+    Arguments:
+      - `storage`: `'default'` keeps (image, worker, label) triplets as well
+        as per image and per worker lists, while `'compact'` only keeps the
+        per image and per worker lists with the label bit packed into the
+        id, using 1, 2 or 4 bytes per entry depending on the no. of images
+        and workers. The compact storage needs less than a third of the
+        memory of the default one. `'weighted'` collapses duplicate (image,
+        worker, label) triplets into one entry with a count, which the
+        objective and gradient weight their terms by, so that repeated
+        labels are evaluated once (with the same results as the default).
+    """
+    assert storage in LABEL_STORAGE, \
+      "Storage must be one of %s" % ', '.join(LABEL_STORAGE)
+    annmodel.set_label_storage(self.mPtr, LABEL_STORAGE.index(storage))
+
   def load_data(self, filename, skipyaml=False):
+    """
+    Loads the labels of a data file, along with the image and worker ids
+    of the .yaml file next to it (unless `skipyaml`).
+
+    Raises `IOError` if the file cannot be read, and `ValueError` if it has
+    a malformed line, a label with an image or worker id out of range, or a
+    no. of labels that differs from its header.
+    """
     yamlfile = "%s.yaml" % filename[:-4]
     if filename[-4:]=='.txt' and os.path.exists(yamlfile) and not skipyaml:
+      import yaml
       prm = yaml.load(open(yamlfile))
       self.imgIds = prm['imgIds']
       self.wkrIds = prm['wkrIds']
     filename = c_char_p(filename)
     annmodel.load_data(self.mPtr, filename)
+    self._clear_param_cache()
+
+  def load_data_array(self, labels, numImgs=None, numWkrs=None):
+    """
+    Loads the labels from an array rather than from a data file.
+
+    Arguments:
+      - `labels`: N x 3 array of (image id, worker id, label) rows
+      - `numImgs`: no. of images (defaults to the largest image id+1)
+      - `numWkrs`: no. of workers (defaults to the largest worker id+1)
+    """
+    labels = ascontiguousarray(labels, dtype=intc).reshape((-1, 3))
+    numImgs, numWkrs = label_array_size(labels, numImgs, numWkrs)
+    annmodel.load_data_array(self.mPtr, numImgs, numWkrs, len(labels),
+                             labels.ctypes.data_as(POINTER(c_int)))
+    self._clear_param_cache()
     
+  def load_data_mapped(self, storeFile):
+    """
+    Uses the labels of a label store file (see `build_label_store`) in
+    place, so that only the parameters are held in memory. The objective
+    and gradient stream over the memory-mapped labels, reading ahead of
+    the scan, and the store is unmapped when the model is deleted.
+    """
+    annmodel.load_data_mapped(self.mPtr, c_char_p(storeFile))
+    self._clear_param_cache()
+
+  def attach_labels(self, store):
+    """
+    Uses the labels of a `LabelStore` rather than loading data, without
+    copying them, so that any number of models can share one load.
+    """
+    annmodel.attach_label_store(self.mPtr, store.sPtr)
+    self._clear_param_cache()
+    self.imgIds = store.imgIds
+    self.wkrIds = store.wkrIds
+
+  def clear_data(self):
+    """
+    Frees the labels of the model (or drops its reference to a shared
+    store) along with its parameters, after which data can be loaded again.
+    """
+    annmodel.clear_data(self.mPtr)
+    self._clear_param_cache()
+
+  def get_label_store(self):
+    """
+    Returns a `LabelStore` holding the labels of the model, which other
+    models can be attached to.
+    """
+    return LabelStore.from_model(self)
+
+  def get_label_array(self):
+    """
+    Returns the loaded labels as an N x 3 array of (image id, worker id,
+    label) rows.
+    """
+    labels = zeros((self.get_num_lbls(), 3), dtype=intc)
+    annmodel.get_label_array(self.mPtr, labels.ctypes.data_as(POINTER(c_int)))
+    return labels
+
+  def get_image_labels(self, imgId):
+    """
+    Returns the worker ids and the labels of the labels of image `imgId`
+    as two arrays, read from the per-image label index of the library.
+    """
+    assert 0 <= imgId < self.get_num_imgs(), \
+      "Image id must be in the range of the %d images" % self.get_num_imgs()
+    n = annmodel.get_image_num_lbls(self.mPtr, imgId)
+    wkrIds, labels = zeros(n, dtype=intc), zeros(n, dtype=intc)
+    annmodel.get_image_labels(self.mPtr, imgId,
+      wkrIds.ctypes.data_as(POINTER(c_int)),
+      labels.ctypes.data_as(POINTER(c_int)))
+    return (wkrIds, labels)
+
   def get_num_wkrs(self):
     return annmodel.get_num_wkrs(self.mPtr)
     
@@ -78,22 +205,62 @@ class Model:
       "Raw parameter vector must be of length %d" % plen
     self._lib_set_vec('set_image_param', c_double, raw)
     
+  def set_term_weights(self, labels=1.0, imagePrior=1.0, workerPrior=1.0):
+    """
+    Sets the weights of the terms of the objective and its gradient.
+
+    Arguments:
+      - `labels`: weight of the label likelihood terms
+      - `imagePrior`: weight of the image parameter prior
+      - `workerPrior`: weight of the worker parameter prior
+    """
+    self._lib_set_vec('set_term_weights', c_double,
+                      [labels, imagePrior, workerPrior])
+    self._termWeights = (float(labels), float(imagePrior),
+                         float(workerPrior))
+
+  def get_term_weights(self):
+    """
+    Returns the weights of the label, image prior and worker prior terms
+    set by `set_term_weights` (all 1 by default).
+    """
+    return self._termWeights
+
   def get_model_param(self):
-    plen = annmodel.get_model_param_len(self.mPtr)
-    vec = self._lib_get_vec('get_model_param', c_double, plen)
+    vec = self._param_view('model')
     prm = {}
-    for i in range(plen):
+    for i in range(len(vec)):
       key = self._mdlPrmList[i]
-      prm[key] = vec[i]
+      prm[key] = float(vec[i])
     return prm
   
   def get_worker_param_raw(self):
-    plen = annmodel.get_worker_param_len(self.mPtr)
-    return self._lib_get_vec('get_worker_param', c_double, plen)
+    return self._param_view('worker').tolist()
   
   def get_image_param_raw(self):
-    plen = annmodel.get_image_param_len(self.mPtr)
-    return self._lib_get_vec('get_image_param', c_double, plen)
+    return self._param_view('image').tolist()
+
+  def _param_view(self, kind):
+    """
+    Returns a read-only array of the 'model', 'worker' or 'image'
+    parameters. It is copied from the library once and kept until the
+    parameters are set or new data is loaded, so that accessing single
+    entries does not copy the whole vector.
+    """
+    vec = self._prmCache.get(kind)
+    if vec is None:
+      t0 = time.time()
+      plen = getattr(annmodel, 'get_%s_param_len' % kind)(self.mPtr)
+      vec = zeros(plen)
+      getattr(annmodel, 'get_%s_param' % kind)(self.mPtr,
+        vec.ctypes.data_as(POINTER(c_double)))
+      vec.setflags(write=False)
+      self._prmCache[kind] = vec
+      self._record_lib_call('lib_get_vec', plen, time.time()-t0)
+    return vec
+
+  def _clear_param_cache(self):
+    self._prmCache = {}
     
   def get_worker_param(self, id=None):
     pass
@@ -101,9 +268,96 @@ class Model:
   def get_image_param(self, id=None):
     pass
   
-  # TODO: load and save parameters
+  def get_stats(self):
+    """
+    Returns the instrumentation counters of the model.
+
+    The result is a dictionary with an entry for each kernel in
+    `STAT_KERNELS` holding the number of calls, labels processed and
+    nanoseconds spent in the library, the number of bytes allocated by
+    `load_data` (as `load_bytes`), the number of bytes of label store
+    mapped by `load_data_mapped` (as `mapped_bytes`), and the Python-side
+    calls, number of values copied and nanoseconds spent in
+    `_lib_get_vec`/`_lib_set_vec` (note that the latter include the time
+    of the library call itself).
+    """
+    slen = annmodel.get_stats_len(self.mPtr)
+    vec = cast((slen*c_double)(), POINTER(c_double))
+    annmodel.get_stats(self.mPtr, vec)
+    nfld = len(STAT_FIELDS)
+    stats = {}
+    for (k, kernel) in enumerate(STAT_KERNELS):
+      stats[kernel] = dict((fld, vec[k*nfld+f]) \
+                           for (f, fld) in enumerate(STAT_FIELDS))
+    stats['load_bytes'] = vec[slen-2]
+    stats['mapped_bytes'] = vec[slen-1]
+    for (fname, stat) in self._libStats.iteritems():
+      stats[fname] = dict(stat)
+    return stats
+
+  def reset_stats(self):
+    """
+    Resets all instrumentation counters of the model.
+    """
+    annmodel.reset_stats(self.mPtr)
+    self._reset_lib_stats()
+
+  def save_state(self, filename):
+    """
+    Saves the model, worker and image parameters and the id mappings to a
+    binary state file (see `utils.save_state_file`).
+    """
+    header = {
+      'model' : self.__class__.__name__,
+      'mdlPrm' : self.get_model_param(),
+      'numImgs' : self.get_num_imgs(),
+      'numWkrs' : self.get_num_wkrs(),
+      'imgIds' : self.imgIds,
+      'wkrIds' : self.wkrIds,
+    }
+    arrays = {
+      'worker' : asarray(self.get_worker_param_raw(), dtype=float),
+      'image' : asarray(self.get_image_param_raw(), dtype=float),
+    }
+    save_state_file(filename, header, arrays)
+
+  def load_state(self, filename, mmap=True):
+    """
+    Restores the parameters saved by `save_state`.
+
+    If the model has data loaded, the saved state must match its number of
+    images and workers, and the parameters can be used as a warm start for
+    `optimize_param`. Otherwise, an empty data set of the saved size is
+    loaded so that the fitted parameters can be queried.
+
+    Arguments:
+      - `filename`: state file to load
+      - `mmap`: memory-map the parameter arrays when reading them
+    """
+    header, arrays = load_state_file(filename, mmap)
+    assert header['model'] == self.__class__.__name__, \
+      "State file holds a %s, not a %s" % (header['model'],
+                                           self.__class__.__name__)
+    if self.get_num_imgs() == 0 and self.get_num_wkrs() == 0:
+      self.set_model_param(prm=header['mdlPrm'])
+      self.load_data_array(zeros((0, 3), dtype=int), header['numImgs'],
+                           header['numWkrs'])
+    else:
+      assert self.get_num_imgs() == header['numImgs'] and \
+        self.get_num_wkrs() == header['numWkrs'], \
+        "State file does not match the size of the loaded data"
+      assert len(arrays['image']) == len(self.get_image_param_raw()) and \
+        len(arrays['worker']) == len(self.get_worker_param_raw()), \
+        "State file does not match the dimension of the model"
+      self.set_model_param(prm=header['mdlPrm'])
+    self.set_worker_param(arrays['worker'])
+    self.set_image_param(arrays['image'])
+    self.imgIds = header['imgIds']
+    self.wkrIds = header['wkrIds']
   
   def optimize_worker_param(self):
+    # SciPy is imported on first use, which keeps `import cubam` fast
+    from scipy.optimize import fmin_l_bfgs_b
     x0 = array(self.get_worker_param_raw())
     # res = fmin_slsqp(self.worker_objective, x0,
     #                  fprime=self.worker_gradient,
@@ -115,6 +369,7 @@ class Model:
     return res
   
   def optimize_image_param(self):
+    from scipy.optimize import fmin_l_bfgs_b
     MAX_RESAMPLE_TRIES = 10
     for trial in range(MAX_RESAMPLE_TRIES):
         grad = self.image_gradient()
@@ -132,12 +387,60 @@ class Model:
     self.set_image_param(res[0])
     return res
   
-  def optimize_param(self, numIter=30, options=None, verbose=False):
+  def optimize_param(self, numIter=30, options=None, verbose=False,
+                     numShards=None, cache=None, screen=None):
+    """
+    Alternates between optimizing the image and the worker parameters.
+
+    Arguments:
+      - `numIter`: no. of alternations
+      - `options`: unused
+      - `verbose`: print progress
+      - `numShards`: if set, split the labels by worker across this many
+        local processes (see `sharded.optimize_param_sharded`)
+      - `cache`: if set, a `cache.FitCache` the fitted parameters are
+        loaded from, or saved to after fitting
+      - `screen`: if set, the weight below which workers are screened out
+        of the alternations (see `screening.optimize_param_screened`),
+        returning the mask of the screened workers
+    """
+    if not cache is None:
+      # sharded and screened fits differ from serial ones, so they are
+      # cached apart (and serial fits keep their keys)
+      fitPrm = { 'numIter' : numIter }
+      if numShards: fitPrm['numShards'] = numShards
+      if not screen is None: fitPrm['screen'] = screen
+      return cache.fit(self, fitPrm, lambda:
+                       self.optimize_param(numIter, options, verbose,
+                                           numShards, screen=screen))
+    if numShards:
+      from sharded import optimize_param_sharded
+      return optimize_param_sharded(self, numShards, numIter, verbose)
+    if not screen is None:
+      from screening import optimize_param_screened
+      return optimize_param_screened(self, numIter, screen, verbose=verbose)
     for n in range(numIter):
       if verbose: print "  - iteration %d/%d" % (n+1, numIter)
       self.optimize_image_param()
       self.optimize_worker_param()
-  
+
+  def optimize_param_stochastic(self, numEpochs=5, batchSize=100000,
+                                **kwargs):
+    """
+    Optimizes the image and worker parameters from minibatches of images
+    and their labels, which scales to far more labels than
+    `optimize_param` (see `stochastic.optimize_param_stochastic` for the
+    other arguments).
+
+    Arguments:
+      - `numEpochs`: max. no. of passes over the minibatches
+      - `batchSize`: approx. no. of labels per minibatch
+
+    Returns the held out negative log-likelihood per label of each epoch.
+    """
+    from stochastic import optimize_param_stochastic
+    return optimize_param_stochastic(self, numEpochs, batchSize, **kwargs)
+
   def objective(self, prm=None):
     n = annmodel.get_image_param_len(self.mPtr)
     if not prm is None:
@@ -154,10 +457,53 @@ class Model:
     return annmodel.objective(self.mPtr)
     
   def image_objective_range(self, imgId, prm):
-    pass
-  
+    """
+    Returns the objective of image `imgId` for each of a list of image
+    parameters (concatenated in the layout of `get_image_param_raw`), along
+    with the parameters.
+    """
+    return (self.image_objective_batch([imgId], prm)[0], prm)
+
   def worker_objective_range(self, wkrId, prm):
-    pass
+    """
+    Returns the objective of worker `wkrId` for each of a list of worker
+    parameters (in the layout of `get_worker_param_raw`), along with the
+    parameters.
+    """
+    return (self.worker_objective_batch([wkrId], prm)[0], prm)
+
+  def image_objective_batch(self, imgIds, prm, numThreads=0):
+    """
+    Evaluates `image_objective_range` on the same parameters for an array
+    of images in one call, spread over `numThreads` threads (one per core
+    if 0). Returns a (no. of images) x (no. of parameters) array.
+    """
+    return self._objective_batch(annmodel.image_objective_batch, imgIds,
+      prm, annmodel.get_image_param_len(self.mPtr), self.get_num_imgs(),
+      numThreads)
+
+  def worker_objective_batch(self, wkrIds, prm, numThreads=0):
+    """
+    Evaluates `worker_objective_range` on the same parameters for an array
+    of workers in one call, see `image_objective_batch`.
+    """
+    return self._objective_batch(annmodel.worker_objective_batch, wkrIds,
+      prm, annmodel.get_worker_param_len(self.mPtr), self.get_num_wkrs(),
+      numThreads)
+
+  def _objective_batch(self, fn, ids, prm, totalLen, num, numThreads):
+    # totalLen parameters over num images or workers
+    ids = ascontiguousarray(ids, dtype=intc).ravel()
+    prm = ascontiguousarray(prm, dtype=float).ravel()
+    assert len(ids) == 0 or (ids.min() >= 0 and ids.max() < num), \
+      "Ids must be in the range of the %d images or workers" % num
+    nout = len(prm)/(totalLen/num) if num > 0 else 0
+    obj = zeros((len(ids), nout))
+    if len(ids) == 0: return obj
+    fn(self.mPtr, len(ids), ids.ctypes.data_as(POINTER(c_int)),
+       prm.ctypes.data_as(POINTER(c_double)), len(prm), nout,
+       obj.ctypes.data_as(POINTER(c_double)), numThreads)
+    return obj
         
   def gradient(self, prm=None):
     n = annmodel.get_image_param_len(self.mPtr)
@@ -179,6 +525,22 @@ class Model:
     grad = self.gradient()
     return array(grad[:n])
     
+  def label_loglik(self, labels, numThreads=0):
+    """
+    Returns the log-likelihood of each of an N x 3 array of (image id,
+    worker id, label) rows under the current parameters, evaluated by the
+    library on `numThreads` threads (one per core if 0). The labels need not
+    be the loaded ones, e.g. they can be labels held out of the fit.
+    """
+    labels = ascontiguousarray(labels, dtype=intc).reshape((-1, 3))
+    label_array_size(labels, self.get_num_imgs(), self.get_num_wkrs())
+    ll = zeros(len(labels))
+    annmodel.label_loglik_batch(self.mPtr, len(labels),
+                                labels.ctypes.data_as(POINTER(c_int)),
+                                ll.ctypes.data_as(POINTER(c_double)),
+                                numThreads)
+    return ll
+
   def get_num_wkr_lbls(self):
     n = self.get_num_wkrs()
     return self._lib_get_vec('get_num_wkr_lbls', c_int, n)
@@ -188,17 +550,33 @@ class Model:
     return self._lib_get_vec('get_num_img_lbls', c_int, n)
     
   def _lib_get_vec(self, fname, vtype, vlen):
+    t0 = time.time()
     vec = (vlen*vtype)()
     vec = cast(vec, POINTER(vtype))
     fn = getattr(annmodel, fname)
     fn(self.mPtr, vec)
-    return vec[:vlen]
+    res = vec[:vlen]
+    self._record_lib_call('lib_get_vec', vlen, time.time()-t0)
+    return res
 
   def _lib_set_vec(self, fname, vtype, vec):
+    t0 = time.time()
     vlen = len(vec)
-    cvec = (vlen*vtype)()
-    cvec = cast(cvec, POINTER(vtype))
-    for i in range(vlen):
-      cvec[i] = vec[i]
+    cvec = ascontiguousarray(vec, dtype=vtype)
     fn = getattr(annmodel, fname)
-    fn(self.mPtr, cvec)
+    fn(self.mPtr, cvec.ctypes.data_as(POINTER(vtype)))
+    # all the vectors set change the parameters (or what they depend on)
+    self._clear_param_cache()
+    self._record_lib_call('lib_set_vec', vlen, time.time()-t0)
+
+  def _reset_lib_stats(self):
+    self._libStats = {
+      'lib_get_vec' : { 'calls' : 0, 'values' : 0, 'ns' : 0.0 },
+      'lib_set_vec' : { 'calls' : 0, 'values' : 0, 'ns' : 0.0 },
+    }
+
+  def _record_lib_call(self, fname, vlen, secs):
+    stat = self._libStats[fname]
+    stat['calls'] += 1
+    stat['values'] += vlen
+    stat['ns'] += secs*1e9
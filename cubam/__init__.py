@@ -1,5 +1,6 @@
 # make some submodules directly accessible
 from Model import Model
+from LabelStore import LabelStore
 from BinaryModel import BinaryModel
 from Binary1dSignalModel import Binary1dSignalModel
 from BinaryNdSignalModel import BinaryNdSignalModel
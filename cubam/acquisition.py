@@ -0,0 +1,156 @@
+"""
+Index of the image uncertainties and worker reliabilities of a fitted model
+for adaptive label acquisition, i.e. choosing which images to send back to
+which annotators.
+
+The image uncertainties are kept in a heap, which `UncertaintyIndex.update`
+refreshes for the images whose parameters have changed since the last
+update, so that the most uncertain images can be found without going over
+all images after every fit. The workers are ranked by reliability, and the
+best workers for an image are found by going down the ranking, skipping the
+workers that have already labeled the image.
+"""
+import heapq
+import numpy as np
+from scipy.stats import norm
+from BinaryBiasModel import BinaryBiasModel
+
+def image_posterior(model, imgIds=None, numPts=200):
+  """
+  Returns the probability that each image of a fitted `Binary1dSignalModel`
+  or `BinaryBiasModel` is of class 1.
+
+  For the signal model this integrates the image objective over a grid of
+  image parameters (as `Binary1dSignalModel.get_image_var` does for one
+  image), while the bias model holds the probabilities as its parameters.
+
+  Input:
+  - `model`: fitted model.
+  - `imgIds`: [None] image ids (all images if None).
+  - `numPts`: [200] no. of grid points.
+  """
+  if imgIds is None:
+    imgIds = np.arange(model.get_num_imgs())
+  if isinstance(model, BinaryBiasModel):
+    return np.array(model.get_image_param_raw(), dtype=float)[imgIds]
+  xis = np.linspace(-4., 4., numPts)
+  obj = model.image_objective_batch(imgIds, xis)
+  post = np.exp(obj - obj.max(1)[:,np.newaxis])
+  return post[:,xis>0].sum(1)/post.sum(1)
+
+def worker_reliability(model):
+  """
+  Returns the probability that each worker of a fitted `Binary1dSignalModel`
+  or `BinaryBiasModel` labels an image correctly, for an image drawn from
+  the class prior (at the class means for the signal model).
+  """
+  prm = np.array(model.get_worker_param_raw(), dtype=float)
+  if isinstance(model, BinaryBiasModel):
+    # rows of [P(label 1 | class 1), P(label 0 | class 0)]
+    prm = prm.reshape((-1, 2))
+    pz1 = model.get_model_param()['pz1']
+    return pz1*prm[:,0] + (1.-pz1)*prm[:,1]
+  numWkrs = len(prm)/2
+  wjs, tjs = prm[:numWkrs], prm[numWkrs:]
+  beta = model.get_model_param()['beta']
+  # a worker labels 1 when xi*wj + noise > tj, with unit noise
+  return beta*norm.cdf(wjs-tjs) + (1.-beta)*norm.cdf(wjs+tjs)
+
+class UncertaintyIndex:
+  """
+  Index of a fitted model answering which images are the most uncertain
+  and which workers are the best to label them, see the module description.
+
+  The uncertainty of an image is the probability that its estimated label
+  is wrong, min(p, 1-p) where p is its posterior (see `image_posterior`).
+  """
+  def __init__(self, model, tol=1e-3, numPts=200):
+    """
+    Arguments:
+      - `model`: fitted `Binary1dSignalModel` or `BinaryBiasModel`
+      - `tol`: [1e-3] image parameters changing by less than this keep
+        their uncertainty in `update`
+      - `numPts`: [200] no. of grid points of `image_posterior`
+    """
+    self.model = model
+    self.tol = tol
+    self.numPts = numPts
+    self.prm = None
+    self.update()
+
+  def update(self):
+    """
+    Refreshes the uncertainties of the images whose parameters have changed
+    since the last update (all images if the no. of images has changed) and
+    the worker ranking. Returns the no. of images refreshed.
+    """
+    prm = np.array(self.model.get_image_param_raw(), dtype=float)
+    if self.prm is None or len(prm) != len(self.prm):
+      changed = np.arange(len(prm))
+      self.posterior = np.zeros(len(prm))
+      self.version = np.zeros(len(prm), dtype=int)
+      self.heap = []
+    else:
+      changed = np.nonzero(np.abs(prm-self.prm) > self.tol)[0]
+    self.prm = prm
+    if len(changed) > 0:
+      self.posterior[changed] = image_posterior(self.model, changed,
+                                                self.numPts)
+      self.version[changed] += 1
+    unc = self.uncertainty()
+    if len(self.heap)+len(changed) > 2*len(prm):
+      # too many stale entries, so rebuild the heap
+      self.heap = [(-unc[i], i, self.version[i]) for i in range(len(prm))]
+      heapq.heapify(self.heap)
+    else:
+      for i in changed:
+        heapq.heappush(self.heap, (-unc[i], i, self.version[i]))
+    self.reliability = worker_reliability(self.model)
+    self.wkrRank = np.argsort(-self.reliability, kind='mergesort')
+    return len(changed)
+
+  def uncertainty(self, imgIds=None):
+    """
+    Returns the uncertainty of the images `imgIds` (all images if None).
+    """
+    post = self.posterior if imgIds is None else self.posterior[imgIds]
+    return np.minimum(post, 1.-post)
+
+  def top_uncertain(self, k, exclude=()):
+    """
+    Returns the ids of the `k` most uncertain images, most uncertain first,
+    leaving out the image ids in `exclude`.
+    """
+    exclude = set(exclude)
+    found, popped = [], []
+    while self.heap and len(found) < k:
+      entry = heapq.heappop(self.heap)
+      if entry[2] != self.version[entry[1]]:
+        continue # stale entry
+      popped.append(entry)
+      if not entry[1] in exclude:
+        found.append(int(entry[1]))
+    for entry in popped:
+      heapq.heappush(self.heap, entry)
+    return found
+
+  def best_workers(self, imgId, k=1, available=None):
+    """
+    Returns the ids of the `k` most reliable workers that have not labeled
+    image `imgId`, most reliable first.
+
+    Input:
+    - `imgId`: image id.
+    - `k`: [1] no. of workers.
+    - `available`: [None] set of the worker ids to choose from (all
+      workers if None).
+    """
+    done = set(self.model.get_image_labels(imgId)[0])
+    found = []
+    for j in self.wkrRank:
+      if len(found) == k:
+        break
+      if j in done or (not available is None and not j in available):
+        continue
+      found.append(int(j))
+    return found
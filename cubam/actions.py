@@ -5,9 +5,17 @@ import yaml, os
 from Binary1dSignalModel import Binary1dSignalModel
 from BinaryBiasModel import BinaryBiasModel
 from MajorityModel import MajorityModel
+from export import export_estimates, EXPORT_FORMATS
+from cache import FitCache
 
-def run_model_on_file(modelName, filename=None, modelPrm=None, optimizePrm=None,
-                      outputPrefix=None):
+def fit_model_on_file(modelName, filename=None, modelPrm=None,
+                      optimizePrm=None, cache=None):
+    """
+    Returns a model ('signal', 'bias' or 'majority') fitted to a data file.
+
+    If `cache` is set (a `cache.FitCache` or the directory of one), the
+    fitted parameters are loaded from it if the same fit has been cached.
+    """
     # load model
     if modelName == 'signal':
         m = Binary1dSignalModel(filename=filename)
@@ -22,9 +30,16 @@ def run_model_on_file(modelName, filename=None, modelPrm=None, optimizePrm=None,
         m.set_model_param(prm=modelPrm)
     # optimize the model parameters
     if optimizePrm is None:
-        m.optimize_param()
-    else:
-        m.optimize_param(**optimizePrm)
+        optimizePrm = {}
+    if not cache is None and modelName != 'majority':
+        if isinstance(cache, basestring): cache = FitCache(cache)
+        optimizePrm = dict(optimizePrm, cache=cache)
+    m.optimize_param(**optimizePrm)
+    return m
+
+def run_model_on_file(modelName, filename=None, modelPrm=None, optimizePrm=None,
+                      outputPrefix=None, cache=None):
+    m = fit_model_on_file(modelName, filename, modelPrm, optimizePrm, cache)
     # convert lists to dictionaries
     imgPrm = m.get_image_param()
     if type(imgPrm)==type(list()):
@@ -45,10 +60,34 @@ def run_model_on_file(modelName, filename=None, modelPrm=None, optimizePrm=None,
     return { 'labels' : labels, 'workers' : wkrPrm, 'images' : imgPrm }
 
 def run_model_on_files(modelName, files, modelPrm=None, optimizePrm=None,
-                       outputDir=None):
+                       outputDir=None, format='csv', cache=None):
+    """
+    Fits a model to each of a list of data files, and writes the estimates
+    to `{outputDir}/{file name}-est-*`.
+
+    The estimates are written by `export.export_estimates` in the `format`
+    'csv' or 'npy', keyed by the original ids if a `{file name}-mapping.yaml`
+    written by `utils.normalize_data_file` is next to the data file, or as
+    YAML dictionaries (see `run_model_on_file`) if `format` is 'yaml'. The
+    fits are cached in `cache` if it is set (see `fit_model_on_file`).
+    """
+    assert format in EXPORT_FORMATS+['yaml'], \
+        "Format must be one of %s" % ', '.join(EXPORT_FORMATS+['yaml'])
+    if outputDir and not os.path.exists(outputDir): os.makedirs(outputDir)
+    if isinstance(cache, basestring): cache = FitCache(cache)
     for filePath in files:
         fn = os.path.basename(filePath)
         if fn[-4:]=='.txt': fn = fn[:-4]
         outputPrefix = '%s/%s' % (outputDir, fn)
-        run_model_on_file(modelName, filename=filePath, modelPrm=modelPrm,
-                          optimizePrm=optimizePrm, outputPrefix=outputPrefix)
+        if format == 'yaml':
+            run_model_on_file(modelName, filename=filePath,
+                              modelPrm=modelPrm, optimizePrm=optimizePrm,
+                              outputPrefix=outputPrefix, cache=cache)
+            continue
+        m = fit_model_on_file(modelName, filePath, modelPrm, optimizePrm,
+                              cache)
+        mapFile = '%s-mapping.yaml' % filePath[:-4]
+        mapping = None
+        if filePath[-4:]=='.txt' and os.path.exists(mapFile):
+            mapping = yaml.load(open(mapFile))
+        export_estimates(m, outputPrefix, format, mapping)
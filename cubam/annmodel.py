@@ -1,49 +1,139 @@
 from os.path import dirname, abspath, join, normpath
-from ctypes import CDLL, c_char_p, c_void_p, c_double, c_int, cast, POINTER
+from ctypes import CDLL, c_char_p, c_void_p, c_double, c_int, c_longlong, \
+  cast, POINTER
 
-# connect to the shared library (assumed to reside in ../cubamcpp.so)
+# the shared library is assumed to reside in ../cubamcpp.so
 libdir = normpath(join(dirname(abspath(__file__)), '..'))
-annmodel = CDLL(abspath(join(libdir, 'cubamcpp.so')))
-
-# set up function argument and return types
-# this is needed to avoid 64/32 bit conversion errors
-annmodel.setup_model.argtypes = [c_char_p]
-annmodel.setup_model.restype = c_void_p
-
-annmodel.clear_model.argtypes = [c_void_p]
-
-annmodel.load_data.argtypes = [c_void_p, c_char_p]
-
-annmodel.set_model_param.argtypes = [c_void_p, POINTER(c_double)]
-annmodel.get_model_param.argtypes = [c_void_p, POINTER(c_double)]
-
-annmodel.set_worker_param.argtypes = [c_void_p, POINTER(c_double)]
-annmodel.set_image_param.argtypes = [c_void_p, POINTER(c_double)]
-annmodel.get_worker_param.argtypes = [c_void_p, POINTER(c_double)]
-annmodel.get_image_param.argtypes = [c_void_p, POINTER(c_double)]
- 
-annmodel.objective.argtypes = [c_void_p]
-annmodel.objective.restype = c_double
-
-annmodel.image_objective.argtypes = [c_void_p, c_int, POINTER(c_double),
-                                     c_int, POINTER(c_double)]
-annmodel.worker_objective.argtypes = [c_void_p, c_int, POINTER(c_double),
-                                      c_int, POINTER(c_double)]
-annmodel.gradient.argtypes = [c_void_p, POINTER(c_double)]
-
-annmodel.get_num_wkr_lbls.argtypes = [c_void_p, POINTER(c_int)]
-annmodel.get_num_img_lbls.argtypes = [c_void_p, POINTER(c_int)]
-
-annmodel.get_num_wkrs.argtypes = [c_void_p]
-annmodel.get_num_wkrs.restype = c_int
-annmodel.get_num_imgs.argtypes = [c_void_p]
-annmodel.get_num_imgs.restype = c_int
-annmodel.get_num_lbls.argtypes = [c_void_p]
-annmodel.get_num_lbls.restype = c_int
-
-annmodel.get_model_param_len.argtypes = [c_void_p]
-annmodel.get_model_param_len.restype = c_int
-annmodel.get_worker_param_len.argtypes = [c_void_p]
-annmodel.get_worker_param_len.restype = c_int
-annmodel.get_image_param_len.argtypes = [c_void_p]
-annmodel.get_image_param_len.restype = c_int
+
+class _Library:
+  """
+  The shared library, loaded on first use (in practice when the first model
+  is constructed), so that importing the package does not load it.
+  """
+  def __getattr__(self, name):
+    if not '_lib' in self.__dict__:
+      lib = CDLL(abspath(join(libdir, 'cubamcpp.so')))
+      _setup(lib)
+      self.__dict__['_lib'] = lib
+    fn = getattr(self._lib, name)
+    # look the function up in the library only once
+    setattr(self, name, fn)
+    return fn
+
+annmodel = _Library()
+
+# exceptions raised for each LoadStatus of the library (see annmodel.hpp)
+LOAD_ERRORS = [None, IOError, ValueError, MemoryError]
+
+def _check_load(status, fn, args):
+  # raises the error of a function loading labels that failed
+  if status != 0:
+    raise LOAD_ERRORS[status](annmodel.get_last_error())
+  return status
+
+def _setup(annmodel):
+  # set up function argument and return types
+  # this is needed to avoid 64/32 bit conversion errors
+  annmodel.setup_model.argtypes = [c_char_p]
+  annmodel.setup_model.restype = c_void_p
+
+  annmodel.clear_model.argtypes = [c_void_p]
+  annmodel.clear_data.argtypes = [c_void_p]
+
+  annmodel.set_label_storage.argtypes = [c_void_p, c_int]
+  annmodel.get_last_error.restype = c_char_p
+  annmodel.load_data.argtypes = [c_void_p, c_char_p]
+  annmodel.load_data_array.argtypes = [c_void_p, c_int, c_int, c_int,
+                                       POINTER(c_int)]
+  annmodel.load_data_mapped.argtypes = [c_void_p, c_char_p]
+  annmodel.build_label_store.argtypes = [c_char_p, c_char_p]
+
+  annmodel.new_label_store.argtypes = [c_int]
+  annmodel.new_label_store.restype = c_void_p
+  annmodel.retain_label_store.argtypes = [c_void_p]
+  annmodel.release_label_store.argtypes = [c_void_p]
+  annmodel.label_store_load_data.argtypes = [c_void_p, c_char_p]
+  annmodel.label_store_load_data_array.argtypes = [c_void_p, c_int, c_int,
+                                                   c_int, POINTER(c_int)]
+  annmodel.label_store_load_data_mapped.argtypes = [c_void_p, c_char_p]
+  annmodel.label_store_get_num_wkrs.argtypes = [c_void_p]
+  annmodel.label_store_get_num_wkrs.restype = c_int
+  annmodel.label_store_get_num_imgs.argtypes = [c_void_p]
+  annmodel.label_store_get_num_imgs.restype = c_int
+  annmodel.label_store_get_num_lbls.argtypes = [c_void_p]
+  annmodel.label_store_get_num_lbls.restype = c_int
+  annmodel.label_store_get_storage.argtypes = [c_void_p]
+  annmodel.label_store_get_storage.restype = c_int
+  annmodel.label_store_get_num_refs.argtypes = [c_void_p]
+  annmodel.label_store_get_num_refs.restype = c_int
+  annmodel.label_store_get_label_array.argtypes = [c_void_p, POINTER(c_int)]
+  annmodel.attach_label_store.argtypes = [c_void_p, c_void_p]
+  annmodel.get_label_store.argtypes = [c_void_p]
+  annmodel.get_label_store.restype = c_void_p
+  # the functions loading labels return a status, raised as an exception
+  for name in ['load_data', 'load_data_array', 'load_data_mapped',
+               'build_label_store', 'label_store_load_data',
+               'label_store_load_data_array', 'label_store_load_data_mapped',
+               'attach_label_store']:
+    fn = getattr(annmodel, name)
+    fn.restype = c_int
+    fn.errcheck = _check_load
+
+  annmodel.set_model_param.argtypes = [c_void_p, POINTER(c_double)]
+  annmodel.get_model_param.argtypes = [c_void_p, POINTER(c_double)]
+
+  annmodel.set_worker_param.argtypes = [c_void_p, POINTER(c_double)]
+  annmodel.set_image_param.argtypes = [c_void_p, POINTER(c_double)]
+  annmodel.get_worker_param.argtypes = [c_void_p, POINTER(c_double)]
+  annmodel.get_image_param.argtypes = [c_void_p, POINTER(c_double)]
+
+  annmodel.objective.argtypes = [c_void_p]
+  annmodel.objective.restype = c_double
+
+  annmodel.image_objective.argtypes = [c_void_p, c_int, POINTER(c_double),
+                                       c_int, POINTER(c_double)]
+  annmodel.worker_objective.argtypes = [c_void_p, c_int, POINTER(c_double),
+                                        c_int, POINTER(c_double)]
+  annmodel.image_objective_batch.argtypes = [c_void_p, c_int, POINTER(c_int),
+    POINTER(c_double), c_int, c_int, POINTER(c_double), c_int]
+  annmodel.worker_objective_batch.argtypes = [c_void_p, c_int, POINTER(c_int),
+    POINTER(c_double), c_int, c_int, POINTER(c_double), c_int]
+  annmodel.gradient.argtypes = [c_void_p, POINTER(c_double)]
+  annmodel.label_loglik_batch.argtypes = [c_void_p, c_int, POINTER(c_int),
+                                          POINTER(c_double), c_int]
+
+  annmodel.set_term_weights.argtypes = [c_void_p, POINTER(c_double)]
+  annmodel.attach_image_param.argtypes = [c_void_p, POINTER(c_double)]
+  annmodel.get_label_array.argtypes = [c_void_p, POINTER(c_int)]
+  annmodel.get_image_labels.argtypes = [c_void_p, c_int, POINTER(c_int),
+                                        POINTER(c_int)]
+  annmodel.get_image_num_lbls.argtypes = [c_void_p, c_int]
+
+  annmodel.get_num_wkr_lbls.argtypes = [c_void_p, POINTER(c_int)]
+  annmodel.get_num_img_lbls.argtypes = [c_void_p, POINTER(c_int)]
+
+  annmodel.get_num_wkrs.argtypes = [c_void_p]
+  annmodel.get_num_wkrs.restype = c_int
+  annmodel.get_num_imgs.argtypes = [c_void_p]
+  annmodel.get_num_imgs.restype = c_int
+  annmodel.get_num_lbls.argtypes = [c_void_p]
+  annmodel.get_num_lbls.restype = c_int
+
+  annmodel.get_model_param_len.argtypes = [c_void_p]
+  annmodel.get_model_param_len.restype = c_int
+  annmodel.get_worker_param_len.argtypes = [c_void_p]
+  annmodel.get_worker_param_len.restype = c_int
+  annmodel.get_image_param_len.argtypes = [c_void_p]
+  annmodel.get_image_param_len.restype = c_int
+
+  annmodel.get_stats_len.argtypes = [c_void_p]
+  annmodel.get_stats_len.restype = c_int
+  annmodel.get_stats.argtypes = [c_void_p, POINTER(c_double)]
+  annmodel.reset_stats.argtypes = [c_void_p]
+
+  annmodel.fit_batch.argtypes = [c_char_p, POINTER(c_double), c_int,
+                                 POINTER(c_longlong), POINTER(c_int),
+                                 POINTER(c_int), POINTER(c_int), c_int,
+                                 c_double, c_int, POINTER(c_longlong),
+                                 POINTER(c_double), POINTER(c_longlong),
+                                 POINTER(c_double), POINTER(c_double), c_int]
@@ -0,0 +1,146 @@
+"""
+Fits a signal model to each of many small, independent label sets in one
+call to the library.
+
+Fitting thousands of label sets of a few hundred labels each one model at a
+time is dominated by the per model overhead (setting up the model, loading
+its labels and driving the optimizer from Python). Here the label sets are
+given as one concatenated array of (image id, worker id, label) rows, with
+the ids local to each set, along with the offsets of the sets in it:
+
+  labels, offsets = stack_label_sets([labels0, labels1, labels2])
+  fit = fit_batch(Binary1dSignalModel, labels, offsets)
+  xis = split_batch(fit['images'], fit['imgOffsets'])  # a vector per set
+
+Each set is then fitted by the library on a thread of its own, alternating
+between the image and the worker parameters as `Model.optimize_param`
+does, with a native L-BFGS in place of SciPy's.
+"""
+import numpy as np
+from ctypes import c_char_p, c_double, c_int, c_longlong, POINTER
+from annmodel import annmodel
+from Binary1dSignalModel import Binary1dSignalModel
+from BinaryNdSignalModel import BinaryNdSignalModel
+
+# the status of each fitted set, as given by `fit_batch`
+BATCH_STATUS = ['converged', 'max_iter', 'failed']
+BATCH_INFO_LEN = 4
+
+def stack_label_sets(labelSets):
+  """
+  Concatenates a list of N x 3 label arrays (with ids local to each array)
+  and returns the labels and the array of the offsets of the sets, with set
+  k in rows `offsets[k]` to `offsets[k+1]`.
+  """
+  sizes = [len(l) for l in labelSets]
+  offsets = np.zeros(len(sizes)+1, dtype=np.int64)
+  offsets[1:] = np.cumsum(sizes)
+  labels = np.zeros((offsets[-1], 3), dtype=np.intc)
+  for (k, l) in enumerate(labelSets):
+    if sizes[k]:
+      labels[offsets[k]:offsets[k+1]] = np.asarray(l).reshape((-1, 3))
+  return labels, offsets
+
+def split_batch(prm, offsets):
+  """
+  Splits stacked parameters (see `fit_batch`) into a list of arrays, one per
+  label set.
+  """
+  return [prm[offsets[k]:offsets[k+1]] for k in range(len(offsets)-1)]
+
+def _set_sizes(col, offsets):
+  # the largest id+1 of a column in each set (0 for empty sets)
+  num = np.zeros(len(offsets)-1, dtype=np.intc)
+  nonEmpty = np.diff(offsets) > 0
+  if nonEmpty.any():
+    num[nonEmpty] = np.maximum.reduceat(col, offsets[:-1][nonEmpty]) + 1
+  return num
+
+def fit_batch(modelClass, labels, offsets, numImgs=None, numWkrs=None,
+              modelPrm=None, numIter=30, tol=1e-6, seed=0, numThreads=0):
+  """
+  Fits a model to each of a batch of label sets, see the module
+  description.
+
+  Input:
+  - `modelClass`: `Binary1dSignalModel` or `BinaryNdSignalModel`.
+  - `labels`: N x 3 array of the concatenated labels of all sets.
+  - `offsets`: array of the (no. of sets + 1) row offsets of the sets.
+  - `numImgs`: [None] array of the no. of images of each set, defaults to
+    the largest image id+1 of each set.
+  - `numWkrs`: [None] array of the no. of workers of each set, defaults to
+    the largest worker id+1 of each set.
+  - `modelPrm`: [None] dictionary of model parameters shared by all sets.
+  - `numIter`: [30] max. no. of alternations.
+  - `tol`: [1e-6] stop once an alternation changes the objective by less
+    than this (relative), 0 to always run `numIter` alternations.
+  - `seed`: [0] seed of the resampling of image parameters with a
+    non-finite gradient (see `Model.optimize_image_param`).
+  - `numThreads`: [0] no. of threads (one per core if 0).
+
+  Output: dictionary with
+  - `images`, `workers`: the image and worker parameters of all sets,
+    stacked in the layout of `get_image_param_raw` and
+    `get_worker_param_raw` of each set.
+  - `imgOffsets`, `wkrOffsets`: the offsets of the sets in them.
+  - `objective`: the final objective of each set (nan if it failed).
+  - `iterations`: the no. of alternations run on each set.
+  - `evaluations`: the no. of objective evaluations of each set.
+  - `status`: index in `BATCH_STATUS` of each set.
+  """
+  # the library fits the models it sets up by class name, which are only
+  # the signal models
+  assert modelClass in (Binary1dSignalModel, BinaryNdSignalModel), \
+    "Batch fitting only works for the signal models"
+  labels = np.ascontiguousarray(labels, dtype=np.intc).reshape((-1, 3))
+  offsets = np.ascontiguousarray(offsets, dtype=np.int64)
+  numSets = len(offsets)-1
+  assert numSets >= 0 and offsets[0] == 0 and offsets[-1] == len(labels) \
+    and (np.diff(offsets) >= 0).all(), \
+    "Offsets must run from 0 to the no. of labels"
+  if numImgs is None: numImgs = _set_sizes(labels[:,0], offsets)
+  if numWkrs is None: numWkrs = _set_sizes(labels[:,1], offsets)
+  numImgs = np.ascontiguousarray(numImgs, dtype=np.intc)
+  numWkrs = np.ascontiguousarray(numWkrs, dtype=np.intc)
+  assert len(numImgs) == numSets and len(numWkrs) == numSets, \
+    "There must be a no. of images and workers per set"
+  setIdx = np.repeat(np.arange(numSets), np.diff(offsets))
+  if len(labels):
+    assert labels[:,:2].min() >= 0 and \
+      (labels[:,0] < numImgs[setIdx]).all() and \
+      (labels[:,1] < numWkrs[setIdx]).all(), \
+      "Label ids must be in the range of the images and workers of each set"
+  # the model parameters and the no. of parameters per image and worker
+  # are taken from a model of one image and one worker
+  m = modelClass()
+  if not modelPrm is None: m.set_model_param(prm=modelPrm)
+  mdlPrm = m.get_model_param()
+  mdlPrm = np.array([mdlPrm[k] for k in m._mdlPrmList], dtype=float)
+  m.load_data_array(np.zeros((0, 3), dtype=int), 1, 1)
+  imgLen = len(m.get_image_param_raw())
+  wkrLen = len(m.get_worker_param_raw())
+  imgOffsets = np.zeros(numSets+1, dtype=np.int64)
+  imgOffsets[1:] = np.cumsum(imgLen*numImgs.astype(np.int64))
+  wkrOffsets = np.zeros(numSets+1, dtype=np.int64)
+  wkrOffsets[1:] = np.cumsum(wkrLen*numWkrs.astype(np.int64))
+  images = np.zeros(imgOffsets[-1])
+  workers = np.zeros(wkrOffsets[-1])
+  info = np.zeros((numSets, BATCH_INFO_LEN))
+  dbl, lng = POINTER(c_double), POINTER(c_longlong)
+  annmodel.fit_batch(c_char_p(modelClass.__name__),
+                     mdlPrm.ctypes.data_as(dbl), numSets,
+                     offsets.ctypes.data_as(lng),
+                     numImgs.ctypes.data_as(POINTER(c_int)),
+                     numWkrs.ctypes.data_as(POINTER(c_int)),
+                     labels.ctypes.data_as(POINTER(c_int)), numIter, tol,
+                     seed, imgOffsets.ctypes.data_as(lng),
+                     images.ctypes.data_as(dbl),
+                     wkrOffsets.ctypes.data_as(lng),
+                     workers.ctypes.data_as(dbl), info.ctypes.data_as(dbl),
+                     numThreads)
+  return {
+    'images' : images, 'workers' : workers,
+    'imgOffsets' : imgOffsets, 'wkrOffsets' : wkrOffsets,
+    'objective' : info[:,0], 'iterations' : info[:,1].astype(int),
+    'evaluations' : info[:,2].astype(int), 'status' : info[:,3].astype(int),
+  }
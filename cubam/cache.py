@@ -0,0 +1,151 @@
+"""
+On-disk cache of fitted model parameters, so that refitting a model to the
+same labels returns at once.
+
+A fit is keyed by a hash of the model class, the model parameters
+(`get_model_param`), the fit settings (e.g. the no. of iterations), the
+weights of the objective terms (`set_term_weights`), the labels and the
+parameters the fit starts from. The fitted worker and image
+parameters are saved in a state file per key (see `utils.save_state_file`)
+in the cache directory, and the least recently used files are removed once
+the files take more than `maxBytes`.
+
+  cache = FitCache('cache/fits')
+  m = Binary1dSignalModel(filename='data/birds.txt')
+  m.optimize_param(cache=cache)   # fits, and saves the parameters
+  m = Binary1dSignalModel(filename='data/birds.txt')
+  m.optimize_param(cache=cache)   # loads the saved parameters
+"""
+import os, hashlib
+import numpy as np
+from utils import save_state_file, load_state_file
+
+class FitCache:
+  """
+  Cache of fitted parameters in a directory, see the module description.
+  Several processes may share a cache directory.
+  """
+  def __init__(self, cacheDir, maxBytes=1<<30):
+    """
+    Arguments:
+      - `cacheDir`: directory the fits are saved in (made if needed)
+      - `maxBytes`: [1 GB] max. total size of the saved fits
+    """
+    self.cacheDir = cacheDir
+    self.maxBytes = maxBytes
+    self.hits = self.misses = 0
+    if not os.path.exists(cacheDir):
+      os.makedirs(cacheDir)
+
+  def key(self, model, fitPrm):
+    """
+    Returns the key of fitting `model` with the settings `fitPrm` (a
+    dictionary), starting from its current parameters.
+    """
+    h = hashlib.sha1()
+    h.update(model.__class__.__name__)
+    h.update(repr(sorted(model.get_model_param().items())))
+    h.update(repr(sorted(fitPrm.items())))
+    h.update(repr(model.get_term_weights()))
+    h.update(repr((model.get_num_imgs(), model.get_num_wkrs())))
+    labels = np.ascontiguousarray(model.get_label_array(), dtype=np.int32)
+    h.update(labels.tostring())
+    for prm in [model.get_worker_param_raw(), model.get_image_param_raw()]:
+      h.update(np.ascontiguousarray(prm, dtype=float).tostring())
+    return h.hexdigest()
+
+  def path(self, key):
+    return os.path.join(self.cacheDir, '%s.state' % key)
+
+  def load(self, key, model):
+    """
+    Sets the parameters saved under `key` on `model`. Returns the arrays
+    of the saved fit, or None if there are none (or they do not fit the
+    model).
+    """
+    fn = self.path(key)
+    try:
+      header, arrays = load_state_file(fn, mmap=False)
+      os.utime(fn, None) # mark as recently used
+    except (IOError, OSError, AssertionError):
+      self.misses += 1
+      return None
+    if len(arrays['worker']) != len(model.get_worker_param_raw()) or \
+          len(arrays['image']) != len(model.get_image_param_raw()):
+      self.misses += 1
+      return None
+    model.set_worker_param(arrays['worker'])
+    model.set_image_param(arrays['image'])
+    self.hits += 1
+    return arrays
+
+  def save(self, key, model, result=None):
+    """
+    Saves the parameters of `model` under `key`, along with the `result`
+    array of the fit if given, and removes the least recently used fits if
+    the cache is over its size.
+    """
+    arrays = {
+      'worker' : np.asarray(model.get_worker_param_raw(), dtype=float),
+      'image' : np.asarray(model.get_image_param_raw(), dtype=float),
+    }
+    if not result is None: arrays['result'] = np.asarray(result)
+    header = { 'model' : model.__class__.__name__, 'key' : key }
+    # write to a temporary file first, so that readers never see a partly
+    # written fit
+    fn = self.path(key)
+    tmp = '%s.%d.tmp' % (fn, os.getpid())
+    save_state_file(tmp, header, arrays)
+    os.rename(tmp, fn)
+    self.evict()
+
+  def fit(self, model, fitPrm, fitFn):
+    """
+    Loads the fit of `model` with the settings `fitPrm` if it is cached,
+    and otherwise calls `fitFn()` to fit the model and saves the fit.
+    Returns what `fitFn()` returned (None, or an array such as the mask of
+    the screened workers, which is saved with the fit).
+    """
+    key = self.key(model, fitPrm)
+    arrays = self.load(key, model)
+    if not arrays is None:
+      return arrays.get('result')
+    result = fitFn()
+    self.save(key, model, result)
+    return result
+
+  def evict(self):
+    """
+    Removes the least recently used fits until the cache is within its
+    size. Returns the no. of fits removed.
+    """
+    entries = []
+    for name in os.listdir(self.cacheDir):
+      if not name.endswith('.state'):
+        continue
+      fn = os.path.join(self.cacheDir, name)
+      try:
+        st = os.stat(fn)
+      except OSError:
+        continue # removed by another process
+      entries.append((st.st_mtime, st.st_size, fn))
+    total = sum(e[1] for e in entries)
+    removed = 0
+    for (mtime, size, fn) in sorted(entries):
+      if total <= self.maxBytes:
+        break
+      try:
+        os.remove(fn)
+        removed += 1
+      except OSError:
+        pass
+      total -= size
+    return removed
+
+  def clear(self):
+    """
+    Removes all fits.
+    """
+    maxBytes, self.maxBytes = self.maxBytes, -1
+    self.evict()
+    self.maxBytes = maxBytes
@@ -0,0 +1,172 @@
+"""
+K-fold cross-validation of models by the likelihood of held out labels.
+
+The labels of one loaded data set (a `LabelStore` or a model with data
+loaded) are split at random into K folds, given as the fold index of each
+label. For each model and fold, a model is fitted to the labels outside the
+fold, and the labels in the fold are scored by their predictive
+log-likelihood under the fitted model (see `predictive_loglik`). The
+(model, fold) fits run in a pool of processes, which share the labels and
+folds with the parent process rather than reading a data file per fold.
+The store has no masked view of its labels, so each fit loads a copy of
+the labels outside its fold (see `Model.load_data_array`), which only
+lives as long as the fit:
+
+  from cubam.crossval import cross_validate
+  store = LabelStore('data/birds.txt')
+  models = { '1d' : (Binary1dSignalModel, None),
+             '2d' : (BinaryNdSignalModel, { 'dim' : 2 }),
+             '3d' : (BinaryNdSignalModel, { 'dim' : 3 }),
+             'bias' : (BinaryBiasModel, None) }
+  report = cross_validate(store, models, numFolds=5, numProcs=4)
+  report['2d']['heldOut']   # mean held out log-likelihood per label
+
+All models score a label with the parameters of its image marginalized
+over their posterior given the labels of the fit, at the fitted worker
+parameters, so that the signal and the bias models are compared alike.
+"""
+import time
+import itertools
+import numpy as np
+from utils import make_rng, label_array_size, TaskPool, pool_state
+from BinaryBiasModel import BinaryBiasModel
+
+# max. no. of (image, grid point) values of the posteriors held at once
+POSTERIOR_CHUNK = 1 << 20
+
+def label_folds(numLbls, numFolds, seed=None):
+  """
+  Returns the fold (0 to `numFolds`-1) of each of `numLbls` labels, with
+  the labels spread at random over folds of equal size (up to one label).
+  """
+  rng = make_rng(seed)
+  fold = np.empty(numLbls, dtype=int)
+  fold[rng.permutation(numLbls)] = np.arange(numLbls) % numFolds
+  return fold
+
+def predictive_loglik(model, labels, numPts=40, numThreads=0):
+  """
+  Returns the predictive log-likelihood of each of an N x 3 array of (image
+  id, worker id, label) rows under a fitted model, with the image
+  parameters marginalized over their posterior given the loaded labels.
+
+  `BinaryBiasModel` sums over the class of the image (see its
+  `label_loglik`). The signal models integrate over a grid of `numPts`
+  values per dimension over [-4, 4] (`numPts`**dim points), evaluating the
+  posterior of the images with `image_objective_batch` on `numThreads`
+  threads as `acquisition.image_posterior` does.
+  """
+  labels = np.asarray(labels, dtype=int).reshape((-1, 3))
+  if isinstance(model, BinaryBiasModel):
+    return model.label_loglik(labels)
+  from scipy.special import logsumexp
+  from scipy.stats import norm
+  numWkrs = model.get_num_wkrs()
+  label_array_size(labels, model.get_num_imgs(), numWkrs)
+  ll = np.zeros(len(labels))
+  if len(labels) == 0: return ll
+  # worker parameters are laid out as [wjs (numWkrs x dim), tjs]
+  wkrPrm = np.array(model.get_worker_param_raw(), dtype=float)
+  dim = len(wkrPrm)/numWkrs-1
+  wjs = wkrPrm[:numWkrs*dim].reshape((numWkrs, dim))
+  tjs = wkrPrm[numWkrs*dim:]
+  ticks = np.linspace(-4., 4., numPts)
+  grid = np.array(list(itertools.product(ticks, repeat=dim)))
+  # the labels are scored a chunk of images at a time
+  order = np.argsort(labels[:,0], kind='mergesort')
+  imgs, starts = np.unique(labels[order,0], return_index=True)
+  starts = np.append(starts, len(order))
+  chunk = max(1, POSTERIOR_CHUNK/len(grid))
+  for c in range(0, len(imgs), chunk):
+    cimgs = imgs[c:c+chunk]
+    logPost = model.image_objective_batch(cimgs, grid.flatten(), numThreads)
+    logPost -= logsumexp(logPost, axis=1)[:,np.newaxis]
+    rows = order[starts[c]:starts[min(c+chunk, len(imgs))]]
+    i, j, lij = labels[rows].T
+    signal = wjs[j].dot(grid.T) - tjs[j][:,np.newaxis]
+    signal[lij == 0] *= -1.
+    ll[rows] = logsumexp(logPost[np.searchsorted(cimgs, i)] \
+                         + norm.logcdf(signal), axis=1)
+  return ll
+
+def cross_validate(data, models, numFolds=5, numProcs=1, numIter=30,
+                   numPts=40, seed=None, verbose=False):
+  """
+  Cross-validates models on a data set, see the module description.
+
+  Input:
+  - `data`: `LabelStore` or model holding the labels.
+  - `models`: dictionary of (name -> (model class, model parameters) or
+    (model class, model parameters, optimize parameters)), where the model
+    parameters (a dictionary or None) are set before the labels are loaded
+    and the optimize parameters are passed to `optimize_param` (by default
+    `numIter` alternations).
+  - `numFolds`: [5] no. of folds.
+  - `numProcs`: [1] no. of worker processes (all cores if None).
+  - `numIter`: [30] no. of alternations of the fits.
+  - `numPts`: [40] no. of grid points per dimension of the image posteriors
+    of the signal models, see `predictive_loglik`.
+  - `seed`: [None] random state or seed of the folds, see `utils.make_rng`.
+  - `verbose`: [False] print progress.
+
+  Output: dictionary of (name -> report), where the report holds per fold
+  the `heldOut` mean log-likelihood per held out label, the `logLik` sum of
+  the held out log-likelihoods, the `numLbls` held out labels and the
+  `time` spent fitting and scoring (arrays over the folds), as well as the
+  `mean` log-likelihood per label over all held out labels and the
+  `stderr` of the per fold means (0 for a single fold).
+  """
+  labels = np.asarray(data.get_label_array(), dtype=np.intc)
+  fold = label_folds(len(labels), numFolds, seed)
+  initArgs = (labels, data.get_num_imgs(), data.get_num_wkrs(), fold)
+  tasks = []
+  for (name, spec) in sorted(models.iteritems()):
+    modelClass, modelPrm = spec[:2]
+    optimizePrm = spec[2] if len(spec) > 2 else { 'numIter' : numIter }
+    # the library threads are left to the processes when there are several
+    tasks += [(name, modelClass, modelPrm, optimizePrm, numPts, k,
+               1 if numProcs != 1 else 0) for k in range(numFolds)]
+  if verbose:
+    print "%d models x %d folds to fit" % (len(models), numFolds)
+  results = []
+  if not numProcs is None: numProcs = min(numProcs, len(tasks))
+  with TaskPool(numProcs, _init_worker, initArgs) as pool:
+    for res in pool.imap_unordered(_fit_fold, tasks):
+      results.append(res)
+      if verbose: _print_done(len(results), len(tasks), res)
+  report = {}
+  for name in models.keys():
+    res = sorted((r for r in results if r['name'] == name),
+                 key=lambda r: r['fold'])
+    rep = dict((key, np.array([r[key] for r in res]))
+               for key in ['heldOut', 'logLik', 'numLbls', 'time'])
+    rep['mean'] = rep['logLik'].sum()/max(1, rep['numLbls'].sum())
+    rep['stderr'] = rep['heldOut'].std(ddof=1)/np.sqrt(numFolds) \
+      if numFolds > 1 else 0.0
+    report[name] = rep
+  return report
+
+def _print_done(n, num, res):
+  print "  - %d/%d: %s fold %d, held out %.4f per label (%.1fs)" % \
+    (n, num, res['name'], res['fold'], res['heldOut'], res['time'])
+
+def _init_worker(labels, numImgs, numWkrs, fold):
+  # state of the processes, see `utils.TaskPool`
+  return { 'labels' : labels, 'numImgs' : numImgs, 'numWkrs' : numWkrs,
+           'fold' : fold }
+
+def _fit_fold(task):
+  name, modelClass, modelPrm, optimizePrm, numPts, k, numThreads = task
+  labels, isHeldOut = pool_state['labels'], pool_state['fold'] == k
+  t0 = time.time()
+  m = modelClass()
+  if not modelPrm is None: m.set_model_param(prm=modelPrm)
+  m.load_data_array(labels[~isHeldOut], pool_state['numImgs'],
+                    pool_state['numWkrs'])
+  m.optimize_param(**optimizePrm)
+  ll = predictive_loglik(m, labels[isHeldOut], numPts, numThreads)
+  return {
+    'name' : name, 'fold' : k,
+    'heldOut' : ll.mean() if len(ll) else 0.0, 'logLik' : ll.sum(),
+    'numLbls' : len(ll), 'time' : time.time()-t0,
+  }
@@ -0,0 +1,162 @@
+"""
+Vectorized evaluation of estimates against ground truth.
+
+The estimates of a set of trials are taken as a trials x images matrix
+(a single trial may be given as a vector), and the ground truth either as
+a vector of images shared by all trials or as a matrix of its own per
+trial. Real valued estimates and ground truth (e.g. the image parameters
+of the signal models) are thresholded into labels, while boolean ones are
+taken as is.
+
+All trials are evaluated in one pass over the matrices, and the bootstrap
+confidence intervals resample all the bootstrap replicates at once, as a
+matrix of resampling counts multiplied with the per image errors.
+"""
+import numpy as np
+from utils import make_rng
+
+def as_labels(x, threshold=0.0):
+  """
+  Returns a trials x images boolean matrix of labels, with the values of
+  `x` above `threshold` of class 1 (unless `x` already is boolean).
+  """
+  x = np.atleast_2d(np.asarray(x))
+  if x.dtype == bool:
+    return x
+  return x > threshold
+
+def _label_pair(est, gt, threshold):
+  est = as_labels(est, threshold)
+  gt = as_labels(gt, threshold)
+  assert gt.shape[1] == est.shape[1], \
+    "Estimates and ground truth must have the same no. of images"
+  assert gt.shape[0] in (1, est.shape[0]), \
+    "Ground truth must be shared by all trials or given per trial"
+  return est, np.broadcast_to(gt, est.shape)
+
+def error_rates(est, gt, threshold=0.0):
+  """
+  Computes the error, false alarm and miss rates of each trial.
+
+  Input:
+  - `est`: trials x images matrix (or images vector) of estimates.
+  - `gt`: images vector or trials x images matrix of ground truth.
+  - `threshold`: [0.0] threshold of real valued estimates and ground truth,
+    e.g. 0.5 for posteriors.
+
+  Output:
+  1. error rate array (one value per trial).
+  2. false alarm rate array (nan for trials without class 0 images).
+  3. miss rate array (nan for trials without class 1 images).
+  """
+  est, gt = _label_pair(est, gt, threshold)
+  numPos = gt.sum(1).astype(float)
+  numNeg = gt.shape[1] - numPos
+  er = (est != gt).mean(1)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    far = (est & ~gt).sum(1)/numNeg
+    mr = (~est & gt).sum(1)/numPos
+  return er, far, mr
+
+def _rank_rows(x):
+  # ranks (from 1) within each row, with ties given their average rank
+  numRows, numCols = x.shape
+  order = np.argsort(x, axis=1, kind='mergesort')
+  srt = np.take_along_axis(x, order, axis=1)
+  new = np.ones(x.shape, dtype=bool)
+  new[:,1:] = srt[:,1:] != srt[:,:-1]
+  group = np.cumsum(new.ravel()) - 1
+  pos = np.tile(np.arange(1., numCols+1), numRows)
+  avg = np.bincount(group, pos)/np.bincount(group)
+  ranks = np.empty(x.shape)
+  ranks[np.arange(numRows)[:,np.newaxis], order] = \
+    avg[group].reshape(x.shape)
+  return ranks
+
+def _pearson_rows(u, v):
+  u = u - u.mean(1)[:,np.newaxis]
+  v = v - v.mean(1)[:,np.newaxis]
+  with np.errstate(divide='ignore', invalid='ignore'):
+    return (u*v).sum(1)/np.sqrt((u*u).sum(1)*(v*v).sum(1))
+
+def correlations(est, gt):
+  """
+  Computes the Spearman and Pearson correlation coefficients between the
+  estimates and the ground truth of each trial (see `error_rates` for the
+  input), as `utils.correlation` does for one trial.
+
+  Output:
+  1. Spearman correlation array (one value per trial).
+  2. Pearson correlation array.
+  """
+  est = np.atleast_2d(np.asarray(est, dtype=float))
+  gt = np.broadcast_to(np.atleast_2d(np.asarray(gt, dtype=float)), est.shape)
+  return (_pearson_rows(_rank_rows(est), _rank_rows(gt)),
+          _pearson_rows(est, gt))
+
+def _trial_mean(rates, cnt):
+  # count weighted mean over the trials (rows) of each replicate (column),
+  # leaving out the trials whose rate is undefined
+  known = ~np.isnan(rates)
+  with np.errstate(invalid='ignore'):
+    return (cnt*np.where(known, rates, 0.)).sum(0)/(cnt*known).sum(0)
+
+def bootstrap_ci(est, gt, numBoot=1000, alpha=0.05, resample='both',
+                 threshold=0.0, seed=None, chunkSize=100):
+  """
+  Computes percentile bootstrap confidence intervals of the error, false
+  alarm and miss rates averaged over the trials (see `error_rates`).
+
+  Each replicate draws the images with replacement (shared by all trials),
+  and/or the trials with replacement, as a matrix of counts. The rates of
+  `chunkSize` replicates are computed together by multiplying the count
+  matrix with the per image errors of all trials.
+
+  Input:
+  - `est`, `gt`, `threshold`: see `error_rates`.
+  - `numBoot`: [1000] no. of bootstrap replicates.
+  - `alpha`: [0.05] the intervals cover 1-alpha.
+  - `resample`: ['both'] 'images', 'trials' or 'both'.
+  - `seed`: [None] random state or seed, see `utils.make_rng`.
+  - `chunkSize`: [100] no. of replicates computed at a time.
+
+  Output:
+  1. array of the [error, false alarm, miss] rates averaged over the trials
+     (leaving out the trials where a rate is undefined).
+  2. array of the lower ends of their intervals.
+  3. array of the upper ends of their intervals.
+  """
+  assert resample in ('images', 'trials', 'both'), \
+    "Resample must be one of images, trials or both"
+  rng = make_rng(seed)
+  est, gt = _label_pair(est, gt, threshold)
+  numTrials, numImgs = est.shape
+  # per image errors, false alarms and class 0 images (and misses and
+  # class 1 images) of each trial
+  wrong = (est != gt).astype(float)
+  fa, neg = (est & ~gt).astype(float), (~gt).astype(float)
+  miss, pos = (~est & gt).astype(float), gt.astype(float)
+  boot = np.empty((3, numBoot))
+  for start in range(0, numBoot, chunkSize):
+    num = min(chunkSize, numBoot-start)
+    if resample in ('images', 'both'):
+      imgCnt = rng.multinomial(numImgs, np.ones(numImgs)/numImgs,
+                               size=num).T.astype(float)
+    else:
+      imgCnt = np.ones((numImgs, num))
+    with np.errstate(divide='ignore', invalid='ignore'):
+      rates = [wrong.dot(imgCnt)/numImgs, fa.dot(imgCnt)/neg.dot(imgCnt),
+               miss.dot(imgCnt)/pos.dot(imgCnt)]
+    if resample in ('trials', 'both'):
+      trialCnt = rng.multinomial(numTrials, np.ones(numTrials)/numTrials,
+                                 size=num).T.astype(float)
+    else:
+      trialCnt = np.ones((numTrials, num))
+    for r in range(3):
+      boot[r,start:start+num] = _trial_mean(rates[r], trialCnt)
+  rates = np.array([_trial_mean(r[:,np.newaxis], np.ones((numTrials, 1)))[0]
+                    for r in error_rates(est, gt)])
+  with np.errstate(invalid='ignore'):
+    lower = np.nanpercentile(boot, 100.*alpha/2, axis=1)
+    upper = np.nanpercentile(boot, 100.*(1.-alpha/2), axis=1)
+  return rates, lower, upper
@@ -0,0 +1,178 @@
+"""
+Runs benchmark experiments: every model fitted to every trial of every
+data set, such as the comparisons in `demo/synthetic.py`.
+
+Each (data set, model, trial) task is fitted in a process of a pool and its
+estimates are saved to a file of its own as soon as it is done, so that an
+interrupted experiment loses at most the tasks that were running. Each file
+also holds a hash of the spec of its task (see `task_spec_hash`). Running
+the experiment again skips the tasks whose files exist with the same spec,
+reruns those whose data file or parameters changed, and collects the
+results of all tasks once they are done:
+
+  from cubam.experiments import run_experiment
+  datasets = { 'w04' : ['data/w04-t0.txt', 'data/w04-t1.txt'] }
+  models = { 'signal' : ('signal', None), 'bias' : ('bias', None),
+             'majority' : ('majority', { 'addNoise' : True }) }
+  results = run_experiment(datasets, models, 'results/synthetic', 4)
+  results['w04']['signal']['labels']   # trials x images label matrix
+
+The global numpy random state of each task is seeded from the experiment
+seed and the name of the task, so that the results do not depend on the
+order the tasks are run in or on how many runs they took.
+"""
+import os, time, zlib, hashlib
+import numpy as np
+from actions import fit_model_on_file
+from utils import TaskPool, as_array
+
+def task_file(resultDir, dataset, model, trial):
+  """
+  Returns the file the estimates of a task are saved to.
+  """
+  return os.path.join(resultDir, dataset, '%s-t%03d.npz' % (model, trial))
+
+def task_spec_hash(task, seed):
+  """
+  Returns a hash of what the result of a task depends on: its data file
+  (by name, size and modification time, so that the data is not read to
+  check a result), model name, model parameters, optimize parameters and
+  the experiment seed.
+  """
+  filename, modelName, modelPrm, optimizePrm = task[3:7]
+  st = os.stat(filename)
+  spec = (filename, st.st_size, st.st_mtime, modelName,
+          _canonical(modelPrm), _canonical(optimizePrm), seed)
+  return hashlib.sha1(repr(spec)).hexdigest()
+
+def _canonical(prm):
+  # dictionaries as sorted lists of items, so that their repr is stable
+  if isinstance(prm, dict):
+    return [(k, _canonical(v)) for (k, v) in sorted(prm.iteritems())]
+  if isinstance(prm, (list, tuple)):
+    return [_canonical(v) for v in prm]
+  return prm
+
+def _is_done(task, seed):
+  # whether the result file of a task exists and is of the same spec
+  resultFile = task[-1]
+  if not os.path.exists(resultFile):
+    return False
+  try:
+    saved = np.load(resultFile)
+  except (IOError, ValueError):
+    return False
+  try:
+    return 'spec' in saved.files and \
+      str(saved['spec']) == task_spec_hash(task, seed)
+  finally:
+    saved.close()
+
+def make_tasks(datasets, models, resultDir):
+  """
+  Returns the list of (data set, model, trial, data file, model name, model
+  parameters, optimize parameters, result file) tasks of an experiment, see
+  `run_experiment`.
+  """
+  tasks = []
+  for (dataset, files) in sorted(datasets.iteritems()):
+    for (model, spec) in sorted(models.iteritems()):
+      modelName, modelPrm = spec[:2]
+      optimizePrm = spec[2] if len(spec) > 2 else None
+      for (trial, filename) in enumerate(files):
+        tasks.append((dataset, model, trial, filename, modelName, modelPrm,
+                      optimizePrm, task_file(resultDir, dataset, model,
+                                             trial)))
+  return tasks
+
+def run_experiment(datasets, models, resultDir, numProcs=1, seed=0,
+                   verbose=False):
+  """
+  Fits every model to every trial of every data set, resuming an earlier
+  run of the experiment in `resultDir`, see the module description.
+
+  Input:
+  - `datasets`: dictionary of (data set name -> list of data files, one
+    per trial).
+  - `models`: dictionary of (name -> (model name, model parameters) or
+    (model name, model parameters, optimize parameters)), with the model
+    names and parameters of `actions.fit_model_on_file`.
+  - `resultDir`: directory the task results are saved in.
+  - `numProcs`: [1] no. of worker processes (all cores if None).
+  - `seed`: [0] seed the random states of the tasks are derived from.
+  - `verbose`: [False] print progress.
+
+  Output: see `collect_results`.
+  """
+  tasks = make_tasks(datasets, models, resultDir)
+  todo = [t for t in tasks if not _is_done(t, seed)]
+  if verbose:
+    print "%d of %d tasks to run" % (len(todo), len(tasks))
+  args = [t + (seed,) for t in todo]
+  if not numProcs is None: numProcs = min(numProcs, len(todo))
+  with TaskPool(numProcs) as pool:
+    # tasks take very different times depending on the model and data set
+    done = pool.imap_unordered(_run_task, args)
+    for (n, (task, secs)) in enumerate(done):
+      if verbose: _print_done(n, len(todo), task, secs)
+  return collect_results(datasets, models, resultDir)
+
+def collect_results(datasets, models, resultDir):
+  """
+  Loads the results of the tasks of an experiment that are done.
+
+  Output: dictionary of (data set -> model -> results), where the results
+  hold the `labels` and `images` (trials x images matrices of the label
+  and image parameter estimates, with a row per image parameter vector for
+  models with more than one parameter per image), `time` (seconds spent
+  fitting each trial) and `trials` (the indices of the trials done). Models
+  with no trial done are left out.
+  """
+  results = {}
+  for (dataset, files) in datasets.iteritems():
+    results[dataset] = {}
+    for model in models.keys():
+      res = { 'labels' : [], 'images' : [], 'time' : [], 'trials' : [] }
+      for trial in range(len(files)):
+        fn = task_file(resultDir, dataset, model, trial)
+        if not os.path.exists(fn):
+          continue
+        saved = np.load(fn)
+        for key in ['labels', 'images', 'time']:
+          res[key].append(saved[key])
+        res['trials'].append(trial)
+      if res['trials']:
+        results[dataset][model] = dict((k, np.array(v))
+                                       for (k, v) in res.iteritems())
+  return results
+
+def _print_done(n, num, task, secs):
+  print "  - task %d/%d: %s %s trial %d (%.1fs)" % \
+    ((n+1, num) + task[:3] + (secs,))
+
+def _run_task(args):
+  # fits one task and saves its estimates, returning (task, seconds)
+  task, seed = args[:-1], args[-1]
+  (dataset, model, trial, filename, modelName, modelPrm, optimizePrm,
+   resultFile) = task
+  np.random.seed(zlib.crc32('%s/%s/%d/%d' % (dataset, model, trial, seed))
+                 & 0xffffffff)
+  t0 = time.time()
+  m = fit_model_on_file(modelName, filename, modelPrm, optimizePrm)
+  secs = time.time()-t0
+  resDir = os.path.dirname(resultFile)
+  if not os.path.exists(resDir):
+    try:
+      os.makedirs(resDir)
+    except OSError:
+      pass # made by another process
+  # write to a temporary file first, so that an interrupted write does not
+  # leave a result behind
+  tmp = '%s.%d.tmp' % (resultFile, os.getpid())
+  f = open(tmp, 'wb')
+  np.savez(f, labels=as_array(m.get_labels()),
+           images=as_array(m.get_image_param_raw()), time=secs,
+           spec=task_spec_hash(task, seed))
+  f.close()
+  os.rename(tmp, resultFile)
+  return (task[:3], secs)
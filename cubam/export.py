@@ -0,0 +1,149 @@
+"""
+Columnar export of the estimates of a fitted model.
+
+The estimates are taken column by column from the parameter vectors of the
+model, with a row per image and per worker keyed by the original ids, and
+written either as CSV files, in chunks of rows, or as a NumPy `.npy` file
+per column (which `numpy.load` can memory-map).
+
+The columns are:
+- images: `id` and, depending on the model, `label`, `xi` (`xi_0`, `xi_1`,
+  ... for `BinaryNdSignalModel`), `posterior` (the probability of class 1)
+  and `votes` (`MajorityModel`).
+- workers: `id` and `wj`, `tj` (`wj_0`, `wj_1`, ..., `tj`) for the signal
+  models, or `a1`, `a0` (the probabilities of a correct label for class 1
+  and class 0 images) for `BinaryBiasModel`.
+"""
+import numpy as np
+from Binary1dSignalModel import Binary1dSignalModel
+from BinaryNdSignalModel import BinaryNdSignalModel
+from BinaryBiasModel import BinaryBiasModel
+from MajorityModel import MajorityModel
+
+EXPORT_FORMATS = ['csv', 'npy']
+
+def id_column(mapping, num):
+  """
+  Returns the original ids of `num` images or workers, given a dictionary
+  of original to normalized ids (see `utils.normalize_data_file`), or the
+  normalized ids if `mapping` is None.
+  """
+  if mapping is None:
+    return np.arange(num)
+  ids = [None]*num
+  for (orig, idx) in mapping.iteritems():
+    ids[idx] = orig
+  if all(isinstance(i, (int, long)) for i in ids):
+    return np.array(ids, dtype=np.int64)
+  return np.array([str(i) for i in ids])
+
+def image_columns(model, ids=None, posterior=True):
+  """
+  Returns the image estimates of a fitted model as a list of (name, array)
+  columns, keyed by the image ids `ids` (the normalized ids if None). The
+  `posterior` column of `Binary1dSignalModel`, which takes a grid of image
+  objective evaluations per image, is left out unless `posterior` is True.
+  """
+  numImgs = model.get_num_imgs()
+  cols = [('id', np.arange(numImgs) if ids is None else np.asarray(ids))]
+  if isinstance(model, BinaryNdSignalModel):
+    dim = model.get_model_param()['dim']
+    xis = np.array(model.get_image_param_raw(), dtype=float)
+    xis = xis.reshape((numImgs, dim))
+    cols += [('xi_%d' % d, xis[:,d]) for d in range(dim)]
+  elif isinstance(model, Binary1dSignalModel):
+    xis = np.array(model.get_image_param_raw(), dtype=float)
+    cols += [('label', (xis > 0.0).astype(int)), ('xi', xis)]
+    if posterior:
+      from acquisition import image_posterior
+      cols += [('posterior', image_posterior(model))]
+  elif isinstance(model, BinaryBiasModel):
+    post = np.array(model.get_image_param_raw(), dtype=float)
+    cols += [('label', (post > 0.5).astype(int)), ('posterior', post)]
+  elif isinstance(model, MajorityModel):
+    prm = np.array(model.get_image_param_raw(), dtype=float)
+    prm = prm.reshape((numImgs, 2))
+    cols += [('label', np.array(model.get_labels(), dtype=int)),
+             ('posterior', prm[:,0]), ('votes', prm[:,1].astype(int))]
+  return cols
+
+def worker_columns(model, ids=None):
+  """
+  Returns the worker estimates of a fitted model as a list of (name,
+  array) columns, keyed by the worker ids `ids` (the normalized ids if
+  None).
+  """
+  numWkrs = model.get_num_wkrs()
+  cols = [('id', np.arange(numWkrs) if ids is None else np.asarray(ids))]
+  prm = np.array(model.get_worker_param_raw(), dtype=float)
+  if isinstance(model, BinaryNdSignalModel):
+    dim = model.get_model_param()['dim']
+    wjs = prm[:numWkrs*dim].reshape((numWkrs, dim))
+    cols += [('wj_%d' % d, wjs[:,d]) for d in range(dim)]
+    cols += [('tj', prm[numWkrs*dim:])]
+  elif isinstance(model, Binary1dSignalModel):
+    cols += [('wj', prm[:numWkrs]), ('tj', prm[numWkrs:])]
+  elif isinstance(model, BinaryBiasModel):
+    prm = prm.reshape((numWkrs, 2))
+    cols += [('a1', prm[:,0]), ('a0', prm[:,1])]
+  return cols
+
+def write_columns(prefix, columns, format='csv', chunkSize=100000):
+  """
+  Writes columns of equal length, either as `{prefix}.csv` with a header
+  line, in chunks of `chunkSize` rows, or as `{prefix}-{name}.npy` for
+  each column. Returns the list of files written.
+  """
+  assert format in EXPORT_FORMATS, \
+    "Format must be one of %s" % ', '.join(EXPORT_FORMATS)
+  if format == 'npy':
+    files = []
+    for (name, col) in columns:
+      fn = '%s-%s.npy' % (prefix, name)
+      np.save(fn, col)
+      files.append(fn)
+    return files
+  fmt = []
+  for (name, col) in columns:
+    if col.dtype.kind in 'iub': fmt.append('%d')
+    elif col.dtype.kind == 'f': fmt.append('%.10g')
+    else: fmt.append('%s')
+  fmt = ','.join(fmt)
+  fn = '%s.csv' % prefix
+  f = open(fn, 'w')
+  f.write(','.join(name for (name, col) in columns) + '\n')
+  num = len(columns[0][1]) if columns else 0
+  for start in range(0, num, chunkSize):
+    rows = zip(*[col[start:start+chunkSize].tolist()
+                 for (name, col) in columns])
+    f.write('\n'.join(fmt % row for row in rows) + '\n')
+  f.close()
+  return [fn]
+
+def export_estimates(model, outputPrefix, format='csv', mapping=None,
+                     posterior=True, chunkSize=100000):
+  """
+  Writes the image and worker estimates of a fitted model to
+  `{outputPrefix}-est-img` and `{outputPrefix}-est-wkr` (see
+  `write_columns`). Returns the list of files written.
+
+  Input:
+  - `model`: fitted model.
+  - `outputPrefix`: output path prefix.
+  - `format`: ['csv'] 'csv' or 'npy'.
+  - `mapping`: [None] dictionary with the original to normalized id
+    mappings of the images and workers (as `image` and `worker`), e.g.
+    from the file written by `utils.normalize_data_file`.
+  - `posterior`: [True] export the posterior of the signal model images,
+    see `image_columns`.
+  - `chunkSize`: [100000] no. of rows per write of the CSV files.
+  """
+  if mapping is None: mapping = {}
+  imgIds = id_column(mapping.get('image'), model.get_num_imgs())
+  wkrIds = id_column(mapping.get('worker'), model.get_num_wkrs())
+  files = write_columns('%s-est-img' % outputPrefix,
+                        image_columns(model, imgIds, posterior), format,
+                        chunkSize)
+  files += write_columns('%s-est-wkr' % outputPrefix,
+                         worker_columns(model, wkrIds), format, chunkSize)
+  return files
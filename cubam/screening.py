@@ -0,0 +1,130 @@
+"""
+Screening of uninformative workers out of the fitting of the signal models.
+
+A worker whose weight `wj` is near zero (e.g. the 'bot' workers of
+`BinaryBiasModel.sample_worker_param`, who label at random) hardly moves the
+image parameters, yet every objective and gradient evaluation goes over all
+of their labels. After a few alternations on all the labels, such workers
+are screened out: the alternations go on with a model holding only the
+labels of the remaining workers, whose label terms are unchanged, while the
+terms of the screened workers are left out as a constant. Every few
+alternations the worker parameters of all workers are refitted to the
+current image parameters and the workers screened again, so that a worker
+whose weight grows is brought back.
+
+  m = Binary1dSignalModel(filename='data/noisy.txt')
+  screened = m.optimize_param(screen=0.1)   # mask of the screened workers
+"""
+import numpy as np
+from Binary1dSignalModel import Binary1dSignalModel
+from BinaryNdSignalModel import BinaryNdSignalModel
+
+def worker_weights(model):
+  """
+  Returns the magnitude of the weight `wj` of each worker of a fitted
+  signal model (the norm of the weight vector of `BinaryNdSignalModel`).
+  """
+  numWkrs = model.get_num_wkrs()
+  prm = np.array(model.get_worker_param_raw())
+  # worker parameters are laid out as [wjs (numWkrs x dim), tjs]
+  dim = len(prm)/numWkrs-1 if numWkrs > 0 else 0
+  wjs = prm[:numWkrs*dim].reshape((numWkrs, dim))
+  return np.sqrt((wjs*wjs).sum(1))
+
+def screen_workers(model, threshold=0.1):
+  """
+  Returns the mask of the workers whose weight (see `worker_weights`) is
+  below `threshold`.
+  """
+  return worker_weights(model) < threshold
+
+def _param_index(wkrs, numWkrs, dim):
+  # indices of the parameters of workers wkrs in [wjs (numWkrs x dim), tjs]
+  return np.concatenate([(dim*wkrs.reshape((-1, 1)) \
+                          + np.arange(dim)).flatten(),
+                         numWkrs*dim + wkrs]).astype(int)
+
+class ScreenedModel:
+  """
+  A copy of a signal model holding only the labels of the workers that are
+  not screened out, with the same images.
+  """
+  def __init__(self, model, labels, screened):
+    numWkrs = model.get_num_wkrs()
+    self.wkrs = np.nonzero(~screened)[0]
+    dim = len(model.get_worker_param_raw())/numWkrs-1
+    self.prmIdx = _param_index(self.wkrs, numWkrs, dim)
+    wkrMap = np.zeros(numWkrs, dtype=int)
+    wkrMap[self.wkrs] = np.arange(len(self.wkrs))
+    slabels = labels[~screened[labels[:,1]]]
+    slabels[:,1] = wkrMap[slabels[:,1]]
+    self.model = model.__class__()
+    self.model.set_model_param(prm=model.get_model_param())
+    self.model.load_data_array(slabels, model.get_num_imgs(), len(self.wkrs))
+    self.pull(model)
+
+  def pull(self, model):
+    """
+    Sets the parameters of the copy from those of `model`.
+    """
+    self.model.set_image_param(model.get_image_param_raw())
+    wkrPrm = np.array(model.get_worker_param_raw())
+    self.model.set_worker_param(wkrPrm[self.prmIdx])
+
+  def push(self, model):
+    """
+    Sets the parameters of `model` from those of the copy, leaving the
+    parameters of the screened workers as they are.
+    """
+    model.set_image_param(self.model.get_image_param_raw())
+    wkrPrm = np.array(model.get_worker_param_raw())
+    wkrPrm[self.prmIdx] = self.model.get_worker_param_raw()
+    model.set_worker_param(wkrPrm)
+
+def optimize_param_screened(model, numIter=30, threshold=0.1, warmup=3,
+                            recheck=5, verbose=False):
+  """
+  Screened version of `Model.optimize_param` for the signal models, see
+  the module description.
+
+  Arguments:
+    - `numIter`: no. of alternations
+    - `threshold`: workers with a weight below this are screened out
+    - `warmup`: no. of alternations on all labels before the first screening
+    - `recheck`: no. of alternations between the screenings
+    - `verbose`: print progress
+
+  Returns the mask of the workers screened out at the end. Their parameters
+  (like those of all workers) are fitted to the final image parameters.
+  """
+  # the weights are only defined for the signal models
+  assert isinstance(model, (Binary1dSignalModel, BinaryNdSignalModel)), \
+    "Screening only works for the signal models"
+  labels = model.get_label_array()
+  screened = np.zeros(model.get_num_wkrs(), dtype=bool)
+  sub = None
+  for n in range(numIter):
+    if verbose: print "  - iteration %d/%d" % (n+1, numIter)
+    if n >= warmup and (n-warmup) % recheck == 0:
+      if not sub is None:
+        sub.push(model)
+        model.optimize_worker_param()
+      newScreened = screen_workers(model, threshold)
+      if newScreened.all():
+        newScreened[:] = False # keep all, nothing is left to fit
+      if sub is None or (newScreened != screened).any():
+        screened = newScreened
+        sub = ScreenedModel(model, labels, screened) if screened.any() \
+          else None
+        if verbose:
+          print "    screened %d of %d workers" % (screened.sum(),
+                                                   len(screened))
+      else:
+        sub.pull(model)
+    m = model if sub is None else sub.model
+    m.optimize_image_param()
+    m.optimize_worker_param()
+  if not sub is None:
+    sub.push(model)
+    model.optimize_worker_param()
+  return screened
@@ -0,0 +1,309 @@
+"""
+A long-lived local service keeping fitted models in memory.
+
+The service answers posterior and label queries by original image id,
+accepts new labels and refits the models in a background thread. Each fit
+is held in an immutable snapshot which queries read without taking a lock,
+and a refit swaps in a new snapshot once it is done, so readers are never
+blocked by a refit.
+
+It is served over HTTP, with JSON request and response bodies, on a
+localhost port or a Unix socket:
+
+  from cubam.service import ModelService, serve
+  service = ModelService()
+  service.add_model('birds', 'signal', 'data/birds.txt',
+                    mapping='data/birds-mapping.yaml')
+  serve(service, ('localhost', 8080))   # or serve(service, '/tmp/cubam')
+
+Endpoints:
+- `GET /models`: the models with their sizes and fit versions.
+- `GET /stats`: request latency percentiles by endpoint.
+- `POST /posterior`: `{"model": name, "images": [ids]}`, returns the
+  probability that each image is of class 1 and its label (null for
+  unknown images), with the version of the fit answering the query.
+- `POST /labels`: `{"model": name, "labels": [[image, worker, label]],
+  "refit": true}`, adds labels (new ids are added to the model) and
+  schedules a refit unless `refit` is false.
+- `POST /refit`: `{"model": name}`, schedules a refit.
+"""
+import time, json, threading, collections
+import SocketServer
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+import yaml
+import numpy as np
+from Binary1dSignalModel import Binary1dSignalModel
+from BinaryBiasModel import BinaryBiasModel
+from utils import read_label_array
+from acquisition import image_posterior
+
+# models the service can hold, by the names used in `actions`
+SERVICE_MODELS = {
+  'signal' : Binary1dSignalModel,
+  'bias' : BinaryBiasModel,
+}
+
+# no. of recent requests per endpoint the latency percentiles are taken over
+LATENCY_WINDOW = 10000
+
+class _Fit:
+  # immutable snapshot of a fit, shared by the readers
+  def __init__(self, version, imgIdx, posterior, numLbls, fitTime):
+    self.version = version
+    self.imgIdx = imgIdx
+    self.posterior = posterior
+    self.numLbls = numLbls
+    self.fitTime = fitTime
+
+class _Entry:
+  # labels of a model (under `lock`) and its current fit
+  def __init__(self, modelName, modelPrm, optimizePrm):
+    self.modelName = modelName
+    self.modelPrm = modelPrm
+    self.optimizePrm = optimizePrm or {}
+    self.lock = threading.Lock()
+    self.rows = []
+    self.imgIdx = {}
+    self.wkrIdx = {}
+    self.fit = None
+
+class ModelService:
+  """
+  Fitted models held in memory, see the module description.
+  """
+  def __init__(self):
+    self.entries = {}
+    self.latency = collections.defaultdict(
+      lambda: collections.deque(maxlen=LATENCY_WINDOW))
+    self._pending = []
+    self._cond = threading.Condition()
+    self._refitter = threading.Thread(target=self._refit_loop)
+    self._refitter.daemon = True
+    self._refitter.start()
+
+  def add_model(self, name, modelName, filename, mapping=None,
+                modelPrm=None, optimizePrm=None):
+    """
+    Loads the labels of a data file and fits a model to them (in the
+    calling thread, so the model answers queries once this returns).
+
+    Input:
+    - `name`: name the model is queried by.
+    - `modelName`: 'signal' or 'bias'.
+    - `filename`: data file.
+    - `mapping`: [None] YAML mapping of original to normalized ids written
+      by `utils.normalize_data_file` (the normalized ids are used if None).
+    - `modelPrm`: [None] model parameters.
+    - `optimizePrm`: [None] arguments to `optimize_param`.
+    """
+    assert modelName in SERVICE_MODELS, \
+      "Model must be one of %s" % ', '.join(sorted(SERVICE_MODELS))
+    entry = _Entry(modelName, modelPrm, optimizePrm)
+    labels, numImgs, numWkrs = read_label_array(filename)
+    if mapping is None:
+      entry.imgIdx = dict((i, i) for i in range(numImgs))
+      entry.wkrIdx = dict((j, j) for j in range(numWkrs))
+    else:
+      ids = yaml.load(open(mapping))
+      entry.imgIdx, entry.wkrIdx = ids['image'], ids['worker']
+    entry.rows = labels.tolist()
+    # the first fit is done before the model is added, so that queries never
+    # see a model without a fit, and a failed fit leaves no model behind
+    self._refit(entry)
+    self.entries[name] = entry
+
+  def add_labels(self, name, labels, refit=True):
+    """
+    Adds (image id, worker id, label) rows with original ids to a model,
+    and schedules a refit unless `refit` is False. Returns the no. of
+    labels of the model.
+    """
+    entry = self._entry(name)
+    with entry.lock:
+      for (imgId, wkrId, lbl) in labels:
+        i = entry.imgIdx.setdefault(imgId, len(entry.imgIdx))
+        j = entry.wkrIdx.setdefault(wkrId, len(entry.wkrIdx))
+        entry.rows.append([i, j, int(lbl)])
+      numLbls = len(entry.rows)
+    if refit:
+      self.schedule_refit(name)
+    return numLbls
+
+  def schedule_refit(self, name):
+    """
+    Schedules a refit of a model in the background. Requests made while a
+    refit of the model is pending are merged into it.
+    """
+    self._entry(name)
+    with self._cond:
+      if not name in self._pending:
+        self._pending.append(name)
+      self._cond.notify()
+
+  def posterior(self, name, imgIds):
+    """
+    Returns the probability that each image is of class 1 (None for
+    unknown images) and the version of the fit it is taken from.
+    """
+    fit = self._entry(name).fit
+    assert not fit is None, "Model %s has not been fitted yet" % name
+    post = []
+    for imgId in imgIds:
+      idx = fit.imgIdx.get(imgId)
+      if idx is None or idx >= len(fit.posterior):
+        post.append(None)
+      else:
+        post.append(float(fit.posterior[idx]))
+    return (post, fit.version)
+
+  def models(self):
+    """
+    Returns a dictionary describing each model (with a null version for
+    models that have not been fitted yet).
+    """
+    info = {}
+    for (name, entry) in self.entries.items():
+      fit = entry.fit
+      if fit is None:
+        info[name] = { 'model' : entry.modelName, 'version' : None,
+                       'pendingLabels' : len(entry.rows) }
+        continue
+      info[name] = {
+        'model' : entry.modelName,
+        'version' : fit.version,
+        'images' : len(fit.posterior),
+        'labels' : fit.numLbls,
+        'pendingLabels' : len(entry.rows)-fit.numLbls,
+        'fitTime' : fit.fitTime,
+      }
+    return info
+
+  def record_latency(self, endpoint, secs):
+    self.latency[endpoint].append(secs)
+
+  def latency_stats(self, percentiles=(50, 90, 99)):
+    """
+    Returns the no. of requests and the latency percentiles in
+    milliseconds of the recent requests to each endpoint.
+    """
+    stats = {}
+    for (endpoint, lat) in self.latency.items():
+      lat = np.array(lat)*1e3
+      stats[endpoint] = dict(('p%d' % p, float(np.percentile(lat, p)))
+                             for p in percentiles)
+      stats[endpoint]['count'] = len(lat)
+    return stats
+
+  def _entry(self, name):
+    assert name in self.entries, "Unknown model %s" % name
+    return self.entries[name]
+
+  def _refit_loop(self):
+    while True:
+      with self._cond:
+        while not self._pending:
+          self._cond.wait()
+        name = self._pending.pop(0)
+      try:
+        self._refit(self.entries[name])
+      except Exception, e:
+        print "Refit of %s failed: %s" % (name, e)
+
+  def _refit(self, entry):
+    t0 = time.time()
+    with entry.lock:
+      labels = np.array(entry.rows, dtype=int).reshape((-1, 3))
+      imgIdx = dict(entry.imgIdx)
+      numImgs, numWkrs = len(entry.imgIdx), len(entry.wkrIdx)
+    m = SERVICE_MODELS[entry.modelName]()
+    if not entry.modelPrm is None:
+      m.set_model_param(prm=entry.modelPrm)
+    m.load_data_array(labels, numImgs, numWkrs)
+    m.optimize_param(**entry.optimizePrm)
+    version = 1 if entry.fit is None else entry.fit.version+1
+    entry.fit = _Fit(version, imgIdx, image_posterior(m), len(labels),
+                     time.time()-t0)
+
+class _RequestHandler(BaseHTTPRequestHandler):
+  # the service is set on the server by `serve`
+
+  def do_GET(self):
+    service = self.server.service
+    if self.path == '/models':
+      self._respond(service.models)
+    elif self.path == '/stats':
+      self._respond(service.latency_stats)
+    else:
+      self.send_error(404)
+
+  def do_POST(self):
+    service = self.server.service
+    if self.path == '/posterior':
+      def query(req):
+        post, version = service.posterior(req['model'], req['images'])
+        labels = [None if p is None else int(p > 0.5) for p in post]
+        return { 'posterior' : post, 'labels' : labels, 'version' : version }
+    elif self.path == '/labels':
+      def query(req):
+        numLbls = service.add_labels(req['model'], req['labels'],
+                                     req.get('refit', True))
+        return { 'labels' : numLbls }
+    elif self.path == '/refit':
+      def query(req):
+        service.schedule_refit(req['model'])
+        return {}
+    else:
+      self.send_error(404)
+      return
+    length = int(self.headers.getheader('content-length', 0))
+    req = json.loads(self.rfile.read(length))
+    self._respond(lambda: query(req))
+
+  def _respond(self, query):
+    t0 = time.time()
+    try:
+      body, code = json.dumps(query()), 200
+    except (KeyError, AssertionError, ValueError, TypeError), e:
+      body, code = json.dumps({ 'error' : str(e) }), 400
+    self.send_response(code)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+    self.server.service.record_latency(self.path, time.time()-t0)
+
+  def address_string(self):
+    # Unix socket clients have no address
+    if isinstance(self.client_address, tuple):
+      return BaseHTTPRequestHandler.address_string(self)
+    return 'unix'
+
+  def log_message(self, format, *args):
+    if self.server.verbose:
+      BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+class _ThreadingUnixHTTPServer(SocketServer.ThreadingMixIn,
+                               SocketServer.UnixStreamServer):
+  daemon_threads = True
+
+def make_server(service, address, verbose=False):
+  """
+  Returns a server for a `ModelService`, on a (host, port) address or the
+  path of a Unix socket, answering each request in a thread of its own.
+  """
+  if isinstance(address, tuple):
+    server = _ThreadingHTTPServer(address, _RequestHandler)
+  else:
+    server = _ThreadingUnixHTTPServer(address, _RequestHandler)
+  server.service = service
+  server.verbose = verbose
+  return server
+
+def serve(service, address, verbose=False):
+  """
+  Serves a `ModelService` until interrupted, see `make_server`.
+  """
+  make_server(service, address, verbose).serve_forever()
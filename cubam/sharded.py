@@ -0,0 +1,151 @@
+"""
+Data-parallel fitting of the signal models across local processes.
+
+The labels are split by worker into shards, each of which is loaded into a
+model in its own process. Each shard evaluates the label terms of its
+workers (plus the prior of its workers, and the image prior for the first
+shard), and the partial objectives and gradients are reduced through shared
+memory buffers. All the shard models use the same shared image parameter
+vector (see `Model.attach_image_param`), so it is never copied to them.
+"""
+import mmap
+from multiprocessing import Process, Pipe
+from ctypes import c_double, POINTER
+import numpy as np
+from scipy.optimize import fmin_l_bfgs_b
+from annmodel import annmodel
+
+def shared_array(shape, dtype=float):
+  """
+  Returns a zeroed array in anonymous shared memory, which is shared with
+  (rather than copied to) processes forked after it was created.
+  """
+  dtype = np.dtype(dtype)
+  num = int(np.prod(shape))
+  buf = mmap.mmap(-1, max(1, num*dtype.itemsize))
+  return np.frombuffer(buf, dtype=dtype, count=num).reshape(shape)
+
+def split_workers(numWkrLbls, numShards):
+  """
+  Assigns workers to shards so that the no. of labels are balanced.
+
+  Input:
+  - `numWkrLbls`: no. of labels of each worker.
+  - `numShards`: no. of shards.
+
+  Output:
+  1. Array with the shard of each worker.
+  """
+  shard = np.zeros(len(numWkrLbls), dtype=int)
+  loads = np.zeros(numShards)
+  for j in np.argsort(-np.asarray(numWkrLbls), kind='mergesort'):
+    s = np.argmin(loads)
+    shard[j] = s
+    loads[s] += numWkrLbls[j]
+  return shard
+
+class ShardPool:
+  """
+  Pool of processes, each holding the labels of a subset of the workers.
+  """
+  def __init__(self, model, numShards):
+    labels = model.get_label_array()
+    numImgs, numWkrs = model.get_num_imgs(), model.get_num_wkrs()
+    self.imgLen = annmodel.get_image_param_len(model.mPtr)
+    self.wkrLen = annmodel.get_worker_param_len(model.mPtr)
+    # worker parameters are laid out as [wjs (numWkrs x dim), tjs]
+    dim = self.wkrLen/numWkrs-1 if numWkrs > 0 else 0
+    shard = split_workers(np.bincount(labels[:,1], minlength=numWkrs),
+                          numShards)
+    # set up the buffers shared with the shard processes
+    self.xis = shared_array(self.imgLen)
+    self.wkrPrm = shared_array(self.wkrLen)
+    self.imgGrad = shared_array((numShards, self.imgLen))
+    self.wkrGrad = shared_array(self.wkrLen)
+    self.objs = shared_array(numShards)
+    self.conns, self.procs = [], []
+    for s in range(numShards):
+      wkrs = np.nonzero(shard==s)[0]
+      prmIdx = np.concatenate([(dim*wkrs.reshape((-1, 1)) \
+                                + np.arange(dim)).flatten(),
+                               numWkrs*dim + wkrs]).astype(int)
+      wkrMap = np.zeros(numWkrs, dtype=int)
+      wkrMap[wkrs] = np.arange(len(wkrs))
+      slabels = labels[shard[labels[:,1]]==s]
+      slabels[:,1] = wkrMap[slabels[:,1]]
+      conn, childConn = Pipe()
+      proc = Process(target=_run_shard,
+                     args=(childConn, model.__class__,
+                           model.get_model_param(), slabels, numImgs,
+                           len(wkrs), prmIdx, s, self))
+      proc.daemon = True
+      proc.start()
+      self.conns.append(conn)
+      self.procs.append(proc)
+    for conn in self.conns: conn.recv() # wait until the shards are loaded
+
+  def evaluate(self, xis, wkrPrm):
+    """
+    Evaluates the objective and gradient for the given parameters.
+
+    Output:
+    1. The objective.
+    2. The gradient with respect to the image parameters.
+    3. The gradient with respect to the worker parameters.
+    """
+    self.xis[:] = xis
+    self.wkrPrm[:] = wkrPrm
+    for conn in self.conns: conn.send('eval')
+    for conn in self.conns: conn.recv()
+    return (self.objs.sum(), self.imgGrad.sum(0), self.wkrGrad.copy())
+
+  def close(self):
+    for conn in self.conns: conn.send('stop')
+    for proc in self.procs: proc.join()
+    self.conns, self.procs = [], []
+
+def _run_shard(conn, modelClass, mdlPrm, labels, numImgs, numWkrs, prmIdx,
+               shardIdx, pool):
+  m = modelClass()
+  m.set_model_param(prm=mdlPrm)
+  m.load_data_array(labels, numImgs, numWkrs)
+  annmodel.attach_image_param(m.mPtr,
+                              pool.xis.ctypes.data_as(POINTER(c_double)))
+  # the image prior is only added by the first shard
+  m.set_term_weights(imagePrior=1.0 if shardIdx==0 else 0.0)
+  grad = np.zeros(pool.imgLen+len(prmIdx))
+  conn.send(True)
+  while conn.recv() == 'eval':
+    m.set_worker_param(pool.wkrPrm[prmIdx])
+    pool.objs[shardIdx] = annmodel.objective(m.mPtr)
+    annmodel.gradient(m.mPtr, grad.ctypes.data_as(POINTER(c_double)))
+    pool.imgGrad[shardIdx] = grad[:pool.imgLen]
+    pool.wkrGrad[prmIdx] = grad[pool.imgLen:]
+    conn.send(True)
+
+def optimize_param_sharded(model, numShards, numIter=30, verbose=False):
+  """
+  Sharded version of `Model.optimize_param` for the signal models.
+
+  The image and worker parameters are optimized in turn as in
+  `Model.optimize_param`, but the objective and gradient are evaluated by a
+  `ShardPool` of `numShards` processes. The final parameters are set in
+  `model`.
+  """
+  pool = ShardPool(model, numShards)
+  try:
+    xis = np.array(model.get_image_param_raw())
+    wkrPrm = np.array(model.get_worker_param_raw())
+    for n in range(numIter):
+      if verbose: print "  - iteration %d/%d" % (n+1, numIter)
+      obj, imgGrad, wkrGrad = pool.evaluate(xis, wkrPrm)
+      if not np.all(np.isfinite(imgGrad)) or np.isinf(obj):
+        xis = 0.1*np.random.randn(len(xis))
+      imgFn = lambda x: pool.evaluate(x, wkrPrm)[:2]
+      xis = fmin_l_bfgs_b(imgFn, xis, iprint=-1, maxfun=100)[0]
+      wkrFn = lambda w: pool.evaluate(xis, w)[::2]
+      wkrPrm = fmin_l_bfgs_b(wkrFn, wkrPrm, iprint=-1, maxfun=100)[0]
+  finally:
+    pool.close()
+  model.set_image_param(xis)
+  model.set_worker_param(wkrPrm)
@@ -0,0 +1,180 @@
+"""
+Stochastic minibatch fitting of the signal models.
+
+The images are split into minibatches, each of which is loaded (with all
+the labels of its images) into a model of its own. Visiting a minibatch
+fits the parameters of its images given the current worker parameters,
+which is exact since all labels of the images are in the minibatch, and
+then takes an Adam step on the worker parameters along the minibatch
+gradient, where the label terms are scaled up by the no. of minibatches.
+Each epoch visits every minibatch once, so touches every label a handful
+of times rather than on every function evaluation as in
+`Model.optimize_param`.
+
+Convergence is monitored on a random subset of labels that are held out of
+the minibatches, by the mean negative log-likelihood of the held out labels
+under the current parameters.
+"""
+import numpy as np
+from scipy.optimize import fmin_l_bfgs_b
+from annmodel import annmodel
+from LabelStore import LABEL_STORAGE
+from utils import make_rng
+
+def split_images(labels, numImgs, numBatches, rng=None):
+  """
+  Splits the images into random minibatches of about equal size.
+
+  Output:
+  1. List with an array of image indices for each minibatch.
+  2. List with the rows of `labels` belonging to each minibatch.
+  """
+  rng = make_rng(rng)
+  batch = np.zeros(numImgs, dtype=int)
+  batch[rng.permutation(numImgs)] = np.arange(numImgs) % numBatches
+  imgs = [np.nonzero(batch==b)[0] for b in range(numBatches)]
+  order = np.argsort(batch[labels[:,0]], kind='mergesort')
+  bounds = np.searchsorted(batch[labels[order,0]], np.arange(numBatches+1))
+  rows = [order[bounds[b]:bounds[b+1]] for b in range(numBatches)]
+  return (imgs, rows)
+
+class Adam:
+  """
+  Adam step size adaptation (Kingma & Ba, 2015) for a parameter vector.
+  """
+  def __init__(self, size, stepSize=0.1, beta1=0.9, beta2=0.999, eps=1e-8):
+    self.stepSize, self.beta1, self.beta2, self.eps = \
+      stepSize, beta1, beta2, eps
+    self.m = np.zeros(size)
+    self.v = np.zeros(size)
+    self.t = 0
+
+  def step(self, prm, grad):
+    """
+    Returns the parameters after a step along the gradient `grad`.
+    """
+    self.t += 1
+    self.m = self.beta1*self.m + (1.0-self.beta1)*grad
+    self.v = self.beta2*self.v + (1.0-self.beta2)*grad*grad
+    mhat = self.m/(1.0-self.beta1**self.t)
+    vhat = self.v/(1.0-self.beta2**self.t)
+    return prm - self.stepSize*mhat/(np.sqrt(vhat)+self.eps)
+
+def _sub_model(model, labels, imgs, numWkrs, storage):
+  # model of the labels of the images `imgs`, re-indexed from 0 in order
+  imgMap = np.zeros(model.get_num_imgs(), dtype=np.intc)
+  imgMap[imgs] = np.arange(len(imgs))
+  labels = np.array(labels, dtype=np.intc)
+  labels[:,0] = imgMap[labels[:,0]]
+  m = model.__class__()
+  m.set_model_param(prm=model.get_model_param())
+  m.set_label_storage(storage)
+  m.load_data_array(labels, len(imgs), numWkrs)
+  return m
+
+def _owns_labels(model):
+  # whether the model holds the only reference to labels in the default
+  # storage, which take more memory than an N x 3 array of them
+  sPtr = annmodel.get_label_store(model.mPtr)
+  return bool(sPtr) and annmodel.label_store_get_num_refs(sPtr) == 1 and \
+    annmodel.label_store_get_storage(sPtr) == LABEL_STORAGE.index('default')
+
+def optimize_param_stochastic(model, numEpochs=5, batchSize=100000,
+                              stepSize=0.1, heldOut=0.05, tol=1e-4,
+                              imageIter=20, storage='default', seed=None,
+                              verbose=False):
+  """
+  Stochastic minibatch version of `Model.optimize_param` for the signal
+  models, see the module description.
+
+  Input:
+  - `model`: model with the data loaded, whose current parameters are used
+    as the starting point.
+  - `numEpochs`: [5] max. no. of passes over the minibatches.
+  - `batchSize`: [100000] approx. no. of labels per minibatch.
+  - `stepSize`: [0.1] Adam step size of the worker parameters.
+  - `heldOut`: [0.05] fraction of the labels held out for monitoring.
+  - `tol`: [1e-4] stop when the held out log-likelihood per label improves
+    by less than this over an epoch.
+  - `imageIter`: [20] max. function evaluations when fitting the image
+    parameters of a minibatch.
+  - `storage`: ['default'] label storage of the minibatch models.
+  - `seed`: [None] random state or seed, see `utils.make_rng`.
+  - `verbose`: [False] print progress.
+
+  Output: list with the held out negative log-likelihood per label after
+  each epoch (empty if no labels are held out). The parameters with the
+  best held out log-likelihood are set in `model`.
+
+  The minibatch models hold copies of the labels, so unless the labels of
+  `model` are shared with other models or mapped, they are freed while the
+  epochs run and loaded again at the end.
+  """
+  rng = make_rng(seed)
+  labels = model.get_label_array()
+  numImgs, numWkrs = model.get_num_imgs(), model.get_num_wkrs()
+  imgLen = annmodel.get_image_param_len(model.mPtr)
+  dim = imgLen/numImgs if numImgs > 0 else 0
+  isHeldOut = rng.rand(len(labels)) < heldOut
+  train = labels[~isHeldOut]
+  numBatches = int(np.ceil(len(train)/float(batchSize)))
+  numBatches = max(1, min(numImgs, numBatches))
+  imgs, rows = split_images(train, numImgs, numBatches, rng)
+  batches = []
+  for b in range(numBatches):
+    m = _sub_model(model, train[rows[b]], imgs[b], numWkrs, storage)
+    # the worker gradient of a minibatch is scaled up by numBatches below,
+    # so the worker prior is scaled down to be counted once
+    m.set_term_weights(workerPrior=1.0/numBatches)
+    batches.append(m)
+  monitor = None
+  if isHeldOut.any():
+    hoImgs = np.unique(labels[isHeldOut,0])
+    monitor = _sub_model(model, labels[isHeldOut], hoImgs, numWkrs, storage)
+    monitor.set_term_weights(imagePrior=0.0, workerPrior=0.0)
+  del train, rows
+  xis = np.array(model.get_image_param_raw()).reshape((numImgs, dim))
+  wkrPrm = np.array(model.get_worker_param_raw())
+  freeLabels = _owns_labels(model)
+  if freeLabels:
+    model.clear_data()
+  else:
+    del labels
+  adam = Adam(len(wkrPrm), stepSize)
+  history, best = [], None
+  try:
+    for epoch in range(numEpochs):
+      for b in rng.permutation(numBatches):
+        m, bimgs = batches[b], imgs[b]
+        m.set_worker_param(wkrPrm)
+        x0 = xis[bimgs].flatten()
+        if not np.all(np.isfinite(m.image_gradient(x0))):
+          x0 = 0.1*rng.randn(len(x0))
+        x = fmin_l_bfgs_b(m.image_objective, x0, fprime=m.image_gradient,
+                          iprint=-1, maxfun=imageIter)[0]
+        xis[bimgs] = x.reshape((-1, dim))
+        grad = np.asarray(m.gradient(), dtype=float)[len(x):]
+        wkrPrm = adam.step(wkrPrm, numBatches*grad)
+      if monitor is None:
+        if verbose: print "  - epoch %d/%d" % (epoch+1, numEpochs)
+        continue
+      monitor.set_worker_param(wkrPrm)
+      monitor.set_image_param(xis[hoImgs].flatten())
+      nll = monitor.objective()/monitor.get_num_lbls()
+      if verbose:
+        print "  - epoch %d/%d, held out nll %.6f" % (epoch+1, numEpochs, nll)
+      history.append(nll)
+      if best is None or nll < best[0]:
+        best = (nll, xis.copy(), wkrPrm.copy())
+      if len(history) > 1 and history[-2]-nll < tol:
+        break
+  finally:
+    # the best parameters so far are kept if the epochs are interrupted
+    if not best is None:
+      xis, wkrPrm = best[1], best[2]
+    if freeLabels:
+      model.set_label_storage('default')
+      model.load_data_array(labels, numImgs, numWkrs)
+    model.set_image_param(xis.flatten())
+    model.set_worker_param(wkrPrm)
+  return history
@@ -0,0 +1,172 @@
+"""
+Sweeps over the model parameters (`beta`, `sigx`, `sigw`, `muw`, `sigt`) of
+the signal models on one data set.
+
+The labels are split into a training and a held-out part once, and each
+worker process loads the training labels once into a model (and the
+held-out labels into a second one), which is then refitted for every
+setting it is handed. Settings are handed out as processes become free, and
+each one starts from the fitted parameters of the closest setting that has
+completed so far. The fits stop once the objective stops improving, so that
+warm-started fits only need a few iterations.
+"""
+import time
+import numpy as np
+from utils import make_rng, as_array, TaskPool, pool_state
+
+def param_grid(**values):
+  """
+  Returns the settings of a grid, with all combinations of the values
+  given for each model parameter, e.g. `param_grid(sigx=[.5, 1., 2.],
+  sigw=[1., 3.])`.
+  """
+  settings = [{}]
+  for (key, vals) in sorted(values.iteritems()):
+    settings = [dict(s, **{key : v}) for s in settings for v in vals]
+  return settings
+
+def param_random(numSettings, ranges, logScale=(), seed=None):
+  """
+  Returns random settings of the model parameters.
+
+  Input:
+  - `numSettings`: no. of settings.
+  - `ranges`: dictionary of (parameter -> (min, max)).
+  - `logScale`: [()] parameters sampled uniformly on a log scale.
+  - `seed`: [None] random state or seed, see `utils.make_rng`.
+  """
+  rng = make_rng(seed)
+  settings = [{} for s in range(numSettings)]
+  for (key, (lo, hi)) in sorted(ranges.iteritems()):
+    if key in logScale:
+      vals = np.exp(rng.uniform(np.log(lo), np.log(hi), numSettings))
+    else:
+      vals = rng.uniform(lo, hi, numSettings)
+    for (s, v) in zip(settings, vals): s[key] = float(v)
+  return settings
+
+def run_sweep(model, settings, numProcs=1, numIter=30, tol=1e-5,
+              heldOut=0.1, gt=None, seed=None, verbose=False):
+  """
+  Fits a signal model for each of a list of parameter settings.
+
+  Input:
+  - `model`: model with the data loaded, whose class and model parameters
+    are used for the fits (the settings only override the parameters they
+    hold).
+  - `settings`: list of dictionaries of model parameters, see `param_grid`
+    and `param_random`.
+  - `numProcs`: [1] no. of worker processes.
+  - `numIter`: [30] max. alternations of image and worker parameter
+    optimization per setting (see `Model.optimize_param`).
+  - `tol`: [1e-5] stop a fit when an alternation improves the objective by
+    less than this fraction.
+  - `heldOut`: [0.1] fraction of the labels held out of the fits.
+  - `gt`: [None] ground truth image labels, indexed by image.
+  - `seed`: [None] random state or seed, see `utils.make_rng`.
+  - `verbose`: [False] print progress.
+
+  Output: list with a dictionary for each setting, with the keys `prm`
+  (the model parameters), `objective` (the final objective on the training
+  labels), `heldOut` (the mean log-likelihood of the held out labels),
+  `agreement` (the fraction of held out labels agreeing with the estimated
+  image label), `accuracy` (the fraction of image labels agreeing with `gt`,
+  if given), `warmStart` (the index of the setting the fit started from, or
+  None), `numIter` (alternations run) and `time` (seconds spent fitting).
+  """
+  rng = make_rng(seed)
+  labels = model.get_label_array()
+  numImgs, numWkrs = model.get_num_imgs(), model.get_num_wkrs()
+  isHeldOut = rng.rand(len(labels)) < heldOut
+  base = model.get_model_param()
+  prms = [dict(base, **s) for s in settings]
+  # distances between settings are measured relative to the swept ranges
+  keys = sorted(set(k for s in settings for k in s.keys()))
+  pts = np.array([[p[k] for k in keys] for p in prms], dtype=float)
+  if len(keys) > 0:
+    scale = pts.max(0)-pts.min(0)
+    pts /= np.where(scale > 0, scale, 1.0)
+  initArgs = (model.__class__, base, labels[~isHeldOut], labels[isHeldOut],
+              numImgs, numWkrs, gt, numIter, tol)
+  results = [None]*len(prms)
+  pending, done, todo = {}, [], range(len(prms))
+  with TaskPool(numProcs, _init_worker, initArgs) as pool:
+    while todo or pending:
+      while todo and len(pending) < numProcs:
+        s = todo.pop(0)
+        warm = None
+        if done:
+          dist = ((pts[done]-pts[s])**2).sum(1)
+          warm = done[int(np.argmin(dist))]
+        start = None if warm is None else results[warm]['param']
+        pending[s] = (warm, pool.submit(_fit_setting, prms[s], start))
+      ready = [s for (s, (w, res)) in pending.iteritems() if res.ready()]
+      if not ready:
+        time.sleep(0.01)
+        continue
+      for s in ready:
+        warm, res = pending.pop(s)
+        results[s] = res.get()
+        results[s]['warmStart'] = warm
+        done.append(s)
+        if verbose:
+          print "  - setting %d/%d: objective %.4f, held out %.4f" % \
+            (len(done), len(prms), results[s]['objective'],
+             results[s]['heldOut'])
+  for r in results: del r['param']
+  return results
+
+def _init_worker(modelClass, mdlPrm, train, test, numImgs, numWkrs, gt,
+                 numIter, tol):
+  m = modelClass()
+  m.set_model_param(prm=mdlPrm)
+  m.load_data_array(train, numImgs, numWkrs)
+  t = modelClass()
+  t.set_model_param(prm=mdlPrm)
+  t.load_data_array(test, numImgs, numWkrs)
+  # the objective of the held out model is minus their log-likelihood
+  t.set_term_weights(imagePrior=0.0, workerPrior=0.0)
+  # state of the processes, see `utils.TaskPool`
+  return {
+    'model' : m, 'test' : t, 'testLabels' : test, 'gt' : gt,
+    'numIter' : numIter, 'tol' : tol,
+    'reset' : (m.get_image_param_raw(), m.get_worker_param_raw()),
+  }
+
+def _fit_setting(prm, start):
+  m, t = pool_state['model'], pool_state['test']
+  t0 = time.time()
+  m.set_model_param(prm=prm)
+  if start is None: start = pool_state['reset']
+  m.set_image_param(start[0])
+  m.set_worker_param(start[1])
+  # alternate as in `Model.optimize_param`, until the objective settles
+  obj = m.objective()
+  for n in range(pool_state['numIter']):
+    m.optimize_image_param()
+    m.optimize_worker_param()
+    prevObj, obj = obj, m.objective()
+    if prevObj-obj < pool_state['tol']*abs(obj):
+      break
+  imgPrm, wkrPrm = m.get_image_param_raw(), m.get_worker_param_raw()
+  res = {
+    'prm' : prm,
+    'objective' : obj,
+    'numIter' : n+1,
+    'time' : time.time()-t0,
+    'param' : (imgPrm, wkrPrm),
+    'agreement' : None,
+    'accuracy' : None,
+  }
+  t.set_model_param(prm=prm)
+  t.set_image_param(imgPrm)
+  t.set_worker_param(wkrPrm)
+  test = pool_state['testLabels']
+  res['heldOut'] = -t.objective()/max(1, len(test))
+  if hasattr(m, 'get_labels'):
+    est = as_array(m.get_labels())
+    if len(test) > 0:
+      res['agreement'] = np.mean(est[test[:,0]] == test[:,2])
+    if not pool_state['gt'] is None:
+      res['accuracy'] = np.mean(est == np.asarray(pool_state['gt']))
+  return res
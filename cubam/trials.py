@@ -0,0 +1,161 @@
+"""
+Runs models on many sub-samples of one label set held in memory.
+
+The full label set is loaded once into a `LabelSet`, each sub-sample is a
+boolean mask over its label array, and the models are loaded from a view of
+the masked labels rather than from per-trial data files. Within a trial,
+the masked labels are loaded once into a `LabelStore` that all models are
+attached to.
+"""
+import numpy as np
+from utils import read_label_array, label_array_size, make_rng, as_array
+from LabelStore import LabelStore
+
+class LabelSet:
+  """
+  A set of (image, worker, label) triplets held as an integer array.
+  """
+  def __init__(self, labels, numImgs=None, numWkrs=None, imgIds=None,
+               wkrIds=None):
+    """
+    Arguments:
+      - `labels`: N x 3 array of zero-indexed (image, worker, label) rows
+      - `numImgs`: no. of images (defaults to the largest image id+1)
+      - `numWkrs`: no. of workers (defaults to the largest worker id+1)
+      - `imgIds`: [None] list of original image ids, by index
+      - `wkrIds`: [None] list of original worker ids, by index
+    """
+    self.labels = np.asarray(labels, dtype=np.intc).reshape((-1, 3))
+    self.numImgs, self.numWkrs = label_array_size(self.labels, numImgs,
+                                                  numWkrs)
+    self.imgIds = imgIds
+    self.wkrIds = wkrIds
+
+  @classmethod
+  def from_datafile(cls, filename):
+    """
+    Loads a zero-indexed data file (see `utils.write_data_file`).
+    """
+    labels, numImgs, numWkrs = read_label_array(filename)
+    return cls(labels, numImgs, numWkrs)
+
+  @classmethod
+  def from_triplets(cls, rows):
+    """
+    Builds a label set from (image id, worker id, label) triplets, where the
+    ids may be any hashable values (e.g. image filenames).
+    """
+    imgIdx, wkrIdx = {}, {}
+    labels = np.zeros((len(rows), 3), dtype=np.intc)
+    for (k, (imgId, wkrId, label)) in enumerate(rows):
+      if not imgIdx.has_key(imgId): imgIdx[imgId] = len(imgIdx)
+      if not wkrIdx.has_key(wkrId): wkrIdx[wkrId] = len(wkrIdx)
+      labels[k] = (imgIdx[imgId], wkrIdx[wkrId], int(label))
+    imgIds = sorted(imgIdx.keys(), key=imgIdx.get)
+    wkrIds = sorted(wkrIdx.keys(), key=wkrIdx.get)
+    return cls(labels, len(imgIds), len(wkrIds), imgIds, wkrIds)
+
+  def __len__(self):
+    return len(self.labels)
+
+  def subsample_images(self, annPerImg, rng=None):
+    """
+    Returns a mask keeping (at most) `annPerImg` random labels per image.
+    """
+    rng = make_rng(rng)
+    # sort the labels by image, in random order within each image
+    order = np.lexsort((rng.rand(len(self.labels)), self.labels[:,0]))
+    imgs = self.labels[order,0]
+    start = np.searchsorted(imgs, imgs)
+    mask = np.zeros(len(self.labels), dtype=bool)
+    mask[order] = (np.arange(len(order))-start) < annPerImg
+    return mask
+
+  def subsample_workers(self, numWkr, rng=None):
+    """
+    Returns a mask keeping all labels of `numWkr` random workers.
+    """
+    rng = make_rng(rng)
+    wkrs = rng.permutation(self.numWkrs)[:numWkr]
+    keep = np.zeros(self.numWkrs, dtype=bool)
+    keep[wkrs] = True
+    return keep[self.labels[:,1]]
+
+  def view(self, mask=None):
+    """
+    Returns the labels selected by a mask, with the workers re-indexed.
+
+    The image indices are kept, so that estimates line up across different
+    masks, while the workers are re-indexed from 0 (in order of their
+    original index).
+
+    Output:
+    1. M x 3 label array.
+    2. Array with the original worker index of each new worker index.
+    """
+    labels = self.labels if mask is None else self.labels[mask]
+    wkrs = np.unique(labels[:,1])
+    wkrMap = np.zeros(self.numWkrs, dtype=np.intc)
+    wkrMap[wkrs] = np.arange(len(wkrs))
+    labels = np.column_stack([labels[:,0], wkrMap[labels[:,1]],
+                              labels[:,2]]).astype(np.intc)
+    return (labels, wkrs)
+
+  def load_model(self, model, mask=None):
+    """
+    Loads the labels selected by a mask into a model.
+
+    Output:
+    1. Array with the original worker index of each model worker index.
+    """
+    labels, wkrs = self.view(mask)
+    model.load_data_array(labels, self.numImgs, len(wkrs))
+    return wkrs
+
+def run_trials(labelSet, models, numTrials, annPerImg=None, numWkr=None,
+               seed=None, optimizePrm=None, verbose=False):
+  """
+  Fits models on random sub-samples of a label set.
+
+  Each trial draws one mask (keeping `annPerImg` labels per image and/or
+  the labels of `numWkr` workers), which is shared by all the models.
+
+  Input:
+  - `labelSet`: `LabelSet` holding all labels.
+  - `models`: dictionary of (name -> model class or factory function).
+  - `numTrials`: number of trials.
+  - `annPerImg`: [None] labels kept per image.
+  - `numWkr`: [None] workers kept.
+  - `seed`: [None] random state or seed, see `utils.make_rng`.
+  - `optimizePrm`: [None] arguments for `optimize_param`.
+  - `verbose`: [False] print progress.
+
+  Output: dictionary of (name -> list of per trial estimates), where each
+  estimate is a dictionary with the keys `labels` and `images` (label and
+  image parameter arrays indexed by image), `workers` (worker parameters)
+  and `wkrIdx` (original worker index of each worker).
+  """
+  rng = make_rng(seed)
+  if optimizePrm is None: optimizePrm = {}
+  results = dict((name, []) for name in models.keys())
+  for t in range(numTrials):
+    if verbose: print "- trial %d/%d" % (t+1, numTrials)
+    mask = np.ones(len(labelSet), dtype=bool)
+    if not annPerImg is None:
+      mask &= labelSet.subsample_images(annPerImg, rng)
+    if not numWkr is None:
+      mask &= labelSet.subsample_workers(numWkr, rng)
+    labels, wkrs = labelSet.view(mask)
+    store = LabelStore()
+    store.load_data_array(labels, labelSet.numImgs, len(wkrs))
+    for (name, factory) in models.iteritems():
+      m = factory()
+      m.attach_labels(store)
+      m.optimize_param(**optimizePrm)
+      results[name].append({
+        'labels' : as_array(m.get_labels()),
+        'images' : as_array(m.get_image_param_raw()),
+        'workers' : as_array(m.get_worker_param_raw()),
+        'wkrIdx' : wkrs,
+      })
+  return results
@@ -1,6 +1,5 @@
-import yaml, pickle, os
+import pickle, os
 import numpy as np
-from scipy.stats import pearsonr, spearmanr
 from tempfile import mkstemp
 
 ###########################################################################
@@ -19,6 +18,35 @@ def randtn(minlim=-3., maxlim=3.):
         rn = np.random.randn()
     return rn
 
+def randtn_array(num, minlim=-3., maxlim=3., rng=None):
+    """
+    Vectorized version of `randtn`, samples `num` values at once.
+    
+    Inputs:
+    - `num`: number of samples to draw.
+    - `minlim`: [-3] the lower bound to truncate at.
+    - `maxlim`: [-3] the upper bound to truncate at.
+    - `rng`: [None] random state or seed, see `make_rng`.
+    """
+    rng = make_rng(rng)
+    rn = rng.randn(num)
+    bad = (rn<minlim) | (rn>maxlim)
+    while bad.any():
+        rn[bad] = rng.randn(bad.sum())
+        bad = (rn<minlim) | (rn>maxlim)
+    return rn
+
+def make_rng(seed=None):
+    """
+    Returns a `numpy.random.RandomState` for a seed.
+
+    If `seed` already is a random state it is returned as is, and if it is
+    `None` the global numpy random state is used.
+    """
+    if isinstance(seed, np.random.RandomState): return seed
+    if seed is None: return np.random.mtrand._rand
+    return np.random.RandomState(seed)
+
 def correlation(u, v):
     """
     Compute the Spearman and Person correlation coefficients.
@@ -31,6 +59,7 @@ def correlation(u, v):
     1. Spearman correlation.
     2. Pearson correlation.
     """
+    from scipy.stats import pearsonr, spearmanr
     return [spearmanr(u,v)[0], pearsonr(u,v)[0]]
 
 def tw2tsw(tj, wj):
@@ -84,6 +113,7 @@ def normalize_data_file(filename, outpfx, skipFirst=False):
         outfile.write("%d %d %d\n" % (imgIds[imgId], wkrIds[wkrId], label))
     outfile.close()
     # save mapping
+    import yaml
     outfile = open("%s-mapping.yaml" % outpfx, 'w')
     yaml.dump({'image' : imgIds, 'worker' : wkrIds}, outfile)
     outfile.close()
@@ -117,6 +147,45 @@ def write_data_file(labels, filename=None):
     f.close()
     return filename
 
+def label_array_size(labels, numImgs=None, numWkrs=None):
+    """
+    Checks a (image id, worker id, label) array and returns its size.
+
+    Input:
+    - `labels`: N x 3 array of zero-indexed labels.
+    - `numImgs`: [None] no. of images, defaults to the largest image id+1.
+    - `numWkrs`: [None] no. of workers, defaults to the largest worker id+1.
+
+    Output:
+    1. The no. of images.
+    2. The no. of workers.
+    """
+    if numImgs is None:
+        numImgs = int(labels[:,0].max())+1 if len(labels) else 0
+    if numWkrs is None:
+        numWkrs = int(labels[:,1].max())+1 if len(labels) else 0
+    if len(labels):
+        assert labels[:,0].min()>=0 and labels[:,0].max()<numImgs, \
+          "Image ids must be in the range [0, %d)" % numImgs
+        assert labels[:,1].min()>=0 and labels[:,1].max()<numWkrs, \
+          "Worker ids must be in the range [0, %d)" % numWkrs
+    return (numImgs, numWkrs)
+
+def read_label_array(filename):
+    """
+    Reads a text-based data file (see `write_data_file`) into an array.
+
+    Output:
+    1. N x 3 integer array of (image id, worker id, label) rows.
+    2. The no. of images given in the header.
+    3. The no. of workers given in the header.
+    """
+    f = open(filename)
+    numImgs, numWkrs, numLbls = [int(c) for c in f.readline().split()]
+    labels = np.fromstring(f.read(), dtype=int, sep=' ')
+    f.close()
+    return (labels.reshape((-1, 3)), numImgs, numWkrs)
+
 def read_data_file(filename, skipFirst=True):
     """
     Reads a text-based data file and returns a structured dictionary.
@@ -188,6 +257,95 @@ def sample_labels(model, wkrs, imgs):
               for ii in range(len(imgs)) for wi in range(len(wkrs))]
     return labels
 
+def sample_design(numImgs, numWkrs, wkrsPerImg=None, activity=None,
+                  rng=None, chunkSize=1000000):
+    """
+    Samples which workers label which images, in chunks of images.
+
+    If `wkrsPerImg` is `None`, every worker labels every image. Otherwise
+    each image is labeled by `wkrsPerImg` distinct workers, drawn with
+    probabilities proportional to `(j+1)**-activity` for worker `j`, so
+    that `activity` gives a power-law worker activity (or uniform activity
+    if it is `None` or 0).
+
+    Input:
+    - `numImgs`: number of images.
+    - `numWkrs`: number of workers.
+    - `wkrsPerImg`: [None] number of workers per image.
+    - `activity`: [None] power-law exponent of the worker activity.
+    - `rng`: [None] random state or seed, see `make_rng`.
+    - `chunkSize`: [1000000] approximate no. of labels per chunk.
+
+    Output: generator of (image index array, worker index array) chunks.
+    """
+    rng = make_rng(rng)
+    if wkrsPerImg is None or wkrsPerImg >= numWkrs:
+        # dense design
+        numRows = max(1, chunkSize/numWkrs)
+        for i0 in range(0, numImgs, numRows):
+            i1 = min(i0+numRows, numImgs)
+            imgIdx = np.repeat(np.arange(i0, i1), numWkrs)
+            wkrIdx = np.tile(np.arange(numWkrs), i1-i0)
+            yield (imgIdx, wkrIdx)
+        return
+    # sparse design: pick the top-k of the log-weights perturbed by Gumbel
+    # noise, which samples k workers without replacement for each image
+    logw = np.zeros(numWkrs)
+    if activity:
+        logw = -activity*np.log(np.arange(1, numWkrs+1))
+    numRows = max(1, min(chunkSize/wkrsPerImg, chunkSize/numWkrs))
+    for i0 in range(0, numImgs, numRows):
+        i1 = min(i0+numRows, numImgs)
+        keys = logw - np.log(-np.log(rng.rand(i1-i0, numWkrs)))
+        wkrIdx = np.argpartition(-keys, wkrsPerImg-1, axis=1)
+        wkrIdx = wkrIdx[:,:wkrsPerImg].flatten()
+        imgIdx = np.repeat(np.arange(i0, i1), wkrsPerImg)
+        yield (imgIdx, wkrIdx)
+
+def generate_data_arrays(model, numImgs, numWkrs, filename, wkrsPerImg=None,
+                         activity=None, seed=None, wkrPrm={}, imgPrm={},
+                         chunkSize=1000000):
+    """
+    Vectorized version of `generate_data` supporting sparse designs.
+
+    Parameters and labels are sampled as arrays using the model functions
+    `sample_worker_param_array`, `sample_image_param_array` and
+    `sample_label_array`, and the labels are streamed to the data file in
+    chunks (see `write_data_file` for the format). The first line of the
+    file holds `numImgs` and `numWkrs`, even if some workers end up with no
+    labels in a sparse design.
+
+    Input:
+    - `model`: model instance to use for sampling parameters and labels.
+    - `numImgs`: number of image parameters to generate.
+    - `numWkrs`: number of worker parameters to generate.
+    - `filename`: filename of the output file.
+    - `wkrsPerImg`: [None] workers per image, see `sample_design`.
+    - `activity`: [None] worker activity exponent, see `sample_design`.
+    - `seed`: [None] random state or seed, see `make_rng`.
+    - `wkrPrm`: [{}] arguments for `model.sample_worker_param_array`.
+    - `imgPrm`: [{}] arguments for `model.sample_image_param_array`.
+    - `chunkSize`: [1000000] approximate no. of labels per chunk.
+
+    Output:
+    1. Dictionary of image and worker parameter arrays, with two keys: img
+       and wkr.
+    """
+    rng = make_rng(seed)
+    wkrs = model.sample_worker_param_array(numWkrs, rng=rng, **wkrPrm)
+    imgs = model.sample_image_param_array(numImgs, rng=rng, **imgPrm)
+    numLbls = numImgs*(numWkrs if wkrsPerImg is None \
+                       else min(wkrsPerImg, numWkrs))
+    f = open(filename, 'w')
+    f.write('%d %d %d\n' % (numImgs, numWkrs, numLbls))
+    for (imgIdx, wkrIdx) in sample_design(numImgs, numWkrs, wkrsPerImg,
+                                          activity, rng, chunkSize):
+        labels = model.sample_label_array(wkrs, imgs, imgIdx, wkrIdx, rng)
+        rows = np.column_stack([imgIdx, wkrIdx, labels]).astype(int)
+        f.write(('%d %d %d\n' * len(rows)) % tuple(rows.ravel()))
+    f.close()
+    return { 'wkr' : wkrs, 'img' : imgs }
+
 def save_param_file(prm, filename):
     """
     Saves a parameter dictionary as a filename.
@@ -202,6 +360,73 @@ def load_param_file(filename):
     """
     return pickle.load(open(filename))
 
+# magic string and alignment (in bytes) of the arrays in state files
+STATE_MAGIC = 'CUBAMST1'
+STATE_ALIGN = 64
+
+def save_state_file(filename, header, arrays):
+    """
+    Saves a header dictionary and named arrays to a binary state file.
+
+    The file starts with `STATE_MAGIC`, the length of the header (as a
+    little-endian 64-bit integer) and the pickled header, followed by the
+    raw array data, where each array is aligned to `STATE_ALIGN` bytes so
+    that it can be memory-mapped when loaded.
+
+    Input:
+    - `filename`: filename of the output file.
+    - `header`: dictionary of (picklable) values.
+    - `arrays`: dictionary of (name -> numpy array).
+    """
+    arrays = dict((name, np.ascontiguousarray(arr)) \
+                  for (name, arr) in arrays.iteritems())
+    header = dict(header)
+    header['arrays'] = [(name, arr.dtype.str, arr.shape) \
+                        for (name, arr) in sorted(arrays.iteritems())]
+    hdr = pickle.dumps(header, 2)
+    f = open(filename, 'wb')
+    f.write(STATE_MAGIC)
+    f.write(np.array([len(hdr)], dtype='<u8').tostring())
+    f.write(hdr)
+    for (name, dtype, shape) in header['arrays']:
+        f.write('\0' * (-f.tell() % STATE_ALIGN))
+        arrays[name].tofile(f)
+    f.close()
+
+def load_state_file(filename, mmap=True):
+    """
+    Loads a state file written by `save_state_file`.
+
+    Input:
+    - `filename`: filename of the state file.
+    - `mmap`: [True] memory-map the arrays (read-only) rather than reading
+      them into memory.
+
+    Output:
+    1. The header dictionary.
+    2. Dictionary of (name -> numpy array).
+    """
+    f = open(filename, 'rb')
+    assert f.read(len(STATE_MAGIC)) == STATE_MAGIC, \
+      "%s is not a state file" % filename
+    hlen = int(np.fromstring(f.read(8), dtype='<u8')[0])
+    header = pickle.loads(f.read(hlen))
+    arrays = {}
+    offset = f.tell()
+    for (name, dtype, shape) in header['arrays']:
+        offset += -offset % STATE_ALIGN
+        count = int(np.prod(shape))
+        if mmap and count > 0:
+            arrays[name] = np.memmap(filename, dtype=dtype, mode='r',
+                                     offset=offset, shape=shape)
+        else:
+            f.seek(offset)
+            arrays[name] = np.fromfile(f, dtype=dtype,
+                                       count=count).reshape(shape)
+        offset += count*np.dtype(dtype).itemsize
+    f.close()
+    return (header, arrays)
+
 ###########################################################################
 ### SAMPLING OF REAL DATA
 ###########################################################################
@@ -221,6 +446,7 @@ def subsample_datafile(filename, tarDir, numTrials, annPerImg, gt=None,
     Outputs:
     - list of filenames to 'labels', 'gt' and 'mapping' (list of dicts)
     """
+    import yaml
     # build a representation for all the data
     imgLabels = {}
     for line in open(filename):
@@ -299,16 +525,13 @@ def majority_vote(imgLbls):
     return zi
 
 def error_rates(exi, gxi):
-    n = len(exi)
-    gt = np.array([xi>0.0 for xi in gxi])
-    est = np.array([xi>0.0 for xi in exi])
-    # error rate
-    er = 1.0-float(sum(gt==est))/n
-    # false alarm rate
-    far = float(sum(est[gt==False]))/sum(gt==False)
-    # miss rate
-    mr = float(sum(est[gt==True]==False))/sum(gt==True)
-    return [er, far, mr]
+    """
+    Computes the error, false alarm and miss rates of the estimated image
+    parameters `exi` given the ground truth `gxi`, thresholded at 0 (see
+    `evaluation.error_rates` for many trials at once).
+    """
+    from evaluation import error_rates as trial_error_rates
+    return [float(r[0]) for r in trial_error_rates(exi, gxi)]
 
 def compute_error(est, gt):
     """
@@ -320,5 +543,96 @@ def compute_error(est, gt):
     if type(gt)==type(dict()):
         gt = [gt[k] for k in sorted(gt.keys())]
     assert len(gt)==len(est), "Estimates and ground truth must be of same size"
-    numErrs = sum([int(gt[i]!=est[i]) for i in range(len(est))])
-    return float(numErrs)/len(est)
+    return float(np.mean(np.asarray(est)!=np.asarray(gt)))
+
+def as_array(est):
+    """
+    Returns the estimates of a model as an array, where models return them
+    either as lists or as dictionaries keyed by index.
+    """
+    if type(est)==type(dict()):
+        est = [est[k] for k in sorted(est.keys())]
+    return np.asarray(est)
+
+###########################################################################
+### PARALLEL TASKS
+###########################################################################
+# per process state of the tasks of a `TaskPool`, as set up by its `initFn`
+pool_state = {}
+
+def _init_pool_state(initFn, initArgs):
+    pool_state.clear()
+    if not initFn is None:
+        pool_state.update(initFn(*initArgs))
+
+class _Done:
+    # result of a task run in this process, mimicking an AsyncResult
+    def __init__(self, value): self.value = value
+    def ready(self): return True
+    def get(self): return self.value
+
+class TaskPool:
+    """
+    Runs tasks in a pool of processes, or in this process if the pool has
+    one process. Each process first calls `initFn(*initArgs)`, which returns
+    a dictionary of state shared by the tasks (e.g. labels loaded once per
+    process) that the tasks find in `pool_state`:
+
+      with TaskPool(4, load_labels, (labels,)) as pool:
+          for res in pool.imap_unordered(fit, tasks):
+              print res
+
+    The processes are terminated when the block is left.
+    """
+    def __init__(self, numProcs=1, initFn=None, initArgs=()):
+        """
+        Arguments:
+          - `numProcs`: [1] no. of processes (all cores if None)
+          - `initFn`: [None] function setting up the state of a process
+          - `initArgs`: [()] arguments of `initFn`
+        """
+        # multiprocessing is only imported when a pool is used
+        if numProcs is None:
+            from multiprocessing import cpu_count
+            numProcs = cpu_count()
+        self.pool = None
+        if numProcs > 1:
+            from multiprocessing import Pool
+            self.pool = Pool(numProcs, _init_pool_state, (initFn, initArgs))
+        else:
+            _init_pool_state(initFn, initArgs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def submit(self, fn, *args):
+        """
+        Runs `fn(*args)` and returns its result as an `AsyncResult` (with
+        `ready` and `get`), run at once if there are no processes.
+        """
+        if self.pool is None:
+            return _Done(fn(*args))
+        return self.pool.apply_async(fn, args)
+
+    def imap_unordered(self, fn, tasks):
+        """
+        Iterates over `fn(task)` for a list of tasks in the order they are
+        done. The tasks are handed out one at a time, as they may take very
+        different times.
+        """
+        if self.pool is None:
+            return (fn(task) for task in tasks)
+        return self.pool.imap_unordered(fn, tasks, 1)
+
+    def close(self):
+        """
+        Terminates the processes, or clears the state of this process.
+        """
+        if self.pool is None:
+            pool_state.clear()
+        else:
+            self.pool.terminate()
+            self.pool = None
@@ -9,11 +9,11 @@ You should just be able to run it:
 
 """
 import os, pickle, yaml
-from numpy import random, mean, std, sqrt
+from numpy import random, array
 from matplotlib.pylab import figure
 
-from cubam import Binary1dSignalModel, BinaryBiasModel
-from cubam.utils import majority_vote, read_data_file
+from cubam.evaluation import error_rates, bootstrap_ci
+from cubam.experiments import run_experiment
 
 ############################################################################
 # TASKS
@@ -26,6 +26,11 @@ tasks = ['gen-data','run-models','show-results']
 numWkrList = [4, 12, 20]
 numImg = 500
 numTrial = 40
+models = {
+    'signal' : ('signal', None),
+    'bias' : ('bias', None),
+    'majority' : ('majority', { 'addNoise' : True }),
+}
 
 ############################################################################
 # OUTPUT LOCATION
@@ -85,49 +90,38 @@ task = 'run-models'
 rateFile = '%s-rates.pickle' % resDir
 if task in tasks:
     dinfo = pickle.load(open(dinfoFile))
-    gzi = dinfo['gt']
-    errRates = { 'signal' : {}, 'majority' : {}, 'bias' : {} }
-    getParameter = lambda prmdict, pidx: [prmdict[i][pidx] for i \
-                                          in range(len(prmdict))]
+    gt = array(dinfo['gt'], dtype=bool)
+    # fit the models to all trials in parallel, resuming an interrupted run
+    datasets = dict(('w%02d' % numWkr, trialList) \
+                    for (numWkr, trialList) in dinfo['filemap'])
+    results = run_experiment(datasets, models, '%s-fits' % resDir,
+                             numProcs=None, seed=rndseed, verbose=True)
+    errRates = dict((alg, {}) for alg in models.keys())
+    errCIs = dict((alg, {}) for alg in models.keys())
     for (numWkr, trialList) in dinfo['filemap']:
-        print "Processing %d workers" % numWkr
-        for alg in errRates.keys(): errRates[alg][numWkr] = []
-        for dfile in trialList:
-            # Binary Signal Model
-            m = Binary1dSignalModel(filename=dfile)
-            m.optimize_param()
-            exi = getParameter(m.get_image_param(), 0)
-            comperr = lambda ez: float(sum([ez[id]!=gzi[id] for id \
-              in range(dinfo['numImg'])]))/dinfo['numImg']
-            err = comperr([exi[id]>0. for id in range(dinfo['numImg'])])
-            errRates['signal'][numWkr].append(err)
-            # Binary Bias Model
-            m = BinaryBiasModel(filename=dfile)
-            m.optimize_param()
-            iprm = m.get_image_param_raw()
-            err = comperr([iprm[id]>.5 for id in range(dinfo['numImg'])])
-            errRates['bias'][numWkr].append(err)
-            # majority
-            labels = read_data_file(dfile)
-            ezis = majority_vote(labels['image'])
-            err = comperr([ezis[id] for id in range(dinfo['numImg'])])
-            errRates['majority'][numWkr].append(err)
+        # evaluate all trials at once
+        for (alg, res) in results['w%02d' % numWkr].iteritems():
+            errRates[alg][numWkr] = error_rates(res['labels'], gt)[0]
+            rate, lower, upper = bootstrap_ci(res['labels'], gt, seed=rndseed)
+            errCIs[alg][numWkr] = (lower[0], upper[0])
     # save result
     f = open(rateFile, 'w')
-    pickle.dump(errRates, f); f.close()
+    pickle.dump((errRates, errCIs), f); f.close()
 
 ############################################################################
 # PLOT THE ERROR RATE VS NO OF WORKERS FOR EACH ALGORITHM
 ############################################################################
 task = 'show-results'
 if task in tasks:
-    errRates = pickle.load(open(rateFile))
+    errRates, errCIs = pickle.load(open(rateFile))
     exps = [('signal', 'NIPS 2010'), ('majority', 'majority'), ('bias', 'Dawid & Skene')]
     numWkrList = sorted(errRates[exps[0][0]].keys())
     fig = figure(1, (5.5,3)); fig.clear(); ax = fig.add_subplot(1,1,1)
     for (expt, legname) in exps:
-        rates = [mean(errRates[expt][nw]) for nw in numWkrList]
-        erbs = [std(errRates[expt][nw])/sqrt(numTrial) for nw in numWkrList]
+        rates = array([errRates[expt][nw].mean() for nw in numWkrList])
+        # asymmetric error bars from the bootstrap confidence intervals
+        cis = array([errCIs[expt][nw] for nw in numWkrList])
+        erbs = [rates-cis[:,0], cis[:,1]-rates]
         ax.errorbar(numWkrList, rates, yerr=erbs, label=legname, lw=3)
     ax.set_xlabel('number of annotators', fontsize=16)
     ax.set_ylabel('error rate', fontsize=16)
@@ -0,0 +1,90 @@
+"""
+This script fits the NIPS 2010 model to a large synthetic data set, once
+with the labels loaded in memory and once with the labels memory-mapped from
+a label store file, and reports the load and fit times, the memory held for
+the labels and the rate at which the objective and gradient scan them.
+
+You should just be able to run it:
+
+  python out-of-core.py
+
+"""
+import os, time
+
+from cubam import Binary1dSignalModel
+from cubam.Model import build_label_store
+from cubam.utils import generate_data_arrays
+
+############################################################################
+# TASKS
+############################################################################
+tasks = ['gen-data', 'build-store', 'run-models']
+
+############################################################################
+# DEMO PARAMETERS
+############################################################################
+numImgs = 200000
+numWkrs = 300
+wkrsPerImg = 10
+numIter = 3
+
+############################################################################
+# OUTPUT LOCATION
+############################################################################
+resDir = 'results'
+filePrefix = '%s/%s' % (resDir, __file__[:-3])
+dataFile = '%s.txt' % filePrefix
+storeFile = '%s.lbl' % filePrefix
+
+############################################################################
+# GENERATE SYNTHETIC DATA FOR THE DEMO
+############################################################################
+task = 'gen-data'
+if not os.path.exists(resDir): os.makedirs(resDir)
+if task in tasks:
+    print "Generating Synthetic Data..."
+    generate_data_arrays(Binary1dSignalModel(), numImgs, numWkrs, dataFile,
+                         wkrsPerImg=wkrsPerImg, activity=1.0, seed=3)
+
+############################################################################
+# BUILD THE LABEL STORE
+############################################################################
+task = 'build-store'
+if task in tasks:
+    print "Building Label Store..."
+    t0 = time.time()
+    build_label_store(dataFile, storeFile)
+    print "  %.2f s, %.1f MB" % (time.time()-t0,
+                                 os.path.getsize(storeFile)/1e6)
+
+############################################################################
+# RUN THE MODELS
+############################################################################
+task = 'run-models'
+if task in tasks:
+    print "Running Models..."
+    print "%-10s %8s %8s %10s %12s %12s %12s" % ('labels', 'load [s]',
+        'fit [s]', 'held [MB]', 'scan [Ml/s]', 'read [MB/s]', 'objective')
+    for mode in ['in-memory', 'mapped']:
+        model = Binary1dSignalModel()
+        t0 = time.time()
+        if mode == 'mapped':
+            model.load_data_mapped(storeFile)
+        else:
+            model.load_data(dataFile)
+        loadTime = time.time()-t0
+        t0 = time.time()
+        model.optimize_param(numIter=numIter)
+        fitTime = time.time()-t0
+        stats = model.get_stats()
+        # each objective and gradient call scans all labels once by image
+        scan = stats['objective']['labels'] + stats['gradient']['labels']
+        scanSecs = (stats['objective']['ns'] + stats['gradient']['ns'])/1e9
+        read = '-'
+        if mode == 'mapped':
+            # the scans read the image half of the label store
+            read = '%.1f' % (scan/model.get_num_lbls() \
+                             *stats['mapped_bytes']/2.0/scanSecs/1e6)
+        print "%-10s %8.2f %8.2f %10.1f %12.1f %12s %12.2f" % (mode,
+            loadTime, fitTime, stats['load_bytes']/1e6, scan/scanSecs/1e6,
+            read, model.objective())
@@ -3,10 +3,13 @@ from distutils.core import setup, Extension
 # C++ implementation sources
 cppDir = 'src'
 cppFiles = [
+  'BatchFit.cpp',
   'Binary1dSignalModel.cpp',
   'BinaryModel.cpp',
   'BinaryNdSignalModel.cpp',
   'BinarySignalModel.cpp',
+  'DataFile.cpp',
+  'LabelStore.cpp',
   'Model.cpp',
   'annmodel.cpp',
   'utils.cpp'
@@ -19,5 +22,7 @@ setup (name='CUBAM',
   author = 'Peter Welinder',
   author_email = 'peter@welinder.se',
   url = 'http://github.com/welinder/cubam',
-  ext_modules = [Extension('cubamcpp', sources=sources)],
+  ext_modules = [Extension('cubamcpp', sources=sources,
+                          extra_compile_args=['-std=c++11', '-pthread'],
+                          extra_link_args=['-pthread'])],
   packages=['cubam'])
\ No newline at end of file
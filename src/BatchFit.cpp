@@ -0,0 +1,225 @@
+#include <cmath>
+#include <random>
+#include <vector>
+#include "utils.hpp"
+#include "annmodel.hpp"
+#include "Model.hpp"
+
+#include "BatchFit.hpp"
+
+using namespace std;
+
+// L-BFGS settings, those of fmin_l_bfgs_b (m=10, pgtol=1e-5, factr=1e7)
+#define LBFGS_MEMORY 10
+#define LBFGS_PGTOL 1e-5
+#define LBFGS_FTOL 2.220446049250313e-09
+// sufficient decrease of the backtracking line search
+#define LBFGS_ARMIJO 1e-4
+#define LBFGS_MIN_STEP 1e-20
+// as Model.optimize_image_param
+#define MAX_RESAMPLE_TRIES 10
+
+static double dot(int n, const double *a, const double *b) {
+  double s = 0.0;
+  for (int k=0; k<n; k++)
+    s += a[k]*b[k];
+  return s;
+}
+
+static bool all_finite(int n, const double *a) {
+  for (int k=0; k<n; k++)
+    if (!isfinite(a[k]))
+      return false;
+  return true;
+}
+
+double minimize_lbfgs(int n, double *x,
+                      const function<double(const double*, double*)> &fg,
+                      int maxfun, int *nfev) {
+  vector<double> g(n), d(n), xn(n), gn(n);
+  // ring buffers of the last LBFGS_MEMORY steps and gradient changes
+  vector<double> S(LBFGS_MEMORY*n), Y(LBFGS_MEMORY*n);
+  double rho[LBFGS_MEMORY], alpha[LBFGS_MEMORY];
+  int npairs = 0, newest = -1, numfun = 0;
+  double fx = fg(x, &g[0]);
+  numfun++;
+  while (isfinite(fx) && all_finite(n, &g[0]) && numfun < maxfun) {
+    double gmax = 0.0;
+    for (int k=0; k<n; k++)
+      gmax = max(gmax, fabs(g[k]));
+    if (gmax <= LBFGS_PGTOL)
+      break;
+    // two-loop recursion for d = -H g
+    d = g;
+    for (int m=0; m<npairs; m++) {
+      int p = (newest-m+LBFGS_MEMORY) % LBFGS_MEMORY;
+      alpha[p] = rho[p]*dot(n, &S[p*n], &d[0]);
+      for (int k=0; k<n; k++)
+        d[k] -= alpha[p]*Y[p*n+k];
+    }
+    // scale so that the first step has unit length
+    double gamma = 1.0/sqrt(dot(n, &g[0], &g[0]));
+    if (npairs > 0)
+      gamma = 1.0/(rho[newest]*dot(n, &Y[newest*n], &Y[newest*n]));
+    for (int k=0; k<n; k++)
+      d[k] *= gamma;
+    for (int m=npairs-1; m>=0; m--) {
+      int p = (newest-m+LBFGS_MEMORY) % LBFGS_MEMORY;
+      double beta = rho[p]*dot(n, &Y[p*n], &d[0]);
+      for (int k=0; k<n; k++)
+        d[k] += (alpha[p]-beta)*S[p*n+k];
+    }
+    for (int k=0; k<n; k++)
+      d[k] = -d[k];
+    double gd = dot(n, &g[0], &d[0]);
+    if (!(gd < 0.0)) {
+      // not a descent direction, start over from steepest descent
+      npairs = 0;
+      gamma = 1.0/sqrt(dot(n, &g[0], &g[0]));
+      for (int k=0; k<n; k++)
+        d[k] = -gamma*g[k];
+      gd = dot(n, &g[0], &d[0]);
+    }
+    // backtrack (by quadratic interpolation) until the decrease suffices
+    double step = 1.0, fn = 0.0;
+    bool found = false;
+    while (numfun < maxfun && step >= LBFGS_MIN_STEP) {
+      for (int k=0; k<n; k++)
+        xn[k] = x[k] + step*d[k];
+      fn = fg(&xn[0], &gn[0]);
+      numfun++;
+      if (isfinite(fn) && fn <= fx + LBFGS_ARMIJO*step*gd) {
+        found = true;
+        break;
+      }
+      double next = 0.1*step;
+      if (isfinite(fn))
+        next = max(next, min(0.5*step,
+                             -0.5*gd*step*step/(fn-fx-gd*step)));
+      step = next;
+    }
+    if (!found)
+      break;
+    // keep the curvature pair if it is positive
+    int p = (newest+1) % LBFGS_MEMORY;
+    double sy = 0.0, yy = 0.0;
+    for (int k=0; k<n; k++) {
+      S[p*n+k] = xn[k]-x[k];
+      Y[p*n+k] = gn[k]-g[k];
+      sy += S[p*n+k]*Y[p*n+k];
+      yy += Y[p*n+k]*Y[p*n+k];
+    }
+    if (sy > 1e-10*yy) {
+      rho[p] = 1.0/sy;
+      newest = p;
+      npairs = min(npairs+1, LBFGS_MEMORY);
+    }
+    double fprev = fx;
+    for (int k=0; k<n; k++)
+      x[k] = xn[k];
+    g.swap(gn);
+    fx = fn;
+    if (fprev-fx <= LBFGS_FTOL*max(max(fabs(fprev), fabs(fx)), 1.0))
+      break;
+  }
+  *nfev += numfun;
+  return fx;
+}
+
+void fit_model(Model *model, int numIter, double tol, unsigned seed,
+               double *info) {
+  int nimg = model->get_image_param_len();
+  int nwkr = model->get_worker_param_len();
+  vector<double> grad(nimg+nwkr), xis(nimg), wkr(nwkr);
+  // the image (worker) objective and its part of the gradient
+  auto imageFg = [&](const double *x, double *g) {
+    model->set_image_param((double*) x);
+    double obj = model->objective();
+    model->gradient(&grad[0]);
+    for (int k=0; k<nimg; k++)
+      g[k] = grad[k];
+    return obj;
+  };
+  auto workerFg = [&](const double *x, double *g) {
+    model->set_worker_param((double*) x);
+    double obj = model->objective();
+    model->gradient(&grad[0]);
+    for (int k=0; k<nwkr; k++)
+      g[k] = grad[nimg+k];
+    return obj;
+  };
+  mt19937 rng(seed);
+  normal_distribution<double> randn(0.0, 1.0);
+  int nfev = 0, iter = 0, status = BATCH_MAX_ITER;
+  double obj = model->objective();
+  while (iter < numIter) {
+    // resample the image parameters if the gradient is not finite
+    for (int trial=0; trial<MAX_RESAMPLE_TRIES; trial++) {
+      model->gradient(&grad[0]);
+      if (all_finite(nimg, &grad[0]) && isfinite(model->objective()))
+        break;
+      for (int k=0; k<nimg; k++)
+        xis[k] = 0.1*randn(rng);
+      model->set_image_param(&xis[0]);
+    }
+    model->get_image_param(&xis[0]);
+    minimize_lbfgs(nimg, &xis[0], imageFg, 100, &nfev);
+    model->set_image_param(&xis[0]);
+    model->get_worker_param(&wkr[0]);
+    minimize_lbfgs(nwkr, &wkr[0], workerFg, 100, &nfev);
+    model->set_worker_param(&wkr[0]);
+    double prev = obj;
+    obj = model->objective();
+    iter++;
+    if (tol > 0.0 && fabs(prev-obj) <= tol*max(max(fabs(prev), fabs(obj)),
+                                              1.0)) {
+      status = BATCH_CONVERGED;
+      break;
+    }
+  }
+  if (!isfinite(obj))
+    status = BATCH_FAILED;
+  info[0] = obj;
+  info[1] = iter;
+  info[2] = nfev;
+  info[3] = status;
+}
+
+void batch_fit(const char *model, const double *mdlPrm, int numProbs,
+               const long long *lblOffsets, const int *numImgs,
+               const int *numWkrs, const int *labels, int numIter,
+               double tol, int seed, const long long *imgOffsets,
+               double *imgPrm, const long long *wkrOffsets, double *wkrPrm,
+               double *info, int nthreads) {
+  // an unknown model name gives no model, which fails every problem
+  Model *test = (Model*) setup_model(model);
+  if (test == 0) {
+    for (int p=0; p<numProbs; p++) {
+      double *pinfo = info + (long long)p*BATCH_INFO_LEN;
+      pinfo[0] = NAN;
+      pinfo[1] = pinfo[2] = 0.0;
+      pinfo[3] = BATCH_FAILED;
+    }
+    return;
+  }
+  delete test;
+  parallel_for(numProbs, nthreads, [&](int p) {
+    double *pinfo = info + (long long)p*BATCH_INFO_LEN;
+    Model *m = (Model*) setup_model(model);
+    try {
+      vector<double> prm(mdlPrm, mdlPrm+m->get_model_param_len());
+      m->set_model_param(&prm[0]);
+      m->load_data(numImgs[p], numWkrs[p], int(lblOffsets[p+1]-lblOffsets[p]),
+                   labels + 3*lblOffsets[p]);
+      fit_model(m, numIter, tol, unsigned(seed) + unsigned(p), pinfo);
+      m->get_image_param(imgPrm + imgOffsets[p]);
+      m->get_worker_param(wkrPrm + wkrOffsets[p]);
+    } catch (...) {
+      // e.g. labels outside the problem's images and workers
+      pinfo[0] = NAN;
+      pinfo[1] = pinfo[2] = 0.0;
+      pinfo[3] = BATCH_FAILED;
+    }
+    delete m;
+  });
+}
@@ -0,0 +1,47 @@
+#ifndef __BatchFit_hpp__
+#define __BatchFit_hpp__
+
+#include <functional>
+
+class Model;
+
+// outcome of fitting one problem of a batch
+enum BatchStatus {
+  BATCH_CONVERGED = 0, // objective changed by less than the tolerance
+  BATCH_MAX_ITER,      // ran all the alternations
+  BATCH_FAILED         // bad labels or model, or a non-finite objective
+};
+// values recorded per problem: (objective, alternations, objective
+// evaluations, status)
+#define BATCH_INFO_LEN 4
+
+// minimizes fg (which returns the objective at x and sets its gradient) from
+// x with L-BFGS, using at most maxfun evaluations, as scipy's fmin_l_bfgs_b
+// does without bounds; x is left at the best point found, and the no. of
+// evaluations is added to nfev
+double minimize_lbfgs(int n, double *x,
+                      const std::function<double(const double*, double*)> &fg,
+                      int maxfun, int *nfev);
+
+// alternates between optimizing the image and the worker parameters of a
+// model with data loaded, as Model.optimize_param does, stopping early once
+// the objective changes by less than tol (relative); writes the values of
+// BATCH_INFO_LEN to info
+void fit_model(Model *model, int numIter, double tol, unsigned seed,
+               double *info);
+
+// fits a model of class name model to each of numProbs independent label
+// sets on nthreads threads (one per core if nthreads <= 0). Problem p has
+// the (i, j, label) triplets labels[3*lblOffsets[p], 3*lblOffsets[p+1]),
+// with ids local to the problem, numImgs[p] images and numWkrs[p] workers;
+// its parameters are written to imgPrm+imgOffsets[p] and
+// wkrPrm+wkrOffsets[p], and its info to info+p*BATCH_INFO_LEN; every problem
+// fails if model is not a model name known to setup_model
+void batch_fit(const char *model, const double *mdlPrm, int numProbs,
+               const long long *lblOffsets, const int *numImgs,
+               const int *numWkrs, const int *labels, int numIter,
+               double tol, int seed, const long long *imgOffsets,
+               double *imgPrm, const long long *wkrOffsets, double *wkrPrm,
+               double *info, int nthreads);
+
+#endif
@@ -62,42 +62,38 @@ void Binary1dSignalModel::get_worker_param(double *vars) {
 double Binary1dSignalModel::objective() {
   if (!mDataIsLoaded)
     throw runtime_error("Data not loaded.");
-  double obj = 0.0;
+  double xiobj = 0.0, wkrobj = 0.0, lblobj = 0.0;
   // compute the xi prior
   for(int i=0; i<mNumImgs; i++) {
     double x0sq = (mXis[i]+1.0)*(mXis[i]+1.0);
     double x1sq = (mXis[i]-1.0)*(mXis[i]-1.0);
-    obj += (-0.5*log(2.0*PI*mSigX*mSigX)
+    xiobj += (-0.5*log(2.0*PI*mSigX*mSigX)
             + log(mBeta*exp(-0.5*x1sq/(mSigX*mSigX))
                   + (1.-mBeta)*exp(-0.5*x0sq/(mSigX*mSigX))));
   }
   // compute the wj prior
   for(int j=0; j<mNumWkrs; j++)
-    obj += LOGNORM(mWjs[j], mMuW, mSigW);
+    wkrobj += LOGNORM(mWjs[j], mMuW, mSigW);
   // compute the tj prior
   for(int j=0; j<mNumWkrs; j++)
-    obj += LOGNORM(mTjs[j], 0.0, mSigT);
+    wkrobj += LOGNORM(mTjs[j], 0.0, mSigT);
   // compute the shared terms
-  int idx, i, j, lij;
-  for(int k=0; k<mNumLbls; k++) {
-    idx = k*3;
-    i = mLabels[idx];
-    j = mLabels[idx+1];
-    lij = mLabels[idx+2];
+  for_each_weighted_label([&](int i, int j, int lij, int cnt) {
     double cdfarg = mXis[i]*mWjs[j] - mTjs[j];
     if(lij == 0) {
       if(cdfarg<0.0)
-        obj += log(1.0-cdf(cdfarg));
+        lblobj += cnt*log(1.0-cdf(cdfarg));
       else
-        obj += log(cdf(-cdfarg));
+        lblobj += cnt*log(cdf(-cdfarg));
     } else {
       if(cdfarg<0.0)
-        obj += log(cdf(cdfarg));
+        lblobj += cnt*log(cdf(cdfarg));
       else
-        obj += log(1.0-cdf(-cdfarg));
+        lblobj += cnt*log(1.0-cdf(-cdfarg));
     }
-  }
-  return -obj;
+  });
+  return -(mImgPriorWeight*xiobj + mWkrPriorWeight*wkrobj
+           + mLblWeight*lblobj);
 }
 
 void Binary1dSignalModel::worker_objective(int wkrId, double *prm, 
@@ -109,14 +105,14 @@ void Binary1dSignalModel::worker_objective(int wkrId, double *prm,
   
   // compute xi prior sum (shared by all terms)
   double xiprior = 0.0;
-  for(int i=0; i<mNumWkrLbls[wkrId]; i++) {
-    int idx = (mWkrLbls[wkrId])[2*i]; // the image idx
+  // idx is the image idx
+  for_each_weighted_wkr_label(wkrId, [&](int idx, int lij, int cnt) {
     double x0sq = (mXis[idx]+1.0)*(mXis[idx]+1.0);
     double x1sq = (mXis[idx]-1.0)*(mXis[idx]-1.0);
-    xiprior += (-0.5*log(2.0*PI*mSigX*mSigX)
-                + log(mBeta*exp(-0.5*x1sq/(mSigX*mSigX))
-                      + (1.-mBeta)*exp(-0.5*x0sq/(mSigX*mSigX))));
-  }
+    xiprior += cnt*(-0.5*log(2.0*PI*mSigX*mSigX)
+                    + log(mBeta*exp(-0.5*x1sq/(mSigX*mSigX))
+                          + (1.-mBeta)*exp(-0.5*x0sq/(mSigX*mSigX))));
+  });
   // add wkr prm specific prior
   int npts = nprm/2; // since we have (wj, tj) pairs in the prm list
   int toffset = npts;
@@ -124,25 +120,22 @@ void Binary1dSignalModel::worker_objective(int wkrId, double *prm,
     obj[j] = xiprior + LOGNORM(prm[j], mMuW, mSigW)
       + LOGNORM(prm[toffset+j], 0.0, mSigT);
   // compute the shared terms
-  int endidx = mNumWkrLbls[wkrId]*2;
-  for(int idx=0; idx<endidx; idx+=2) {
-    int i = (mWkrLbls[wkrId])[idx];
-    int lij = (mWkrLbls[wkrId])[idx+1];
+  for_each_weighted_wkr_label(wkrId, [&](int i, int lij, int cnt) {
     for(int j=0; j<npts; j++) {
       double cdfarg = mXis[i]*prm[j] - prm[toffset+j];
       if(lij == 0) {
         if(cdfarg<0.0)
-          obj[j] += log(1.0-cdf(cdfarg));
+          obj[j] += cnt*log(1.0-cdf(cdfarg));
         else
-          obj[j] += log(cdf(-cdfarg));
+          obj[j] += cnt*log(cdf(-cdfarg));
       } else {
         if(cdfarg<0.0)
-          obj[j] += log(cdf(cdfarg));
+          obj[j] += cnt*log(cdf(cdfarg));
         else
-          obj[j] += log(1.0-cdf(-cdfarg));
+          obj[j] += cnt*log(1.0-cdf(-cdfarg));
       }
     }
-  }
+  });
 }
 
 void Binary1dSignalModel::image_objective(int imgId, double *prm, 
@@ -154,11 +147,10 @@ void Binary1dSignalModel::image_objective(int imgId, double *prm,
   
   // add worker priors (shared by all terms)
   double wkrprior = 0.0;
-  for(int j=0; j<mNumImgLbls[imgId]; j++) {
-    int idx = (mImgLbls[imgId])[2*j];
-    wkrprior += LOGNORM(mWjs[idx], mMuW, mSigW) 
-                + LOGNORM(mTjs[idx], 0.0, mSigT);
-  }
+  for_each_weighted_img_label(imgId, [&](int idx, int lij, int cnt) {
+    wkrprior += cnt*(LOGNORM(mWjs[idx], mMuW, mSigW) 
+                     + LOGNORM(mTjs[idx], 0.0, mSigT));
+  });
   // compute image related priors based on the prm vector
   for(int i=0; i<nprm; i++) {
     double x0sq = (prm[i]+1.0)*(prm[i]+1.0);
@@ -168,25 +160,22 @@ void Binary1dSignalModel::image_objective(int imgId, double *prm,
                 + (1.-mBeta)*exp(-0.5*x0sq/(mSigX*mSigX))));
   }
   // compute the shared terms
-  int endidx = mNumImgLbls[imgId]*2;
-  for(int idx=0; idx<endidx; idx+=2) {
-    int j = (mImgLbls[imgId])[idx];
-    int lij = (mImgLbls[imgId])[idx+1];
+  for_each_weighted_img_label(imgId, [&](int j, int lij, int cnt) {
     for(int i=0; i<nprm; i++) {
       double cdfarg = prm[i]*mWjs[j] - mTjs[j];
       if(lij == 0) {
         if(cdfarg<0.0)
-          obj[i] += log(1.0-cdf(cdfarg));
+          obj[i] += cnt*log(1.0-cdf(cdfarg));
         else
-          obj[i] += log(cdf(-cdfarg));
+          obj[i] += cnt*log(cdf(-cdfarg));
       } else {
         if(cdfarg<0.0)
-          obj[i] += log(cdf(cdfarg));
+          obj[i] += cnt*log(cdf(cdfarg));
         else
-          obj[i] += log(1.0-cdf(-cdfarg));
+          obj[i] += cnt*log(1.0-cdf(-cdfarg));
       }
     }
-  }
+  });
 }
 
 void Binary1dSignalModel::gradient(double *grad) {
@@ -203,23 +192,19 @@ void Binary1dSignalModel::gradient(double *grad) {
     double x1sq = (mXis[i]-1.0)*(mXis[i]-1.0);
     x0sq = NORMAL(x0sq, mSigX);
     x1sq = NORMAL(x1sq, mSigX);
-    grad[i] = (mBeta*(mXis[i]-1.0)*x1sq + (1.0-mBeta)*(mXis[i]+1.0)*x0sq)
+    grad[i] = mImgPriorWeight
+      *(mBeta*(mXis[i]-1.0)*x1sq + (1.0-mBeta)*(mXis[i]+1.0)*x0sq)
       /mSigX/mSigX/ (mBeta*x1sq +(1.0-mBeta)*x0sq);
   }
   // compute the wj & tj prior gradients
   int woffset = mNumImgs;
   int toffset = woffset + mNumWkrs;
   for(int j=0; j<mNumWkrs; j++) {
-    grad[toffset+j] = mTjs[j]/mSigT/mSigT;
-    grad[woffset+j] = (mWjs[j]-mMuW)/mSigW/mSigW;
+    grad[toffset+j] = mWkrPriorWeight*mTjs[j]/mSigT/mSigT;
+    grad[woffset+j] = mWkrPriorWeight*(mWjs[j]-mMuW)/mSigW/mSigW;
   }
   // compute the shared terms
-  int idx, i, j, lij;
-  for(int k=0; k<mNumLbls; k++) {
-    idx = k*3;
-    i = mLabels[idx];
-    j = mLabels[idx+1];
-    lij = mLabels[idx+2];
+  for_each_weighted_label([&](int i, int j, int lij, int cnt) {
     double cdfarg = mXis[i]*mWjs[j] - mTjs[j];
     double lambda_ij;
     if(lij == 0) {
@@ -233,10 +218,11 @@ void Binary1dSignalModel::gradient(double *grad) {
       else
         lambda_ij = 1.0/(1.0-cdf(-cdfarg));
     }
-    double philambda_ij = exp(-0.5*cdfarg*cdfarg)/sqrt(2.0*PI)*lambda_ij;
+    double philambda_ij = mLblWeight*exp(-0.5*cdfarg*cdfarg)/sqrt(2.0*PI)
+      *lambda_ij*cnt;
     // add shared components to gradients
     grad[i] -= mWjs[j]*philambda_ij;
     grad[woffset+j] -= mXis[i]*philambda_ij;
     grad[toffset+j] += philambda_ij;
-  }
+  });
 }
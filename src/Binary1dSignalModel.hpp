@@ -21,6 +21,9 @@ public:
   
   double objective();
   void gradient(double *grad);
+
+protected:
+  double signal(int i, int j) { return mXis[i]*mWjs[j] - mTjs[j]; }
 };
 
 #endif
@@ -1,91 +1,119 @@
 #include <stdexcept>
-#include <fstream>
-#include <cstdio>
-#include <cstring>
-#include "utils.hpp"
 
 #include "BinaryModel.hpp"
 
 using namespace std;
 
 BinaryModel::BinaryModel() {
-  mWkrLbls = 0;
-  mImgLbls = 0;
-  mLabels = 0;
+  mLabelStore = 0;
+  mStorage = STORAGE_DEFAULT;
+}
+
+BinaryModel::~BinaryModel() {
+  BinaryModel::clear_data();
+}
+
+void BinaryModel::set_label_storage(int storage) {
+  if (mDataIsLoaded)
+    throw runtime_error("Cannot change the label storage when data is loaded.");
+  if (storage != STORAGE_DEFAULT && storage != STORAGE_COMPACT
+      && storage != STORAGE_WEIGHTED)
+    throw runtime_error("Unknown label storage.");
+  mStorage = storage;
+}
+
+int BinaryModel::get_label_storage() {
+  return mDataIsLoaded ? mLabelStore->get_storage() : mStorage;
+}
+
+void BinaryModel::get_label_array(int *labels) {
+  if (!mDataIsLoaded)
+    throw runtime_error("Data not loaded.");
+  mLabelStore->get_label_array(labels);
+}
+
+void BinaryModel::get_image_labels(int imgId, int *wkrIds, int *labels) {
+  if (!mDataIsLoaded)
+    throw runtime_error("Data not loaded.");
+  int k = 0;
+  for_each_img_label(imgId, [&](int j, int lij) {
+    wkrIds[k] = j; labels[k] = lij; k++;
+  });
 }
 
 void BinaryModel::clear_data() {
   if (!mDataIsLoaded)
     return;
-  for (int j=0; j<mNumWkrs; j++)
-    delete [] mWkrLbls[j];
-  delete [] mWkrLbls; mWkrLbls = 0;
-  for (int i=0; i<mNumImgs; i++)
-    delete [] mImgLbls[i];
-  delete [] mImgLbls; mImgLbls = 0;
-  delete [] mLabels; mLabels = 0;
+  mLabelStore->release(); mLabelStore = 0;
+  // the label counts belong to the store
+  mNumWkrLbls = 0; mNumImgLbls = 0;
+  Model::clear_data();
   mDataIsLoaded = false;
 }
 
-// TODO: error checking here so that we know when a file was corrupt
 void BinaryModel::load_data(const char *filename) {
   if (mDataIsLoaded)
     throw runtime_error("You must clear the old data before loading new data.");
-  // read data file
-  ifstream inFile;
-  inFile.open(filename, ios::in);
-  if (!inFile)
-    throw runtime_error("Unable to open data file.");
-  // read the dataset size and set up labels
-  char line[LINELEN+1];
-  inFile.getline(line, LINELEN);
-  sscanf(line, "%d %d %d\n", &mNumImgs, &mNumWkrs, &mNumLbls);
-  mNumWkrLbls = new int[mNumWkrs];
-  for (int j=0; j<mNumWkrs; j++) mNumWkrLbls[j] = 0;
-  mNumImgLbls = new int[mNumImgs];
-  for (int i=0; i<mNumImgs; i++) mNumImgLbls[i] = 0;
-  mLabels = new int[3*mNumLbls]; // 3 since (i, j, label)
-  // read the labels
-  int i, j, label;
-  int idx = 0;
-  while(!inFile.eof()) {
-    inFile.getline(line,100);
-    if (strlen(line)<5) // need to fit at least 3 columns
-      continue;
-    sscanf(line, "%d %d %d\n", &i, &j, &label);
-    mLabels[idx] = i; mLabels[idx+1] = j; mLabels[idx+2] = label;
-    mNumWkrLbls[j] += 1;
-    mNumImgLbls[i] += 1;
-    idx += 3;
+  LabelStore *store = new LabelStore(mStorage);
+  try {
+    store->load_data(filename);
+  } catch (...) {
+    store->release();
+    throw;
+  }
+  attach_loaded_store(store);
+}
+
+void BinaryModel::load_data(int numImgs, int numWkrs, int numLbls,
+                            const int *labels) {
+  if (mDataIsLoaded)
+    throw runtime_error("You must clear the old data before loading new data.");
+  LabelStore *store = new LabelStore(mStorage);
+  try {
+    store->load_data(numImgs, numWkrs, numLbls, labels);
+  } catch (...) {
+    store->release();
+    throw;
   }
-  inFile.close();  
-  // allocate mem for the image and worker labels
-  mImgLbls = new int*[mNumImgs];
-  for (i=0; i<mNumImgs; i++)
-    mImgLbls[i] = new int[mNumImgLbls[i]*2];
-  mWkrLbls = new int*[mNumWkrs];
-  for (j=0; j<mNumWkrs; j++)
-    mWkrLbls[j] = new int[mNumWkrLbls[j]*2];
-  // replicate the labels for access from wkrs and imgs
-  int *wkrIdx = new int[mNumWkrs];
-  for (int j=0; j<mNumWkrs; j++) wkrIdx[j] = 0;
-  int *imgIdx = new int[mNumImgs];
-  for (int i=0; i<mNumImgs; i++) imgIdx[i] = 0;
-  for (int k=0; k<mNumLbls; k++) {
-    idx = k*3;
-    i = mLabels[idx]; j = mLabels[idx+1]; label = mLabels[idx+2];
-    // image label
-    (mImgLbls[i])[2*imgIdx[i]] = j;
-    (mImgLbls[i])[2*imgIdx[i]+1] = label;
-    imgIdx[i] += 1;
-    // worker label
-    (mWkrLbls[j])[2*wkrIdx[j]] = i;
-    (mWkrLbls[j])[2*wkrIdx[j]+1] = label;
-    wkrIdx[j] += 1;
+  attach_loaded_store(store);
+}
+
+void BinaryModel::load_data_mapped(const char *storeFile) {
+  if (mDataIsLoaded)
+    throw runtime_error("You must clear the old data before loading new data.");
+  LabelStore *store = new LabelStore(mStorage);
+  try {
+    store->load_data_mapped(storeFile);
+  } catch (...) {
+    store->release();
+    throw;
   }
-  delete [] wkrIdx; delete [] imgIdx; // temporary vars
+  attach_loaded_store(store);
+}
+
+void BinaryModel::attach_label_store(LabelStore *store) {
+  if (mDataIsLoaded)
+    throw runtime_error("You must clear the old data before loading new data.");
+  if (!store->is_loaded())
+    throw runtime_error("Label store holds no data.");
+  store->retain();
+  mLabelStore = store;
+  mNumImgs = store->get_num_imgs();
+  mNumWkrs = store->get_num_wkrs();
+  mNumLbls = store->get_num_lbls();
+  mNumImgLbls = store->get_num_img_lbls();
+  mNumWkrLbls = store->get_num_wkr_lbls();
   // since we have no. of workers and images, we can reset params
   mDataIsLoaded = true; // this must come before reset to avoid exceptions
   reset_worker_param();
   reset_image_param();
 }
+
+// attaches a store loaded by this model, which then holds its only reference
+void BinaryModel::attach_loaded_store(LabelStore *store) {
+  attach_label_store(store);
+  store->release();
+  // keep track of the memory held for the labels
+  record_alloc(store->get_alloc_bytes());
+  record_map(store->get_mapped_bytes());
+}
@@ -2,18 +2,59 @@
 #define __BinaryModel_hpp_
 
 #include "Model.hpp"
+#include "LabelStore.hpp"
 
 class BinaryModel : public Model {
 public:
   BinaryModel();
-  
+  virtual ~BinaryModel();
+
   void load_data(const char *filename);
+  void load_data(int numImgs, int numWkrs, int numLbls, const int *labels);
+  void load_data_mapped(const char *storeFile);
   void clear_data();
-  
-protected:  
-  int **mWkrLbls;
-  int **mImgLbls;
-  int *mLabels;
+
+  // use the labels of a store (possibly shared with other models) rather
+  // than loading them, the store is released by clear_data
+  void attach_label_store(LabelStore *store);
+  LabelStore *get_label_store() { return mLabelStore; }
+
+  void set_label_storage(int storage);
+  int get_label_storage();
+  void get_label_array(int *labels);
+  void get_image_labels(int imgId, int *wkrIds, int *labels);
+
+protected:
+  // call fn(i, j, lij) for every label
+  template <class Fn> void for_each_label(Fn fn) {
+    mLabelStore->for_each_label(fn);
+  }
+  // call fn(j, lij) for every label of image imgId
+  template <class Fn> void for_each_img_label(int imgId, Fn fn) {
+    mLabelStore->for_each_img_label(imgId, fn);
+  }
+  // call fn(i, lij) for every label of worker wkrId
+  template <class Fn> void for_each_wkr_label(int wkrId, Fn fn) {
+    mLabelStore->for_each_wkr_label(wkrId, fn);
+  }
+  // as the above, calling fn(..., count) once per distinct label (see
+  // LabelStore::for_each_weighted_label)
+  template <class Fn> void for_each_weighted_label(Fn fn) {
+    mLabelStore->for_each_weighted_label(fn);
+  }
+  template <class Fn> void for_each_weighted_img_label(int imgId, Fn fn) {
+    mLabelStore->for_each_weighted_img_label(imgId, fn);
+  }
+  template <class Fn> void for_each_weighted_wkr_label(int wkrId, Fn fn) {
+    mLabelStore->for_each_weighted_wkr_label(wkrId, fn);
+  }
+
+  LabelStore *mLabelStore;
+  // storage of the label stores created by load_data
+  int mStorage;
+
+private:
+  void attach_loaded_store(LabelStore *store);
 };
 
 #endif
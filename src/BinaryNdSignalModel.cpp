@@ -15,6 +15,7 @@ void BinaryNdSignalModel::set_model_param(double *prm) {
   if (mDataIsLoaded && (prm[5] != mDim))
     throw runtime_error("Cannot set dimension when data is loaded.");
   mDim = int(prm[5]);
+  select_kernels();
 }
 
 void BinaryNdSignalModel::get_model_param(double *prm) {
@@ -85,204 +86,208 @@ void BinaryNdSignalModel::get_worker_param(double *vars) {
     vars[j+nElements] = mTjs[j];
 }
 
-double BinaryNdSignalModel::objective() {
+// the kernels are templated on the dimension D, so that the loops over the
+// dimensions have a fixed length for D>0, while D=0 uses mDim (see
+// select_kernels)
+template <int D>
+double BinaryNdSignalModel::objective_dim() {
   if (!mDataIsLoaded)
     throw runtime_error("Data not loaded.");
-  double obj = 0.0;
+  const int dim = D ? D : mDim;
+  double xiobj = 0.0, wkrobj = 0.0, lblobj = 0.0;
   // compute the xi prior
   for(int i=0; i<mNumImgs; i++) {
+    const double *xi = mXis + i*dim;
     double x0sq = 0.0;
     double x1sq = 0.0;
-    for(int d=0; d<mDim; d++) {
-      x0sq += (mXis[i*mDim+d]+1.0)*(mXis[i*mDim+d]+1.0);
-      x1sq += (mXis[i*mDim+d]-1.0)*(mXis[i*mDim+d]-1.0);
+    for(int d=0; d<dim; d++) {
+      x0sq += (xi[d]+1.0)*(xi[d]+1.0);
+      x1sq += (xi[d]-1.0)*(xi[d]-1.0);
     }
-    obj += (-0.5*double(mDim)*log(2.0*PI*mSigX*mSigX)
+    xiobj += (-0.5*double(dim)*log(2.0*PI*mSigX*mSigX)
             + log(mBeta*exp(-0.5*x1sq/(mSigX*mSigX))
                   + (1.-mBeta)*exp(-0.5*x0sq/(mSigX*mSigX))));
   }
   // compute the wj prior
-  for(int j=0; j<mNumWkrs; j++)
-    for(int d=0; d<mDim; d++)
-      obj += LOGNORM(mWjs[j*mDim+d], mMuW, mSigW);
+  for(int j=0; j<mNumWkrs*dim; j++)
+    wkrobj += LOGNORM(mWjs[j], mMuW, mSigW);
   // compute the tj prior
   for(int j=0; j<mNumWkrs; j++)
-    obj += LOGNORM(mTjs[j], 0.0, mSigT);
+    wkrobj += LOGNORM(mTjs[j], 0.0, mSigT);
   // compute the shared terms
-  int idx, i, j, lij;
-  for(int k=0; k<mNumLbls; k++) {
-    idx = k*3;
-    i = mLabels[idx];
-    j = mLabels[idx+1];
-    lij = mLabels[idx+2];
+  for_each_weighted_label([&](int i, int j, int lij, int cnt) {
+    const double *xi = mXis + i*dim, *wj = mWjs + j*dim;
     double cdfarg = 0.0;
-    for(int d=0; d<mDim; d++)
-      cdfarg += mXis[i*mDim+d]*mWjs[j*mDim+d];
+    for(int d=0; d<dim; d++)
+      cdfarg += xi[d]*wj[d];
     cdfarg -= mTjs[j];
     if(lij == 0) {
       if(cdfarg<0.0)
-        obj += log(1.0-cdf(cdfarg));
+        lblobj += cnt*log(1.0-cdf(cdfarg));
       else
-        obj += log(cdf(-cdfarg));
+        lblobj += cnt*log(cdf(-cdfarg));
     } else {
       if(cdfarg<0.0)
-        obj += log(cdf(cdfarg));
+        lblobj += cnt*log(cdf(cdfarg));
       else
-        obj += log(1.0-cdf(-cdfarg));
+        lblobj += cnt*log(1.0-cdf(-cdfarg));
     }
-  }
-  return -obj;
+  });
+  return -(mImgPriorWeight*xiobj + mWkrPriorWeight*wkrobj
+           + mLblWeight*lblobj);
 }
 
-void BinaryNdSignalModel::worker_objective(int wkrId, double *prm, 
-                                           int nprm, double* obj) {
+template <int D>
+void BinaryNdSignalModel::worker_objective_dim(int wkrId, double *prm, 
+                                               int nprm, double* obj) {
   // wkrId is the id of the worker we're interested in
   // prm is a list of [wjs, tjs] we're computing the objective for
   // nprm is the length of prm, and obj is the resulting objective fn
-  // list (of length nprm/2)
+  // list (of length nprm/(1+dim))
+  const int dim = D ? D : mDim;
   
   // compute xi prior sum (shared by all terms)
   double xiprior = 0.0;
-  for(int i=0; i<mNumWkrLbls[wkrId]; i++) {
-    int idx = (mWkrLbls[wkrId])[2*i]; // the image idx
+  // idx is the image idx
+  for_each_weighted_wkr_label(wkrId, [&](int idx, int lij, int cnt) {
+    const double *xi = mXis + idx*dim;
     double x0sq = 0.0;
     double x1sq = 0.0;
-    for(int d=0; d<mDim; d++) {
-      x0sq += (mXis[idx*mDim+d]+1.0)*(mXis[idx*mDim+d]+1.0);
-      x1sq += (mXis[idx*mDim+d]-1.0)*(mXis[idx*mDim+d]-1.0);
+    for(int d=0; d<dim; d++) {
+      x0sq += (xi[d]+1.0)*(xi[d]+1.0);
+      x1sq += (xi[d]-1.0)*(xi[d]-1.0);
     }
-    xiprior += (-0.5*double(mDim)*log(2.0*PI*mSigX*mSigX)
+    xiprior += cnt*(-0.5*double(dim)*log(2.0*PI*mSigX*mSigX)
             + log(mBeta*exp(-0.5*x1sq/(mSigX*mSigX))
                   + (1.-mBeta)*exp(-0.5*x0sq/(mSigX*mSigX))));
-  }
+  });
   // add wkr prm specific prior
-  int npts = nprm/(1+mDim); // since we have (wj, tj) pairs in the prm list
-  int toffset = npts*mDim;
+  int npts = nprm/(1+dim); // since we have (wj, tj) pairs in the prm list
+  int toffset = npts*dim;
   for(int j=0; j<npts; j++) {
     obj[j] = xiprior + LOGNORM(prm[toffset+j], 0.0, mSigT);
-    for(int d=0; d<mDim; d++)
-      obj[j] += LOGNORM(prm[j*mDim+d], mMuW, mSigW);
+    for(int d=0; d<dim; d++)
+      obj[j] += LOGNORM(prm[j*dim+d], mMuW, mSigW);
   }
     
   // compute the shared terms
-  int endidx = mNumWkrLbls[wkrId]*2;
-  for(int idx=0; idx<endidx; idx+=2) {
-    int i = (mWkrLbls[wkrId])[idx];
-    int lij = (mWkrLbls[wkrId])[idx+1];
+  for_each_weighted_wkr_label(wkrId, [&](int i, int lij, int cnt) {
+    const double *xi = mXis + i*dim;
     for(int j=0; j<npts; j++) {
+      const double *wj = prm + j*dim;
       double cdfarg = 0.0;
-      for(int d=0; d<mDim; d++)
-        cdfarg += mXis[i*mDim+d]*prm[j*mDim+d];
+      for(int d=0; d<dim; d++)
+        cdfarg += xi[d]*wj[d];
       cdfarg -= prm[toffset+j];
       if(lij == 0) {
         if(cdfarg<0.0)
-          obj[j] += log(1.0-cdf(cdfarg));
+          obj[j] += cnt*log(1.0-cdf(cdfarg));
         else
-          obj[j] += log(cdf(-cdfarg));
+          obj[j] += cnt*log(cdf(-cdfarg));
       } else {
         if(cdfarg<0.0)
-          obj[j] += log(cdf(cdfarg));
+          obj[j] += cnt*log(cdf(cdfarg));
         else
-          obj[j] += log(1.0-cdf(-cdfarg));
+          obj[j] += cnt*log(1.0-cdf(-cdfarg));
       }
     }
-  }
+  });
 }
 
-void BinaryNdSignalModel::image_objective(int imgId, double *prm, 
-                                          int nprm, double* obj) {
+template <int D>
+void BinaryNdSignalModel::image_objective_dim(int imgId, double *prm, 
+                                              int nprm, double* obj) {
   // imgId is the id of the image we're interested in
   // prm is a list of xi's we're computing the objective for
   // nprm is the length of prm, and obj is the resulting objective fn
-  // list (also of length nprm)
+  // list (of length nprm/dim)
+  const int dim = D ? D : mDim;
   
   // add worker priors (shared by all terms)
   double wkrprior = 0.0;
-  for(int j=0; j<mNumImgLbls[imgId]; j++) {
-    int idx = (mImgLbls[imgId])[2*j];
-    wkrprior += LOGNORM(mTjs[idx], 0.0, mSigT);
-    for(int d=0; d<mDim; d++)
-      wkrprior += LOGNORM(mWjs[idx*mDim+d], mMuW, mSigW);
-  }
+  for_each_weighted_img_label(imgId, [&](int idx, int lij, int cnt) {
+    wkrprior += cnt*LOGNORM(mTjs[idx], 0.0, mSigT);
+    for(int d=0; d<dim; d++)
+      wkrprior += cnt*LOGNORM(mWjs[idx*dim+d], mMuW, mSigW);
+  });
   // compute image related priors based on the prm vector
-  int npts = nprm/mDim;
+  int npts = nprm/dim;
   for(int i=0; i<npts; i++) {
+    const double *xi = prm + i*dim;
     double x0sq = 0.0;
     double x1sq = 0.0;
-    for(int d=0; d<mDim; d++) {
-      x0sq += (prm[i*mDim+d]+1.0)*(prm[i*mDim+d]+1.0);
-      x1sq += (prm[i*mDim+d]-1.0)*(prm[i*mDim+d]-1.0);
+    for(int d=0; d<dim; d++) {
+      x0sq += (xi[d]+1.0)*(xi[d]+1.0);
+      x1sq += (xi[d]-1.0)*(xi[d]-1.0);
     }
-    obj[i] = wkrprior + (-0.5*double(mDim)*log(2.0*PI*mSigX*mSigX)
+    obj[i] = wkrprior + (-0.5*double(dim)*log(2.0*PI*mSigX*mSigX)
                 + log(mBeta*exp(-0.5*x1sq/(mSigX*mSigX))
                 + (1.-mBeta)*exp(-0.5*x0sq/(mSigX*mSigX))));
   }
   // compute the shared terms
-  int endidx = mNumImgLbls[imgId]*2;
-  for(int idx=0; idx<endidx; idx+=2) {
-    int j = (mImgLbls[imgId])[idx];
-    int lij = (mImgLbls[imgId])[idx+1];
-    for(int i=0; i<nprm; i++) {
+  for_each_weighted_img_label(imgId, [&](int j, int lij, int cnt) {
+    const double *wj = mWjs + j*dim;
+    for(int i=0; i<npts; i++) {
+      const double *xi = prm + i*dim;
       double cdfarg = 0.0;
-      for(int d=0; d<mDim; d++)
-        cdfarg += prm[i*mDim+d]*mWjs[j*mDim+d];
+      for(int d=0; d<dim; d++)
+        cdfarg += xi[d]*wj[d];
       cdfarg -= mTjs[j];
       if(lij == 0) {
         if(cdfarg<0.0)
-          obj[i] += log(1.0-cdf(cdfarg));
+          obj[i] += cnt*log(1.0-cdf(cdfarg));
         else
-          obj[i] += log(cdf(-cdfarg));
+          obj[i] += cnt*log(cdf(-cdfarg));
       } else {
         if(cdfarg<0.0)
-          obj[i] += log(cdf(cdfarg));
+          obj[i] += cnt*log(cdf(cdfarg));
         else
-          obj[i] += log(1.0-cdf(-cdfarg));
+          obj[i] += cnt*log(1.0-cdf(-cdfarg));
       }
     }
-  }
+  });
 }
 
-void BinaryNdSignalModel::gradient(double *grad) {
+template <int D>
+void BinaryNdSignalModel::gradient_dim(double *grad) {
   if (!mDataIsLoaded)
     throw runtime_error("Data not loaded.");
-  // assumes that *grad is a list of length mNumImgs+2*mNumWkrs
+  const int dim = D ? D : mDim;
+  // assumes that *grad is a list of length dim*mNumImgs+(1+dim)*mNumWkrs
   // the order is assumed to be [xis, wjs, tjs]
-  int gradLen = mDim*mNumImgs + (1+mDim)*mNumWkrs;
+  int gradLen = dim*mNumImgs + (1+dim)*mNumWkrs;
   for(int i=0; i<gradLen; i++)
     grad[i] = 0.0;
   // compute the xi prior gradient
   for(int i=0; i<mNumImgs; i++) {
+    const double *xi = mXis + i*dim;
     double x0sq = 0.0;
     double x1sq = 0.0;
-    for(int d=0; d<mDim; d++) {
-      x0sq += (mXis[i*mDim+d]+1.0)*(mXis[i*mDim+d]+1.0);
-      x1sq += (mXis[i*mDim+d]-1.0)*(mXis[i*mDim+d]-1.0);
+    for(int d=0; d<dim; d++) {
+      x0sq += (xi[d]+1.0)*(xi[d]+1.0);
+      x1sq += (xi[d]-1.0)*(xi[d]-1.0);
     }
     x0sq = NORMAL(x0sq, mSigX);
     x1sq = NORMAL(x1sq, mSigX);
-    for(int d=0; d<mDim; d++)
-      grad[i*mDim+d] = (mBeta*(mXis[i*mDim+d]-1.0)*x1sq + 
-        (1.0-mBeta)*(mXis[i*mDim+d]+1.0)*x0sq)
+    for(int d=0; d<dim; d++)
+      grad[i*dim+d] = mImgPriorWeight*(mBeta*(xi[d]-1.0)*x1sq + 
+        (1.0-mBeta)*(xi[d]+1.0)*x0sq)
         /mSigX/mSigX/ (mBeta*x1sq +(1.0-mBeta)*x0sq);
   }
   // compute the wj & tj prior gradients
-  int woffset = mNumImgs*mDim;
-  int toffset = woffset + mNumWkrs*mDim;
-  for(int j=0; j<mNumWkrs; j++) {
-    grad[toffset+j] = mTjs[j]/mSigT/mSigT;
-    for(int d=0; d<mDim; d++)
-      grad[woffset+j*mDim+d] = (mWjs[j*mDim+d]-mMuW)/mSigW/mSigW;
-  }
+  double *gxis = grad;
+  double *gwjs = grad + mNumImgs*dim;
+  double *gtjs = gwjs + mNumWkrs*dim;
+  for(int j=0; j<mNumWkrs; j++)
+    gtjs[j] = mWkrPriorWeight*mTjs[j]/mSigT/mSigT;
+  for(int j=0; j<mNumWkrs*dim; j++)
+    gwjs[j] = mWkrPriorWeight*(mWjs[j]-mMuW)/mSigW/mSigW;
   // compute the shared terms
-  int idx, i, j, lij;
-  for(int k=0; k<mNumLbls; k++) {
-    idx = k*3;
-    i = mLabels[idx];
-    j = mLabels[idx+1];
-    lij = mLabels[idx+2];
+  for_each_weighted_label([&](int i, int j, int lij, int cnt) {
+    const double *xi = mXis + i*dim, *wj = mWjs + j*dim;
     double cdfarg = 0.0;
-    for(int d=0; d<mDim; d++)
-      cdfarg += mXis[i*mDim+d]*mWjs[j*mDim+d];
+    for(int d=0; d<dim; d++)
+      cdfarg += xi[d]*wj[d];
     cdfarg -= mTjs[j];
     double lambda_ij;
     if(lij == 0) {
@@ -296,12 +301,68 @@ void BinaryNdSignalModel::gradient(double *grad) {
       else
         lambda_ij = 1.0/(1.0-cdf(-cdfarg));
     }
-    double philambda_ij = exp(-0.5*cdfarg*cdfarg)/sqrt(2.0*PI)*lambda_ij;
+    double philambda_ij = mLblWeight*exp(-0.5*cdfarg*cdfarg)/sqrt(2.0*PI)
+      *lambda_ij*cnt;
     // add shared components to gradients
-    for(int d=0; d<mDim; d++) {
-      grad[i*mDim+d] -= mWjs[j*mDim+d]*philambda_ij;
-      grad[woffset+j*mDim+d] -= mXis[i*mDim+d]*philambda_ij;
+    double *gxi = gxis + i*dim, *gwj = gwjs + j*dim;
+    for(int d=0; d<dim; d++) {
+      gxi[d] -= wj[d]*philambda_ij;
+      gwj[d] -= xi[d]*philambda_ij;
     }
-    grad[toffset+j] += philambda_ij;
+    gtjs[j] += philambda_ij;
+  });
+}
+
+void BinaryNdSignalModel::select_kernels() {
+  switch (mDim) {
+  case 2:
+    mObjective = &BinaryNdSignalModel::objective_dim<2>;
+    mGradient = &BinaryNdSignalModel::gradient_dim<2>;
+    mWorkerObjective = &BinaryNdSignalModel::worker_objective_dim<2>;
+    mImageObjective = &BinaryNdSignalModel::image_objective_dim<2>;
+    break;
+  case 3:
+    mObjective = &BinaryNdSignalModel::objective_dim<3>;
+    mGradient = &BinaryNdSignalModel::gradient_dim<3>;
+    mWorkerObjective = &BinaryNdSignalModel::worker_objective_dim<3>;
+    mImageObjective = &BinaryNdSignalModel::image_objective_dim<3>;
+    break;
+  case 4:
+    mObjective = &BinaryNdSignalModel::objective_dim<4>;
+    mGradient = &BinaryNdSignalModel::gradient_dim<4>;
+    mWorkerObjective = &BinaryNdSignalModel::worker_objective_dim<4>;
+    mImageObjective = &BinaryNdSignalModel::image_objective_dim<4>;
+    break;
+  default:
+    mObjective = &BinaryNdSignalModel::objective_dim<0>;
+    mGradient = &BinaryNdSignalModel::gradient_dim<0>;
+    mWorkerObjective = &BinaryNdSignalModel::worker_objective_dim<0>;
+    mImageObjective = &BinaryNdSignalModel::image_objective_dim<0>;
   }
 }
+
+double BinaryNdSignalModel::signal(int i, int j) {
+  const double *xi = mXis + i*mDim, *wj = mWjs + j*mDim;
+  double s = -mTjs[j];
+  for(int d=0; d<mDim; d++)
+    s += xi[d]*wj[d];
+  return s;
+}
+
+double BinaryNdSignalModel::objective() {
+  return (this->*mObjective)();
+}
+
+void BinaryNdSignalModel::gradient(double *grad) {
+  (this->*mGradient)(grad);
+}
+
+void BinaryNdSignalModel::worker_objective(int wkrId, double *prm, 
+                                           int nprm, double* obj) {
+  (this->*mWorkerObjective)(wkrId, prm, nprm, obj);
+}
+
+void BinaryNdSignalModel::image_objective(int imgId, double *prm, 
+                                          int nprm, double* obj) {
+  (this->*mImageObjective)(imgId, prm, nprm, obj);
+}
@@ -7,7 +7,7 @@
 
 class BinaryNdSignalModel : public BinarySignalModel {
 public:
-  BinaryNdSignalModel() { mDim = 2; };
+  BinaryNdSignalModel() { mDim = 2; select_kernels(); };
   
   void set_model_param(double *prm);
   void get_model_param(double *prm);
@@ -29,8 +29,26 @@ public:
   double objective();
   void gradient(double *grad);
 
+protected:
+  double signal(int i, int j);
+
 private:
   int mDim;
+
+  // kernels specialized for the dimension (0 for any dimension), which
+  // are picked by select_kernels when the dimension is set
+  template <int D> double objective_dim();
+  template <int D> void gradient_dim(double *grad);
+  template <int D>
+  void worker_objective_dim(int wkrId, double *prm, int nprm, double* obj);
+  template <int D>
+  void image_objective_dim(int imgId, double *prm, int nprm, double* obj);
+  void select_kernels();
+
+  double (BinaryNdSignalModel::*mObjective)();
+  void (BinaryNdSignalModel::*mGradient)(double*);
+  void (BinaryNdSignalModel::*mWorkerObjective)(int, double*, int, double*);
+  void (BinaryNdSignalModel::*mImageObjective)(int, double*, int, double*);
 };
 
 
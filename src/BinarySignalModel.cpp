@@ -1,16 +1,29 @@
+#include <stdexcept>
+#include <cmath>
+#include "utils.hpp"
 #include "BinarySignalModel.hpp"
 
+using namespace std;
+
 BinarySignalModel::BinarySignalModel() {
   mBeta = 0.5;
   mSigX = 0.8;
   mSigW = 1.0;
   mMuW = 1.0;
   mSigT = 3.0;
+  mLblWeight = 1.0;
+  mImgPriorWeight = 1.0;
+  mWkrPriorWeight = 1.0;
+  mOwnXis = true;
   mXis = 0;
   mWjs = 0;
   mTjs = 0;
 }
 
+BinarySignalModel::~BinarySignalModel() {
+  BinarySignalModel::clear_data();
+}
+
 void BinarySignalModel::set_model_param(double *prm) {
   mBeta = prm[0];
   mSigX = prm[1];
@@ -33,11 +46,38 @@ void BinarySignalModel::clear_data() {
   clear_image_param();
 }
 
+void BinarySignalModel::set_term_weights(double *weights) {
+  mLblWeight = weights[0];
+  mImgPriorWeight = weights[1];
+  mWkrPriorWeight = weights[2];
+}
+
+void BinarySignalModel::attach_image_param(double *xis) {
+  if (!mDataIsLoaded)
+    throw runtime_error("Data not loaded.");
+  clear_image_param();
+  mXis = xis;
+  mOwnXis = false;
+}
+
+double BinarySignalModel::label_loglik(int i, int j, int lij) {
+  if (!mDataIsLoaded)
+    throw runtime_error("Data not loaded.");
+  // as the label terms of the objective
+  double cdfarg = signal(i, j);
+  if(lij == 0)
+    return cdfarg<0.0 ? log(1.0-cdf(cdfarg)) : log(cdf(-cdfarg));
+  return cdfarg<0.0 ? log(cdf(cdfarg)) : log(1.0-cdf(-cdfarg));
+}
+
 void BinarySignalModel::clear_worker_param() {
   delete [] mWjs; mWjs = 0;
   delete [] mTjs; mTjs = 0;
 }
 
 void BinarySignalModel::clear_image_param() {
-  delete [] mXis; mXis = 0;
+  if (mOwnXis)
+    delete [] mXis;
+  mXis = 0;
+  mOwnXis = true;
 }
@@ -6,16 +6,28 @@
 class BinarySignalModel : public BinaryModel {
 public:
   BinarySignalModel();
+  virtual ~BinarySignalModel();
   
   void set_model_param(double *prm);
   void get_model_param(double *prm);
   
   void clear_data();
+
+  void set_term_weights(double *weights);
+  void attach_image_param(double *xis);
+
+  double label_loglik(int i, int j, int lij);
   
 protected:
+  // the signal xi.wj - tj of image i seen by worker j
+  virtual double signal(int i, int j) = 0;
   void clear_worker_param();
   void clear_image_param();
 
+  double mLblWeight;
+  double mImgPriorWeight;
+  double mWkrPriorWeight;
+  bool mOwnXis;
   double *mXis;
   double *mWjs;
   double *mTjs;
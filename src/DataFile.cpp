@@ -0,0 +1,88 @@
+#include <stdint.h>
+#include <cstring>
+#include <thread>
+#include <vector>
+#include "utils.hpp"
+
+#include "DataFile.hpp"
+
+using namespace std;
+
+// files below this size are parsed on one thread
+#define PARSE_SPLIT_BYTES (1 << 20)
+
+DataFile::DataFile(const char *filename) {
+  mData = (char*) map_file(filename, &mSize);
+  // parse the header line
+  const char *p = mData, *end = mData+mSize;
+  bool valid = scan_int(p, end, mNumImgs) && scan_int(p, end, mNumWkrs)
+    && scan_int(p, end, mNumLbls);
+  if (valid) {
+    skip_blanks(p, end);
+    valid = (p==end || *p=='\n') && mNumImgs>=0 && mNumWkrs>=0
+      && mNumLbls>=0;
+  }
+  if (!valid) {
+    unmap_file(mData, mSize);
+    throw runtime_error("Malformed data file header.");
+  }
+  mBody = (p==end) ? p : p+1;
+}
+
+DataFile::~DataFile() {
+  unmap_file(mData, mSize);
+}
+
+void DataFile::check(int status, int64_t count) {
+  if (status == PARSE_MALFORMED)
+    throw runtime_error("Malformed label line in data file.");
+  if (status == PARSE_INVALID_ID)
+    throw runtime_error("Label refers to an invalid image or worker.");
+  if (count != mNumLbls)
+    throw runtime_error("No. of labels differs from the data file header.");
+}
+
+void DataFile::read_labels(int *labels) {
+  const char *end = mData+mSize;
+  int64_t len = end-mBody;
+  int nruns = 1;
+  if (len >= PARSE_SPLIT_BYTES)
+    nruns = max(1, int(thread::hardware_concurrency()));
+  // split the lines into runs, each starting after a newline
+  vector<const char*> bounds(nruns+1, end);
+  bounds[0] = mBody;
+  for (int r=1; r<nruns; r++) {
+    const char *p = mBody + len*r/nruns;
+    if (p < bounds[r-1])
+      p = bounds[r-1];
+    const char *nl = (const char*) memchr(p-1, '\n', end-(p-1));
+    bounds[r] = nl ? nl+1 : end;
+  }
+  // parse the runs into buffers of their own, then copy them in order
+  vector<vector<int> > runs(nruns);
+  vector<int> status(nruns);
+  vector<int64_t> counts(nruns);
+  parallel_for(nruns, nruns, [&](int r) {
+    vector<int> &run = runs[r];
+    run.reserve(3*int64_t(mNumLbls)/nruns + 3);
+    status[r] = scan(bounds[r], bounds[r+1], &counts[r],
+                     [&](int i, int j, int label) {
+      run.push_back(i); run.push_back(j); run.push_back(label);
+    });
+  });
+  int64_t count = 0;
+  for (int r=0; r<nruns; r++) {
+    if (status[r] != PARSE_OK)
+      check(status[r], count);
+    count += counts[r];
+  }
+  check(PARSE_OK, count);
+  vector<int64_t> offsets(nruns, 0);
+  for (int r=1; r<nruns; r++)
+    offsets[r] = offsets[r-1] + 3*counts[r-1];
+  parallel_for(nruns, nruns, [&](int r) {
+    if (!runs[r].empty())
+      memcpy(labels+offsets[r], &runs[r][0], sizeof(int)*runs[r].size());
+    vector<int>().swap(runs[r]);
+  });
+}
@@ -0,0 +1,109 @@
+#ifndef __DataFile_hpp__
+#define __DataFile_hpp__
+
+#include <stdexcept>
+#include <stdint.h>
+
+// parse status of a run of label lines
+enum ParseStatus {
+  PARSE_OK = 0,
+  PARSE_MALFORMED,
+  PARSE_INVALID_ID
+};
+
+// A text data file, memory-mapped and parsed in place. The file holds a
+// "{no. images} {no. workers} {no. labels}" header line followed by an
+// "{image id} {worker id} {label}" line per label, with no limit on the
+// line length. Blank lines are skipped.
+class DataFile {
+public:
+  DataFile(const char *filename);
+  ~DataFile();
+
+  int get_num_imgs() { return mNumImgs; }
+  int get_num_wkrs() { return mNumWkrs; }
+  int get_num_lbls() { return mNumLbls; }
+
+  // call fn(i, j, label) for every label, in file order
+  template <class Fn> void for_each_label(Fn fn);
+  // parses the labels into (i, j, label) triplets, with the file split
+  // into runs of whole lines that are parsed on a thread each
+  void read_labels(int *labels);
+
+private:
+  // call fn(i, j, label) for the lines in [begin, end), and count them
+  template <class Fn>
+  int scan(const char *begin, const char *end, int64_t *count, Fn fn);
+  // throws if the status is an error or the count differs from the header
+  void check(int status, int64_t count);
+
+  char *mData;
+  long long mSize;
+  const char *mBody;
+  int mNumImgs;
+  int mNumWkrs;
+  int mNumLbls;
+};
+
+// skips blanks (but not newlines)
+static inline void skip_blanks(const char *&p, const char *end) {
+  while (p<end && (*p==' ' || *p=='\t' || *p=='\r'))
+    p++;
+}
+
+// reads an integer at p (after blanks), returns false if there is none
+static inline bool scan_int(const char *&p, const char *end, int &val) {
+  skip_blanks(p, end);
+  bool neg = (p<end && *p=='-');
+  if (neg)
+    p++;
+  if (p==end || *p<'0' || *p>'9')
+    return false;
+  long long v = 0;
+  while (p<end && *p>='0' && *p<='9') {
+    v = v*10 + (*p-'0');
+    if (v > 0x7fffffff)
+      return false;
+    p++;
+  }
+  val = int(neg ? -v : v);
+  return true;
+}
+
+template <class Fn>
+int DataFile::scan(const char *begin, const char *end, int64_t *count,
+                   Fn fn) {
+  const char *p = begin;
+  int i, j, label;
+  *count = 0;
+  while (p<end) {
+    skip_blanks(p, end);
+    if (p==end)
+      break;
+    if (*p=='\n') { // blank line
+      p++;
+      continue;
+    }
+    if (!scan_int(p, end, i) || !scan_int(p, end, j)
+        || !scan_int(p, end, label))
+      return PARSE_MALFORMED;
+    skip_blanks(p, end);
+    if (p<end && *p!='\n')
+      return PARSE_MALFORMED;
+    p++;
+    if (i<0 || i>=mNumImgs || j<0 || j>=mNumWkrs)
+      return PARSE_INVALID_ID;
+    fn(i, j, label);
+    *count += 1;
+  }
+  return PARSE_OK;
+}
+
+template <class Fn>
+void DataFile::for_each_label(Fn fn) {
+  int64_t count;
+  int status = scan(mBody, mData+mSize, &count, fn);
+  check(status, count);
+}
+
+#endif
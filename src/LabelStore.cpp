@@ -0,0 +1,465 @@
+#include <stdexcept>
+#include <cstdio>
+#include <cstring>
+#include <unistd.h>
+#include <vector>
+#include "utils.hpp"
+#include "DataFile.hpp"
+
+#include "LabelStore.hpp"
+
+using namespace std;
+
+// no. of bytes needed for compact entries holding ids below numIds
+static int entry_bytes(int numIds) {
+  if (2*int64_t(numIds) <= 0x100)
+    return 1;
+  if (2*int64_t(numIds) <= 0x10000)
+    return 2;
+  return 4;
+}
+
+static void *new_entries(int bytes, int64_t num) {
+  if (bytes == 1)
+    return new uint8_t[num];
+  if (bytes == 2)
+    return new uint16_t[num];
+  return new uint32_t[num];
+}
+
+static void delete_entries(int bytes, void *entries) {
+  if (bytes == 1)
+    delete [] (uint8_t*) entries;
+  else if (bytes == 2)
+    delete [] (uint16_t*) entries;
+  else
+    delete [] (uint32_t*) entries;
+}
+
+static void set_entry(void *entries, int bytes, int64_t k, int id, int lbl) {
+  uint32_t val = (uint32_t(id) << 1) | uint32_t(lbl != 0);
+  if (bytes == 1)
+    ((uint8_t*) entries)[k] = uint8_t(val);
+  else if (bytes == 2)
+    ((uint16_t*) entries)[k] = uint16_t(val);
+  else
+    ((uint32_t*) entries)[k] = val;
+}
+
+// a label store file holds a header, the image and worker row offsets and
+// the image and worker row entries, each section starting 64 byte aligned
+#define STORE_MAGIC "CUBAMLS1"
+struct StoreHeader {
+  char magic[8];
+  int32_t numImgs, numWkrs;
+  int32_t imgEntryBytes, wkrEntryBytes;
+  int64_t numLbls;
+};
+
+static int64_t align64(int64_t pos) {
+  return (pos+63) & ~int64_t(63);
+}
+
+// byte positions of the (image offsets, worker offsets, image entries,
+// worker entries) sections of a label store, followed by its size
+static void store_layout(const StoreHeader &hdr, int64_t *pos) {
+  pos[0] = align64(sizeof(StoreHeader));
+  pos[1] = align64(pos[0] + int64_t(sizeof(int64_t))*(hdr.numImgs+1));
+  pos[2] = align64(pos[1] + int64_t(sizeof(int64_t))*(hdr.numWkrs+1));
+  pos[3] = align64(pos[2] + hdr.numLbls*hdr.imgEntryBytes);
+  pos[4] = pos[3] + hdr.numLbls*hdr.wkrEntryBytes;
+}
+
+LabelStore::LabelStore(int storage) {
+  if (storage != STORAGE_DEFAULT && storage != STORAGE_COMPACT
+      && storage != STORAGE_WEIGHTED)
+    throw runtime_error("Unknown label storage.");
+  mRefs = 1;
+  mIsLoaded = false;
+  mNumWkrs = 0;
+  mNumImgs = 0;
+  mNumLbls = 0;
+  mNumEntries = 0;
+  mNumWkrLbls = 0;
+  mNumImgLbls = 0;
+  mAllocBytes = 0.0;
+  mWkrLbls = 0;
+  mImgLbls = 0;
+  mLabels = 0;
+  mStorage = storage;
+  mImgEntryBytes = 0;
+  mWkrEntryBytes = 0;
+  mImgEntries = 0;
+  mWkrEntries = 0;
+  mImgOffsets = 0;
+  mWkrOffsets = 0;
+  mImgRows = 0;
+  mWkrRows = 0;
+  mStore = 0;
+  mStoreSize = 0;
+}
+
+LabelStore::~LabelStore() {
+  if (mStorage == STORAGE_DEFAULT) {
+    if (mWkrLbls != 0)
+      for (int j=0; j<mNumWkrs; j++)
+        delete [] mWkrLbls[j];
+    delete [] mWkrLbls;
+    if (mImgLbls != 0)
+      for (int i=0; i<mNumImgs; i++)
+        delete [] mImgLbls[i];
+    delete [] mImgLbls;
+    delete [] mLabels;
+  } else if (mStorage == STORAGE_MAPPED) {
+    unmap_file(mStore, mStoreSize);
+  } else if (mStorage == STORAGE_WEIGHTED) {
+    delete [] mImgRows;
+    delete [] mWkrRows;
+    delete [] mImgOffsets;
+    delete [] mWkrOffsets;
+  } else {
+    if (mImgEntries != 0)
+      delete_entries(mImgEntryBytes, mImgEntries);
+    if (mWkrEntries != 0)
+      delete_entries(mWkrEntryBytes, mWkrEntries);
+    delete [] mImgOffsets;
+    delete [] mWkrOffsets;
+  }
+  delete [] mNumWkrLbls;
+  delete [] mNumImgLbls;
+}
+
+void LabelStore::release() {
+  mRefs -= 1;
+  if (mRefs == 0)
+    delete this;
+}
+
+void LabelStore::get_label_array(int *labels) {
+  if (!mIsLoaded)
+    throw runtime_error("Data not loaded.");
+  int64_t idx = 0;
+  for_each_label([&](int i, int j, int lij) {
+    labels[idx] = i; labels[idx+1] = j; labels[idx+2] = lij;
+    idx += 3;
+  });
+}
+
+// sets up zeroed per image and per worker label counts
+void LabelStore::init_counts() {
+  // (those of a failed load are dropped)
+  delete [] mNumWkrLbls;
+  delete [] mNumImgLbls;
+  mNumWkrLbls = new int[mNumWkrs];
+  for (int j=0; j<mNumWkrs; j++) mNumWkrLbls[j] = 0;
+  mNumImgLbls = new int[mNumImgs];
+  for (int i=0; i<mNumImgs; i++) mNumImgLbls[i] = 0;
+}
+
+void LabelStore::load_data(const char *filename) {
+  if (mIsLoaded)
+    throw runtime_error("Label store already holds data.");
+  // map the data file and read the dataset size
+  DataFile data(filename);
+  mNumImgs = data.get_num_imgs();
+  mNumWkrs = data.get_num_wkrs();
+  mNumLbls = data.get_num_lbls();
+  init_counts();
+  if (mStorage == STORAGE_COMPACT) {
+    // count the labels in a first pass, so that the (i, j, label) triplets
+    // never have to be held in memory
+    data.for_each_label([&](int i, int j, int label) {
+      mNumWkrLbls[j] += 1;
+      mNumImgLbls[i] += 1;
+    });
+    index_compact_labels(0);
+    int64_t *imgPos = new int64_t[mNumImgs];
+    for (int i=0; i<mNumImgs; i++) imgPos[i] = mImgOffsets[i];
+    int64_t *wkrPos = new int64_t[mNumWkrs];
+    for (int j=0; j<mNumWkrs; j++) wkrPos[j] = mWkrOffsets[j];
+    data.for_each_label([&](int i, int j, int label) {
+      set_entry(mImgEntries, mImgEntryBytes, imgPos[i]++, j, label);
+      set_entry(mWkrEntries, mWkrEntryBytes, wkrPos[j]++, i, label);
+    });
+    delete [] imgPos; delete [] wkrPos; // temporary vars
+    return;
+  }
+  if (mStorage == STORAGE_WEIGHTED) {
+    // the triplets are only held while the duplicates are collapsed
+    vector<int> labels(3*int64_t(mNumLbls));
+    data.read_labels(labels.data());
+    for (int64_t idx=0; idx<3*int64_t(mNumLbls); idx+=3) {
+      mNumWkrLbls[labels[idx+1]] += 1;
+      mNumImgLbls[labels[idx]] += 1;
+    }
+    index_weighted_labels(labels.data());
+    return;
+  }
+  delete [] mLabels;
+  mLabels = new int[3*int64_t(mNumLbls)]; // 3 since (i, j, label)
+  // read the labels
+  data.read_labels(mLabels);
+  for (int64_t idx=0; idx<3*int64_t(mNumLbls); idx+=3) {
+    mNumWkrLbls[mLabels[idx+1]] += 1;
+    mNumImgLbls[mLabels[idx]] += 1;
+  }
+  index_labels();
+}
+
+void LabelStore::load_data(int numImgs, int numWkrs, int numLbls,
+                           const int *labels) {
+  if (mIsLoaded)
+    throw runtime_error("Label store already holds data.");
+  for (int64_t idx=0; idx<3*int64_t(numLbls); idx+=3) {
+    int i = labels[idx], j = labels[idx+1];
+    if (i<0 || i>=numImgs || j<0 || j>=numWkrs)
+      throw runtime_error("Label refers to an invalid image or worker.");
+  }
+  mNumImgs = numImgs; mNumWkrs = numWkrs; mNumLbls = numLbls;
+  init_counts();
+  for (int64_t idx=0; idx<3*int64_t(mNumLbls); idx+=3) {
+    mNumWkrLbls[labels[idx+1]] += 1;
+    mNumImgLbls[labels[idx]] += 1;
+  }
+  if (mStorage == STORAGE_COMPACT) {
+    index_compact_labels(labels);
+    return;
+  }
+  if (mStorage == STORAGE_WEIGHTED) {
+    index_weighted_labels(labels);
+    return;
+  }
+  mLabels = new int[3*int64_t(mNumLbls)]; // 3 since (i, j, label)
+  for (int64_t idx=0; idx<3*int64_t(mNumLbls); idx++)
+    mLabels[idx] = labels[idx];
+  index_labels();
+}
+
+void LabelStore::load_data_mapped(const char *storeFile) {
+  if (mIsLoaded)
+    throw runtime_error("Label store already holds data.");
+  long long size;
+  void *store = map_file(storeFile, &size);
+  StoreHeader hdr;
+  int64_t pos[5];
+  bool valid = size >= (long long) sizeof(StoreHeader);
+  if (valid) {
+    memcpy(&hdr, store, sizeof(StoreHeader));
+    store_layout(hdr, pos);
+    valid = memcmp(hdr.magic, STORE_MAGIC, 8) == 0 && pos[4] == size;
+  }
+  if (!valid) {
+    unmap_file(store, size);
+    throw runtime_error("Invalid label store file.");
+  }
+  mStore = store; mStoreSize = size;
+  mStorage = STORAGE_MAPPED;
+  mNumImgs = hdr.numImgs; mNumWkrs = hdr.numWkrs; mNumLbls = hdr.numLbls;
+  mImgEntryBytes = hdr.imgEntryBytes;
+  mWkrEntryBytes = hdr.wkrEntryBytes;
+  char *base = (char*) store;
+  mImgOffsets = (int64_t*) (base+pos[0]);
+  mWkrOffsets = (int64_t*) (base+pos[1]);
+  mImgEntries = base+pos[2];
+  mWkrEntries = base+pos[3];
+  mNumImgLbls = new int[mNumImgs];
+  for (int i=0; i<mNumImgs; i++)
+    mNumImgLbls[i] = mImgOffsets[i+1]-mImgOffsets[i];
+  mNumWkrLbls = new int[mNumWkrs];
+  for (int j=0; j<mNumWkrs; j++)
+    mNumWkrLbls[j] = mWkrOffsets[j+1]-mWkrOffsets[j];
+  mNumEntries = mNumLbls;
+  // only the label counts are held in memory
+  mAllocBytes += double(sizeof(int))*(mNumWkrs + mNumImgs);
+  mIsLoaded = true;
+}
+
+void LabelStore::build(const char *dataFile, const char *storeFile) {
+  DataFile data(dataFile);
+  StoreHeader hdr;
+  memset(&hdr, 0, sizeof(StoreHeader));
+  memcpy(hdr.magic, STORE_MAGIC, 8);
+  hdr.numImgs = data.get_num_imgs();
+  hdr.numWkrs = data.get_num_wkrs();
+  hdr.numLbls = data.get_num_lbls();
+  // count the labels per image and per worker in a first pass
+  int numImgs = hdr.numImgs, numWkrs = hdr.numWkrs;
+  int64_t *imgPos = new int64_t[numImgs+1];
+  for (int i=0; i<=numImgs; i++) imgPos[i] = 0;
+  int64_t *wkrPos = new int64_t[numWkrs+1];
+  for (int j=0; j<=numWkrs; j++) wkrPos[j] = 0;
+  try {
+    data.for_each_label([&](int i, int j, int label) {
+      imgPos[i+1] += 1;
+      wkrPos[j+1] += 1;
+    });
+  } catch (...) {
+    delete [] imgPos; delete [] wkrPos;
+    throw;
+  }
+  for (int i=0; i<numImgs; i++) imgPos[i+1] += imgPos[i];
+  for (int j=0; j<numWkrs; j++) wkrPos[j+1] += wkrPos[j];
+  hdr.imgEntryBytes = entry_bytes(numWkrs);
+  hdr.wkrEntryBytes = entry_bytes(numImgs);
+  // write the header and offsets, and size the file for the entries
+  int64_t pos[5];
+  store_layout(hdr, pos);
+  FILE *outFile = fopen(storeFile, "wb");
+  if (!outFile) {
+    delete [] imgPos; delete [] wkrPos;
+    throw io_error(string("Unable to open label store file ") + storeFile
+                   + ".");
+  }
+  fwrite(&hdr, sizeof(StoreHeader), 1, outFile);
+  fseek(outFile, pos[0], SEEK_SET);
+  fwrite(imgPos, sizeof(int64_t), numImgs+1, outFile);
+  fseek(outFile, pos[1], SEEK_SET);
+  fwrite(wkrPos, sizeof(int64_t), numWkrs+1, outFile);
+  fclose(outFile);
+  if (truncate(storeFile, pos[4]) != 0) {
+    delete [] imgPos; delete [] wkrPos;
+    throw io_error(string("Unable to size label store file ") + storeFile
+                   + ".");
+  }
+  // fill the entries through the mapped file in a second pass
+  long long size;
+  char *base = (char*) map_file(storeFile, &size, true);
+  data.for_each_label([&](int i, int j, int label) {
+    set_entry(base+pos[2], hdr.imgEntryBytes, imgPos[i]++, j, label);
+    set_entry(base+pos[3], hdr.wkrEntryBytes, wkrPos[j]++, i, label);
+  });
+  unmap_file(base, size);
+  delete [] imgPos; delete [] wkrPos; // temporary vars
+}
+
+// builds the per image and per worker label lists from mLabels
+void LabelStore::index_labels() {
+  int i, j, label, idx;
+  // allocate mem for the image and worker labels
+  mImgLbls = new int*[mNumImgs];
+  for (i=0; i<mNumImgs; i++)
+    mImgLbls[i] = new int[mNumImgLbls[i]*2];
+  mWkrLbls = new int*[mNumWkrs];
+  for (j=0; j<mNumWkrs; j++)
+    mWkrLbls[j] = new int[mNumWkrLbls[j]*2];
+  // replicate the labels for access from wkrs and imgs
+  int *wkrIdx = new int[mNumWkrs];
+  for (int j=0; j<mNumWkrs; j++) wkrIdx[j] = 0;
+  int *imgIdx = new int[mNumImgs];
+  for (int i=0; i<mNumImgs; i++) imgIdx[i] = 0;
+  for (int k=0; k<mNumLbls; k++) {
+    idx = k*3;
+    i = mLabels[idx]; j = mLabels[idx+1]; label = mLabels[idx+2];
+    // image label
+    (mImgLbls[i])[2*imgIdx[i]] = j;
+    (mImgLbls[i])[2*imgIdx[i]+1] = label;
+    imgIdx[i] += 1;
+    // worker label
+    (mWkrLbls[j])[2*wkrIdx[j]] = i;
+    (mWkrLbls[j])[2*wkrIdx[j]+1] = label;
+    wkrIdx[j] += 1;
+  }
+  delete [] wkrIdx; delete [] imgIdx; // temporary vars
+  mNumEntries = mNumLbls;
+  // keep track of the memory held for the labels
+  mAllocBytes += double(sizeof(int))*(mNumWkrs + mNumImgs + 7*mNumLbls)
+    + double(sizeof(int*))*(mNumWkrs + mNumImgs);
+  mIsLoaded = true;
+}
+
+// sets up the compact image and worker rows from the label counts, and
+// fills them from an (i, j, label) array unless labels is null (in which
+// case the caller fills the entries)
+void LabelStore::index_compact_labels(const int *labels) {
+  mImgEntryBytes = entry_bytes(mNumWkrs);
+  mWkrEntryBytes = entry_bytes(mNumImgs);
+  mImgOffsets = new int64_t[mNumImgs+1];
+  mImgOffsets[0] = 0;
+  for (int i=0; i<mNumImgs; i++)
+    mImgOffsets[i+1] = mImgOffsets[i] + mNumImgLbls[i];
+  mWkrOffsets = new int64_t[mNumWkrs+1];
+  mWkrOffsets[0] = 0;
+  for (int j=0; j<mNumWkrs; j++)
+    mWkrOffsets[j+1] = mWkrOffsets[j] + mNumWkrLbls[j];
+  mImgEntries = new_entries(mImgEntryBytes, mNumLbls);
+  mWkrEntries = new_entries(mWkrEntryBytes, mNumLbls);
+  if (labels != 0) {
+    int64_t *imgPos = new int64_t[mNumImgs];
+    for (int i=0; i<mNumImgs; i++) imgPos[i] = mImgOffsets[i];
+    int64_t *wkrPos = new int64_t[mNumWkrs];
+    for (int j=0; j<mNumWkrs; j++) wkrPos[j] = mWkrOffsets[j];
+    for (int64_t idx=0; idx<3*int64_t(mNumLbls); idx+=3) {
+      int i = labels[idx], j = labels[idx+1], label = labels[idx+2];
+      set_entry(mImgEntries, mImgEntryBytes, imgPos[i]++, j, label);
+      set_entry(mWkrEntries, mWkrEntryBytes, wkrPos[j]++, i, label);
+    }
+    delete [] imgPos; delete [] wkrPos; // temporary vars
+  }
+  mNumEntries = mNumLbls;
+  // keep track of the memory held for the labels
+  mAllocBytes += double(sizeof(int))*(mNumWkrs + mNumImgs)
+    + double(sizeof(int64_t))*(mNumWkrs + mNumImgs + 2)
+    + double(mImgEntryBytes + mWkrEntryBytes)*mNumLbls;
+  mIsLoaded = true;
+}
+
+// collapses the duplicates of an (i, j, label) array into the weighted
+// image and worker rows, given the label counts; the labels of an image
+// keep the order they are first given in, and the labels of a worker are
+// ordered by image
+void LabelStore::index_weighted_labels(const int *labels) {
+  // bucket the (j, label) pairs by image
+  vector<int64_t> start(mNumImgs+1, 0);
+  for (int i=0; i<mNumImgs; i++)
+    start[i+1] = start[i] + mNumImgLbls[i];
+  vector<int> pairs(2*int64_t(mNumLbls));
+  vector<int64_t> pos(start.begin(), start.end()-1);
+  for (int64_t idx=0; idx<3*int64_t(mNumLbls); idx+=3) {
+    int64_t k = pos[labels[idx]]++;
+    pairs[2*k] = labels[idx+1];
+    pairs[2*k+1] = labels[idx+2] != 0;
+  }
+  // collapse the pairs of each image, marking the (j, label) pairs seen for
+  // the current image along with their entry
+  vector<int> seenImg(2*int64_t(mNumWkrs), -1);
+  vector<int64_t> seenAt(2*int64_t(mNumWkrs));
+  vector<int> rows;
+  mImgOffsets = new int64_t[mNumImgs+1];
+  mImgOffsets[0] = 0;
+  int64_t n = 0;
+  for (int i=0; i<mNumImgs; i++) {
+    for (int64_t k=start[i]; k<start[i+1]; k++) {
+      int key = 2*pairs[2*k] + pairs[2*k+1];
+      if (seenImg[key] == i) {
+        rows[3*seenAt[key]+2] += 1;
+        continue;
+      }
+      seenImg[key] = i; seenAt[key] = n++;
+      rows.push_back(pairs[2*k]);
+      rows.push_back(pairs[2*k+1]);
+      rows.push_back(1);
+    }
+    mImgOffsets[i+1] = n;
+  }
+  mNumEntries = n;
+  mImgRows = new int[3*n];
+  copy(rows.begin(), rows.end(), mImgRows);
+  // fill the worker rows from the image rows
+  mWkrOffsets = new int64_t[mNumWkrs+1];
+  for (int j=0; j<=mNumWkrs; j++) mWkrOffsets[j] = 0;
+  for (int64_t k=0; k<n; k++)
+    mWkrOffsets[mImgRows[3*k]+1] += 1;
+  for (int j=0; j<mNumWkrs; j++) mWkrOffsets[j+1] += mWkrOffsets[j];
+  mWkrRows = new int[3*n];
+  vector<int64_t> wkrPos(mWkrOffsets, mWkrOffsets+mNumWkrs);
+  for (int i=0; i<mNumImgs; i++) {
+    for (int64_t k=mImgOffsets[i]; k<mImgOffsets[i+1]; k++) {
+      int *row = mWkrRows + 3*wkrPos[mImgRows[3*k]]++;
+      row[0] = i; row[1] = mImgRows[3*k+1]; row[2] = mImgRows[3*k+2];
+    }
+  }
+  // keep track of the memory held for the labels
+  mAllocBytes += double(sizeof(int))*(mNumWkrs + mNumImgs + 6*n)
+    + double(sizeof(int64_t))*(mNumWkrs + mNumImgs + 2);
+  mIsLoaded = true;
+}
@@ -0,0 +1,257 @@
+#ifndef __LabelStore_hpp_
+#define __LabelStore_hpp_
+
+#include <stdint.h>
+#include "utils.hpp"
+
+// layouts used to store the labels in memory
+enum LabelStorage {
+  // (i, j, label) triplets + (id, label) pairs per image and per worker
+  STORAGE_DEFAULT = 0,
+  // only per image and per worker rows, where each entry packs the label
+  // bit into the id, (id<<1 | label), using as few bytes as the ids allow
+  STORAGE_COMPACT,
+  // duplicate (i, j, label) triplets collapsed into per image and per
+  // worker rows of (id, label, count) triplets, which the models weight
+  // by the count (see for_each_weighted_label)
+  STORAGE_WEIGHTED,
+  // compact rows held in a memory-mapped label store file (set by
+  // load_data_mapped, see build)
+  STORAGE_MAPPED
+};
+
+// bytes of a mapped label store that are read ahead of their use
+#define STORE_CHUNK (1<<22)
+
+// labels of a data set, which any number of models can share (see
+// BinaryModel::attach_label_store); a store starts out with one reference
+// and deletes itself when the last reference is released
+class LabelStore {
+public:
+  LabelStore(int storage=STORAGE_DEFAULT);
+
+  void retain() { mRefs += 1; }
+  void release();
+
+  void load_data(const char *filename);
+  void load_data(int numImgs, int numWkrs, int numLbls, const int *labels);
+  void load_data_mapped(const char *storeFile);
+
+  // writes the labels of a data file to a label store file, which holds
+  // the compact image and worker rows (see STORAGE_COMPACT) so that they
+  // can be mapped by load_data_mapped; only the per image and per worker
+  // label counts are held in memory while writing it
+  static void build(const char *dataFile, const char *storeFile);
+
+  bool is_loaded() { return mIsLoaded; }
+  int get_num_refs() { return mRefs; }
+  int get_storage() { return mStorage; }
+  int get_num_wkrs() { return mNumWkrs; }
+  int get_num_imgs() { return mNumImgs; }
+  int get_num_lbls() { return mNumLbls; }
+  // no. of distinct labels held (the no. of labels unless weighted)
+  int get_num_entries() { return mNumEntries; }
+  int *get_num_wkr_lbls() { return mNumWkrLbls; }
+  int *get_num_img_lbls() { return mNumImgLbls; }
+  // bytes allocated for the labels, and bytes of label store file mapped
+  double get_alloc_bytes() { return mAllocBytes; }
+  double get_mapped_bytes() { return mStoreSize; }
+  void get_label_array(int *labels);
+
+  // call fn(i, j, lij) for every label
+  template <class Fn> void for_each_label(Fn fn);
+  // call fn(j, lij) for every label of image imgId
+  template <class Fn> void for_each_img_label(int imgId, Fn fn);
+  // call fn(i, lij) for every label of worker wkrId
+  template <class Fn> void for_each_wkr_label(int wkrId, Fn fn);
+  // as the above, but calling fn(..., count) once per distinct label with
+  // the no. of times it was given (always 1 unless the storage is weighted)
+  template <class Fn> void for_each_weighted_label(Fn fn);
+  template <class Fn> void for_each_weighted_img_label(int imgId, Fn fn);
+  template <class Fn> void for_each_weighted_wkr_label(int wkrId, Fn fn);
+
+private:
+  ~LabelStore(); // use release
+
+  void init_counts();
+  void index_labels();
+  void index_compact_labels(const int *labels);
+  void index_weighted_labels(const int *labels);
+
+  int mRefs;
+  bool mIsLoaded;
+  int mNumWkrs;
+  int mNumImgs;
+  int mNumLbls;
+  int mNumEntries;
+  int *mNumWkrLbls;
+  int *mNumImgLbls;
+  double mAllocBytes;
+
+  int **mWkrLbls;
+  int **mImgLbls;
+  int *mLabels;
+
+  // compact storage: entries of the image rows (holding worker ids) and of
+  // the worker rows (holding image ids), with the row offsets
+  int mStorage;
+  int mImgEntryBytes;
+  int mWkrEntryBytes;
+  void *mImgEntries;
+  void *mWkrEntries;
+  int64_t *mImgOffsets;
+  int64_t *mWkrOffsets;
+
+  // weighted storage: (worker id, label, count) triplets of the image rows
+  // and (image id, label, count) triplets of the worker rows, with the row
+  // offsets in mImgOffsets and mWkrOffsets
+  int *mImgRows;
+  int *mWkrRows;
+
+  // mapped label store file
+  void *mStore;
+  long long mStoreSize;
+
+  template <class T, class Fn>
+  void for_each_compact_label(const T *entries, Fn &fn);
+  template <class T, class Fn>
+  void for_each_compact_entry(const T *entries, int64_t begin, int64_t end,
+                              Fn &fn);
+};
+
+template <class Fn>
+void LabelStore::for_each_label(Fn fn) {
+  if (mStorage == STORAGE_DEFAULT) {
+    for (int64_t idx=0; idx<3*int64_t(mNumLbls); idx+=3)
+      fn(mLabels[idx], mLabels[idx+1], mLabels[idx+2]);
+    return;
+  }
+  if (mStorage == STORAGE_WEIGHTED) {
+    // each distinct label is repeated by its count
+    for (int i=0; i<mNumImgs; i++)
+      for (int64_t k=mImgOffsets[i]; k<mImgOffsets[i+1]; k++)
+        for (int n=0; n<mImgRows[3*k+2]; n++)
+          fn(i, mImgRows[3*k], mImgRows[3*k+1]);
+    return;
+  }
+  switch (mImgEntryBytes) {
+  case 1: for_each_compact_label((const uint8_t*) mImgEntries, fn); break;
+  case 2: for_each_compact_label((const uint16_t*) mImgEntries, fn); break;
+  default: for_each_compact_label((const uint32_t*) mImgEntries, fn);
+  }
+}
+
+template <class Fn>
+void LabelStore::for_each_img_label(int imgId, Fn fn) {
+  if (mStorage == STORAGE_DEFAULT) {
+    int *lbls = mImgLbls[imgId];
+    for (int idx=0; idx<2*mNumImgLbls[imgId]; idx+=2)
+      fn(lbls[idx], lbls[idx+1]);
+    return;
+  }
+  if (mStorage == STORAGE_WEIGHTED) {
+    for (int64_t k=mImgOffsets[imgId]; k<mImgOffsets[imgId+1]; k++)
+      for (int n=0; n<mImgRows[3*k+2]; n++)
+        fn(mImgRows[3*k], mImgRows[3*k+1]);
+    return;
+  }
+  int64_t begin = mImgOffsets[imgId], end = mImgOffsets[imgId+1];
+  switch (mImgEntryBytes) {
+  case 1:
+    for_each_compact_entry((const uint8_t*) mImgEntries, begin, end, fn);
+    break;
+  case 2:
+    for_each_compact_entry((const uint16_t*) mImgEntries, begin, end, fn);
+    break;
+  default:
+    for_each_compact_entry((const uint32_t*) mImgEntries, begin, end, fn);
+  }
+}
+
+template <class Fn>
+void LabelStore::for_each_wkr_label(int wkrId, Fn fn) {
+  if (mStorage == STORAGE_DEFAULT) {
+    int *lbls = mWkrLbls[wkrId];
+    for (int idx=0; idx<2*mNumWkrLbls[wkrId]; idx+=2)
+      fn(lbls[idx], lbls[idx+1]);
+    return;
+  }
+  if (mStorage == STORAGE_WEIGHTED) {
+    for (int64_t k=mWkrOffsets[wkrId]; k<mWkrOffsets[wkrId+1]; k++)
+      for (int n=0; n<mWkrRows[3*k+2]; n++)
+        fn(mWkrRows[3*k], mWkrRows[3*k+1]);
+    return;
+  }
+  int64_t begin = mWkrOffsets[wkrId], end = mWkrOffsets[wkrId+1];
+  switch (mWkrEntryBytes) {
+  case 1:
+    for_each_compact_entry((const uint8_t*) mWkrEntries, begin, end, fn);
+    break;
+  case 2:
+    for_each_compact_entry((const uint16_t*) mWkrEntries, begin, end, fn);
+    break;
+  default:
+    for_each_compact_entry((const uint32_t*) mWkrEntries, begin, end, fn);
+  }
+}
+
+template <class Fn>
+void LabelStore::for_each_weighted_label(Fn fn) {
+  if (mStorage != STORAGE_WEIGHTED) {
+    for_each_label([&](int i, int j, int lij) { fn(i, j, lij, 1); });
+    return;
+  }
+  for (int i=0; i<mNumImgs; i++) {
+    const int *row = mImgRows + 3*mImgOffsets[i];
+    for (int64_t k=mImgOffsets[i]; k<mImgOffsets[i+1]; k++, row+=3)
+      fn(i, row[0], row[1], row[2]);
+  }
+}
+
+template <class Fn>
+void LabelStore::for_each_weighted_img_label(int imgId, Fn fn) {
+  if (mStorage != STORAGE_WEIGHTED) {
+    for_each_img_label(imgId, [&](int j, int lij) { fn(j, lij, 1); });
+    return;
+  }
+  const int *row = mImgRows + 3*mImgOffsets[imgId];
+  for (int64_t k=mImgOffsets[imgId]; k<mImgOffsets[imgId+1]; k++, row+=3)
+    fn(row[0], row[1], row[2]);
+}
+
+template <class Fn>
+void LabelStore::for_each_weighted_wkr_label(int wkrId, Fn fn) {
+  if (mStorage != STORAGE_WEIGHTED) {
+    for_each_wkr_label(wkrId, [&](int i, int lij) { fn(i, lij, 1); });
+    return;
+  }
+  const int *row = mWkrRows + 3*mWkrOffsets[wkrId];
+  for (int64_t k=mWkrOffsets[wkrId]; k<mWkrOffsets[wkrId+1]; k++, row+=3)
+    fn(row[0], row[1], row[2]);
+}
+
+template <class T, class Fn>
+void LabelStore::for_each_compact_label(const T *entries, Fn &fn) {
+  // when the labels are mapped, keep a chunk ahead of the scan in memory
+  int64_t chunk = STORE_CHUNK/sizeof(T), ahead = 0;
+  bool mapped = (mStorage == STORAGE_MAPPED);
+  for (int i=0; i<mNumImgs; i++) {
+    int64_t end = mImgOffsets[i+1];
+    while (mapped && ahead < mNumLbls && ahead < end+chunk) {
+      int64_t len = (mNumLbls-ahead < chunk) ? mNumLbls-ahead : chunk;
+      read_ahead(entries+ahead, len*sizeof(T));
+      ahead += len;
+    }
+    for (int64_t k=mImgOffsets[i]; k<end; k++)
+      fn(i, int(entries[k] >> 1), int(entries[k] & 1));
+  }
+}
+
+template <class T, class Fn>
+void LabelStore::for_each_compact_entry(const T *entries, int64_t begin,
+                                        int64_t end, Fn &fn) {
+  for (int64_t k=begin; k<end; k++)
+    fn(int(entries[k] >> 1), int(entries[k] & 1));
+}
+
+#endif
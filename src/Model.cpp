@@ -1,4 +1,7 @@
+#include <stdexcept>
+#include <algorithm>
 #include "Model.hpp"
+#include "utils.hpp"
 using namespace std;
 
 Model::Model() {
@@ -8,6 +11,7 @@ Model::Model() {
   mDataIsLoaded = false;
   mNumWkrLbls = 0;
   mNumImgLbls = 0;
+  reset_stats();
 }
 
 Model::~Model() {
@@ -19,6 +23,42 @@ void Model::clear_data() {
   delete [] mNumImgLbls; mNumImgLbls = 0;
 }
 
+void Model::set_term_weights(double *weights) {
+  throw runtime_error("Term weights are not supported by this model.");
+}
+
+void Model::attach_image_param(double *xis) {
+  throw runtime_error("Attaching parameters is not supported by this model.");
+}
+
+void Model::worker_objective_batch(int nids, const int *ids, double *prm,
+                                   int nprm, int nout, double *obj,
+                                   int nthreads) {
+  // the objectives only read the model, so the workers can run concurrently
+  parallel_for(nids, nthreads, [&](int k) {
+    this->worker_objective(ids[k], prm, nprm, obj + (long long)k*nout);
+  });
+}
+
+void Model::image_objective_batch(int nids, const int *ids, double *prm,
+                                  int nprm, int nout, double *obj,
+                                  int nthreads) {
+  parallel_for(nids, nthreads, [&](int k) {
+    this->image_objective(ids[k], prm, nprm, obj + (long long)k*nout);
+  });
+}
+
+void Model::label_loglik_batch(int nlbls, const int *labels, double *ll,
+                               int nthreads) {
+  // hand out the labels in chunks, as each one is cheap
+  const int chunk = 4096;
+  parallel_for((nlbls+chunk-1)/chunk, nthreads, [&](int c) {
+    int end = min(nlbls, (c+1)*chunk);
+    for (int k=c*chunk; k<end; k++)
+      ll[k] = this->label_loglik(labels[3*k], labels[3*k+1], labels[3*k+2]);
+  });
+}
+
 void Model::get_num_wkr_lbls(int *num) {
   for (int j=0; j<mNumWkrs; j++)
     num[j] = mNumWkrLbls[j];
@@ -28,3 +68,20 @@ void Model::get_num_img_lbls(int *num) {
   for (int i=0; i<mNumImgs; i++)
     num[i] = mNumImgLbls[i];
 }
+
+void Model::record_call(int kernel, double nlbls, double ns) {
+  double *stat = mStats + kernel*STAT_FIELDS;
+  stat[0] += 1.0;
+  stat[1] += nlbls;
+  stat[2] += ns;
+}
+
+void Model::get_stats(double *stats) {
+  for (int k=0; k<STAT_LEN; k++)
+    stats[k] = mStats[k];
+}
+
+void Model::reset_stats() {
+  for (int k=0; k<STAT_LEN; k++)
+    mStats[k] = 0.0;
+}
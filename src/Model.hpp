@@ -1,6 +1,24 @@
 #ifndef __Model_hpp__
 #define __Model_hpp__
 
+class LabelStore;
+
+// kernels whose calls are counted and timed (see get_stats)
+enum StatKernel {
+  STAT_OBJECTIVE = 0,
+  STAT_GRADIENT,
+  STAT_WORKER_OBJECTIVE,
+  STAT_IMAGE_OBJECTIVE,
+  STAT_LOAD_DATA,
+  STAT_LABEL_LOGLIK,
+  STAT_NUM_KERNELS
+};
+// fields recorded per kernel: (calls, labels processed, nanoseconds)
+#define STAT_FIELDS 3
+// the stats vector ends with the no. of bytes allocated by load_data and
+// the no. of bytes mapped by load_data_mapped
+#define STAT_LEN (STAT_NUM_KERNELS*STAT_FIELDS+2)
+
 class Model {
 public:
   Model();
@@ -18,16 +36,48 @@ public:
   
   virtual void worker_objective(int, double*, int, double*) = 0;
   virtual void image_objective(int, double*, int, double*) = 0;
+  // worker_objective (image_objective) of the parameters prm for each of the
+  // nids workers (images) in ids, with nout values each, on nthreads threads
+  void worker_objective_batch(int nids, const int *ids, double *prm,
+                              int nprm, int nout, double *obj, int nthreads);
+  void image_objective_batch(int nids, const int *ids, double *prm,
+                             int nprm, int nout, double *obj, int nthreads);
+  // log-likelihood of label lij of worker j for image i under the current
+  // parameters (the labels need not be loaded)
+  virtual double label_loglik(int i, int j, int lij) = 0;
+  // label_loglik of each of the nlbls (i, j, label) triplets in labels, on
+  // nthreads threads
+  void label_loglik_batch(int nlbls, const int *labels, double *ll,
+                          int nthreads);
 
   virtual void load_data(const char *filename) = 0;
+  virtual void load_data(int numImgs, int numWkrs, int numLbls,
+                         const int *labels) = 0;
+  // use the labels of a label store file in place, without reading them
+  virtual void load_data_mapped(const char *storeFile) = 0;
+  // use the labels of a store shared with other models
+  virtual void attach_label_store(LabelStore *store) = 0;
+  virtual LabelStore *get_label_store() = 0;
   virtual void clear_data() = 0;
+  virtual void set_label_storage(int storage) = 0;
 
   virtual double objective() = 0;
   virtual void gradient(double *grad) = 0;
 
+  // weights of the label, image prior and worker prior terms in the
+  // objective and gradient (all 1 by default)
+  virtual void set_term_weights(double *weights);
+  // use an external buffer as the image parameters (not copied or freed)
+  virtual void attach_image_param(double *xis);
+  // (i, j, label) triplets of all labels
+  virtual void get_label_array(int *labels) = 0;
+  // (j, label) pairs of the labels of image imgId
+  virtual void get_image_labels(int imgId, int *wkrIds, int *labels) = 0;
+
   int get_num_wkrs() { return mNumWkrs; }
   int get_num_imgs() { return mNumImgs; }
   int get_num_lbls() { return mNumLbls; }
+  bool is_data_loaded() { return mDataIsLoaded; }
   
   virtual int get_worker_param_len() = 0;
   virtual int get_image_param_len() = 0;
@@ -35,6 +85,16 @@ public:
   
   void get_num_wkr_lbls(int *num);
   void get_num_img_lbls(int *num);
+  int get_num_wkr_lbls(int wkrId) { return mNumWkrLbls[wkrId]; }
+  int get_num_img_lbls(int imgId) { return mNumImgLbls[imgId]; }
+
+  // instrumentation counters
+  void record_call(int kernel, double nlbls, double ns);
+  void record_alloc(double bytes) { mStats[STAT_LEN-2] += bytes; }
+  void record_map(double bytes) { mStats[STAT_LEN-1] += bytes; }
+  void get_stats(double *stats);
+  void reset_stats();
+  int get_stats_len() { return STAT_LEN; }
 
 protected:
   virtual void clear_worker_param() = 0;
@@ -46,6 +106,7 @@ protected:
   int *mNumWkrLbls;
   int *mNumImgLbls;
   bool mDataIsLoaded;
+  double mStats[STAT_LEN];
 };
 
 #endif
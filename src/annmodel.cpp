@@ -1,8 +1,11 @@
 #include <cstring>
+#include <new>
+#include <string>
 
 #include "utils.hpp"
 #include "Binary1dSignalModel.hpp"
 #include "BinaryNdSignalModel.hpp"
+#include "BatchFit.hpp"
 #include "annmodel.hpp"
 
 using namespace std;
@@ -12,6 +15,32 @@ using namespace std;
 //#define CALL_MEMBER_FN(object,ptrToMember)  ((object).*(ptrToMember))
 //typedef void (Model::*ModelMemFn)(const char *filename);
 
+// message of the last failed load on each thread
+static thread_local string lastError;
+
+// runs the load fn, turning the exceptions it throws into a LoadStatus
+template <class Fn> static int catch_load_errors(Fn fn) {
+  try {
+    fn();
+    return LOAD_OK;
+  } catch (const io_error &e) {
+    lastError = e.what();
+    return LOAD_IO_ERROR;
+  } catch (const bad_alloc &e) {
+    lastError = "Out of memory while loading the labels.";
+    return LOAD_MEMORY_ERROR;
+  } catch (const exception &e) {
+    lastError = e.what();
+    return LOAD_VALUE_ERROR;
+  } catch (...) {
+    lastError = "Unknown error while loading the labels.";
+    return LOAD_VALUE_ERROR;
+  }
+}
+
+EXPORTED const char *get_last_error() {
+  return lastError.c_str();
+}
 
 EXPORTED MODEL_PTR setup_model(const char* model) {
   Model *ptr = 0;
@@ -31,9 +60,128 @@ EXPORTED void clear_model(MODEL_PTR ptr) {
   mptr = 0; ptr = 0;
 }
 
-EXPORTED void load_data(MODEL_PTR ptr, const char *filename) {
+EXPORTED void clear_data(MODEL_PTR ptr) {
+  Model *mptr = (Model*) ptr;
+  mptr->clear_data();
+}
+
+EXPORTED void set_label_storage(MODEL_PTR ptr, int storage) {
+  Model *mptr = (Model*) ptr;
+  mptr->set_label_storage(storage);
+}
+
+EXPORTED int load_data(MODEL_PTR ptr, const char *filename) {
+  Model *mptr = (Model*) ptr;
+  return catch_load_errors([&]() {
+    double t0 = now_ns();
+    mptr->load_data(filename);
+    mptr->record_call(STAT_LOAD_DATA, mptr->get_num_lbls(), now_ns()-t0);
+  });
+}
+
+EXPORTED int load_data_array(MODEL_PTR ptr, int numImgs, int numWkrs,
+                             int numLbls, int *labels) {
+  Model *mptr = (Model*) ptr;
+  return catch_load_errors([&]() {
+    double t0 = now_ns();
+    mptr->load_data(numImgs, numWkrs, numLbls, labels);
+    mptr->record_call(STAT_LOAD_DATA, mptr->get_num_lbls(), now_ns()-t0);
+  });
+}
+
+EXPORTED int load_data_mapped(MODEL_PTR ptr, const char *storeFile) {
+  Model *mptr = (Model*) ptr;
+  return catch_load_errors([&]() {
+    double t0 = now_ns();
+    mptr->load_data_mapped(storeFile);
+    mptr->record_call(STAT_LOAD_DATA, mptr->get_num_lbls(), now_ns()-t0);
+  });
+}
+
+EXPORTED int build_label_store(const char *dataFile, const char *storeFile) {
+  return catch_load_errors([&]() {
+    LabelStore::build(dataFile, storeFile);
+  });
+}
+
+EXPORTED STORE_PTR new_label_store(int storage) {
+  return (STORE_PTR) new LabelStore(storage);
+}
+
+EXPORTED void retain_label_store(STORE_PTR sptr) {
+  LabelStore *store = (LabelStore*) sptr;
+  store->retain();
+}
+
+EXPORTED void release_label_store(STORE_PTR sptr) {
+  if (sptr == 0)
+    return;
+  LabelStore *store = (LabelStore*) sptr;
+  store->release();
+}
+
+EXPORTED int label_store_load_data(STORE_PTR sptr, const char *filename) {
+  LabelStore *store = (LabelStore*) sptr;
+  return catch_load_errors([&]() { store->load_data(filename); });
+}
+
+EXPORTED int label_store_load_data_array(STORE_PTR sptr, int numImgs,
+                                         int numWkrs, int numLbls,
+                                         int *labels) {
+  LabelStore *store = (LabelStore*) sptr;
+  return catch_load_errors([&]() {
+    store->load_data(numImgs, numWkrs, numLbls, labels);
+  });
+}
+
+EXPORTED int label_store_load_data_mapped(STORE_PTR sptr,
+                                          const char *storeFile) {
+  LabelStore *store = (LabelStore*) sptr;
+  return catch_load_errors([&]() { store->load_data_mapped(storeFile); });
+}
+
+EXPORTED int label_store_get_num_wkrs(STORE_PTR sptr) {
+  LabelStore *store = (LabelStore*) sptr;
+  return store->get_num_wkrs();
+}
+
+EXPORTED int label_store_get_num_imgs(STORE_PTR sptr) {
+  LabelStore *store = (LabelStore*) sptr;
+  return store->get_num_imgs();
+}
+
+EXPORTED int label_store_get_num_lbls(STORE_PTR sptr) {
+  LabelStore *store = (LabelStore*) sptr;
+  return store->get_num_lbls();
+}
+
+EXPORTED int label_store_get_storage(STORE_PTR sptr) {
+  LabelStore *store = (LabelStore*) sptr;
+  return store->get_storage();
+}
+
+EXPORTED int label_store_get_num_refs(STORE_PTR sptr) {
+  LabelStore *store = (LabelStore*) sptr;
+  return store->get_num_refs();
+}
+
+EXPORTED void label_store_get_label_array(STORE_PTR sptr, int *labels) {
+  LabelStore *store = (LabelStore*) sptr;
+  store->get_label_array(labels);
+}
+
+EXPORTED int attach_label_store(MODEL_PTR ptr, STORE_PTR sptr) {
+  Model *mptr = (Model*) ptr;
+  return catch_load_errors([&]() {
+    double t0 = now_ns();
+    mptr->attach_label_store((LabelStore*) sptr);
+    mptr->record_call(STAT_LOAD_DATA, 0.0, now_ns()-t0);
+  });
+}
+
+EXPORTED STORE_PTR get_label_store(MODEL_PTR ptr) {
   Model *mptr = (Model*) ptr;
-  mptr->load_data(filename);
+  return (STORE_PTR) mptr->get_label_store();
 }
 
 EXPORTED void set_model_param(MODEL_PTR ptr, double *prm) {
@@ -68,24 +216,100 @@ EXPORTED void get_image_param(MODEL_PTR ptr, double *prm) {
 
 EXPORTED double objective(MODEL_PTR ptr) {
   Model *mptr = (Model*) ptr;
-  return mptr->objective();
+  double t0 = now_ns();
+  double obj = mptr->objective();
+  mptr->record_call(STAT_OBJECTIVE, mptr->get_num_lbls(), now_ns()-t0);
+  return obj;
 }
 
 EXPORTED void image_objective(MODEL_PTR ptr, int imgId, double *prm, 
                               int nprm, double* obj) {
   Model *mptr = (Model*) ptr;
-  mptr->image_objective(imgId, prm, nprm, obj);                                
+  double t0 = now_ns();
+  mptr->image_objective(imgId, prm, nprm, obj);
+  mptr->record_call(STAT_IMAGE_OBJECTIVE, mptr->get_num_img_lbls(imgId),
+                    now_ns()-t0);
 }
 
 EXPORTED void worker_objective(MODEL_PTR ptr, int wkrId, double *prm, 
                                int nprm, double* obj) {
   Model *mptr = (Model*) ptr;
-  mptr->worker_objective(wkrId, prm, nprm, obj);                                
+  double t0 = now_ns();
+  mptr->worker_objective(wkrId, prm, nprm, obj);
+  mptr->record_call(STAT_WORKER_OBJECTIVE, mptr->get_num_wkr_lbls(wkrId),
+                    now_ns()-t0);
+}
+
+EXPORTED void image_objective_batch(MODEL_PTR ptr, int nids, int *ids,
+                                    double *prm, int nprm, int nout,
+                                    double *obj, int nthreads) {
+  Model *mptr = (Model*) ptr;
+  double t0 = now_ns();
+  mptr->image_objective_batch(nids, ids, prm, nprm, nout, obj, nthreads);
+  double nlbls = 0.0;
+  for (int k=0; k<nids; k++)
+    nlbls += mptr->get_num_img_lbls(ids[k]);
+  mptr->record_call(STAT_IMAGE_OBJECTIVE, nlbls, now_ns()-t0);
+}
+
+EXPORTED void worker_objective_batch(MODEL_PTR ptr, int nids, int *ids,
+                                     double *prm, int nprm, int nout,
+                                     double *obj, int nthreads) {
+  Model *mptr = (Model*) ptr;
+  double t0 = now_ns();
+  mptr->worker_objective_batch(nids, ids, prm, nprm, nout, obj, nthreads);
+  double nlbls = 0.0;
+  for (int k=0; k<nids; k++)
+    nlbls += mptr->get_num_wkr_lbls(ids[k]);
+  mptr->record_call(STAT_WORKER_OBJECTIVE, nlbls, now_ns()-t0);
 }
 
 EXPORTED void gradient(MODEL_PTR ptr, double *grad) {
   Model *mptr = (Model*) ptr;
+  double t0 = now_ns();
   mptr->gradient(grad);
+  mptr->record_call(STAT_GRADIENT, mptr->get_num_lbls(), now_ns()-t0);
+}
+
+EXPORTED void label_loglik_batch(MODEL_PTR ptr, int nlbls, int *labels,
+                                 double *ll, int nthreads) {
+  Model *mptr = (Model*) ptr;
+  double t0 = now_ns();
+  mptr->label_loglik_batch(nlbls, labels, ll, nthreads);
+  mptr->record_call(STAT_LABEL_LOGLIK, nlbls, now_ns()-t0);
+}
+
+EXPORTED void set_term_weights(MODEL_PTR ptr, double *weights) {
+  Model *mptr = (Model*) ptr;
+  mptr->set_term_weights(weights);
+}
+
+EXPORTED void attach_image_param(MODEL_PTR ptr, double *xis) {
+  Model *mptr = (Model*) ptr;
+  mptr->attach_image_param(xis);
+}
+
+EXPORTED void get_label_array(MODEL_PTR ptr, int *labels) {
+  Model *mptr = (Model*) ptr;
+  mptr->get_label_array(labels);
+}
+
+// whether the model has data loaded with an image imgId
+static bool has_image(Model *mptr, int imgId) {
+  return mptr->is_data_loaded() && imgId >= 0
+    && imgId < mptr->get_num_imgs();
+}
+
+EXPORTED void get_image_labels(MODEL_PTR ptr, int imgId, int *wkrIds,
+                               int *labels) {
+  Model *mptr = (Model*) ptr;
+  if (has_image(mptr, imgId))
+    mptr->get_image_labels(imgId, wkrIds, labels);
+}
+
+EXPORTED int get_image_num_lbls(MODEL_PTR ptr, int imgId) {
+  Model *mptr = (Model*) ptr;
+  return has_image(mptr, imgId) ? mptr->get_num_img_lbls(imgId) : 0;
 }
 
 EXPORTED void get_num_wkr_lbls(MODEL_PTR ptr, int *num) {
@@ -127,3 +351,29 @@ EXPORTED int get_image_param_len(MODEL_PTR ptr) {
   Model *mptr = (Model*) ptr;
   return mptr->get_image_param_len();
 }
+
+EXPORTED int get_stats_len(MODEL_PTR ptr) {
+  Model *mptr = (Model*) ptr;
+  return mptr->get_stats_len();
+}
+
+EXPORTED void get_stats(MODEL_PTR ptr, double *stats) {
+  Model *mptr = (Model*) ptr;
+  mptr->get_stats(stats);
+}
+
+EXPORTED void reset_stats(MODEL_PTR ptr) {
+  Model *mptr = (Model*) ptr;
+  mptr->reset_stats();
+}
+
+EXPORTED void fit_batch(const char *model, double *mdlPrm, int numProbs,
+                        long long *lblOffsets, int *numImgs, int *numWkrs,
+                        int *labels, int numIter, double tol, int seed,
+                        long long *imgOffsets, double *imgPrm,
+                        long long *wkrOffsets, double *wkrPrm, double *info,
+                        int nthreads) {
+  batch_fit(model, mdlPrm, numProbs, lblOffsets, numImgs, numWkrs, labels,
+            numIter, tol, seed, imgOffsets, imgPrm, wkrOffsets, wkrPrm, info,
+            nthreads);
+}
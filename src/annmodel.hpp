@@ -3,11 +3,48 @@
 
 #define EXPORTED extern "C"
 typedef void* MODEL_PTR;
+typedef void* STORE_PTR;
 
 EXPORTED MODEL_PTR setup_model(const char*);
 EXPORTED void clear_model(MODEL_PTR ptr);
+EXPORTED void clear_data(MODEL_PTR ptr);
 
-EXPORTED void load_data(MODEL_PTR ptr, const char* filename);
+// outcome of the functions that load labels, which catch the exceptions
+// of bad files or data (these must not cross the C interface), and keep
+// their message for get_last_error
+enum LoadStatus {
+  LOAD_OK = 0,
+  LOAD_IO_ERROR,     // a file could not be opened, mapped or written
+  LOAD_VALUE_ERROR,  // malformed data or invalid ids or counts
+  LOAD_MEMORY_ERROR  // out of memory
+};
+// message of the last failed load on the calling thread
+EXPORTED const char *get_last_error();
+
+EXPORTED void set_label_storage(MODEL_PTR ptr, int storage);
+EXPORTED int load_data(MODEL_PTR ptr, const char* filename);
+EXPORTED int load_data_array(MODEL_PTR ptr, int numImgs, int numWkrs,
+                             int numLbls, int *labels);
+EXPORTED int load_data_mapped(MODEL_PTR ptr, const char* storeFile);
+EXPORTED int build_label_store(const char* dataFile, const char* storeFile);
+
+EXPORTED STORE_PTR new_label_store(int storage);
+EXPORTED void retain_label_store(STORE_PTR sptr);
+EXPORTED void release_label_store(STORE_PTR sptr);
+EXPORTED int label_store_load_data(STORE_PTR sptr, const char* filename);
+EXPORTED int label_store_load_data_array(STORE_PTR sptr, int numImgs,
+                                         int numWkrs, int numLbls,
+                                         int *labels);
+EXPORTED int label_store_load_data_mapped(STORE_PTR sptr,
+                                          const char* storeFile);
+EXPORTED int label_store_get_num_wkrs(STORE_PTR sptr);
+EXPORTED int label_store_get_num_imgs(STORE_PTR sptr);
+EXPORTED int label_store_get_num_lbls(STORE_PTR sptr);
+EXPORTED int label_store_get_storage(STORE_PTR sptr);
+EXPORTED int label_store_get_num_refs(STORE_PTR sptr);
+EXPORTED void label_store_get_label_array(STORE_PTR sptr, int *labels);
+EXPORTED int attach_label_store(MODEL_PTR ptr, STORE_PTR sptr);
+EXPORTED STORE_PTR get_label_store(MODEL_PTR ptr);
 
 EXPORTED void set_model_param(MODEL_PTR ptr, double *prm);
 EXPORTED void get_model_param(MODEL_PTR ptr, double *prm);
@@ -22,8 +59,25 @@ EXPORTED void image_objective(MODEL_PTR ptr, int imgId, double *prm,
                               int nprm, double* obj);
 EXPORTED void worker_objective(MODEL_PTR ptr, int wkrId, double *prm, 
                                int nprm, double* obj);
+EXPORTED void image_objective_batch(MODEL_PTR ptr, int nids, int *ids,
+                                    double *prm, int nprm, int nout,
+                                    double *obj, int nthreads);
+EXPORTED void worker_objective_batch(MODEL_PTR ptr, int nids, int *ids,
+                                     double *prm, int nprm, int nout,
+                                     double *obj, int nthreads);
 EXPORTED void gradient(MODEL_PTR ptr, double *grad);
+EXPORTED void label_loglik_batch(MODEL_PTR ptr, int nlbls, int *labels,
+                                 double *ll, int nthreads);
+
+EXPORTED void set_term_weights(MODEL_PTR ptr, double *weights);
+EXPORTED void attach_image_param(MODEL_PTR ptr, double *xis);
+EXPORTED void get_label_array(MODEL_PTR ptr, int *labels);
+// the labels of image imgId and their no., none unless imgId is an image
+// of the loaded data
+EXPORTED void get_image_labels(MODEL_PTR ptr, int imgId, int *wkrIds,
+                               int *labels);
 
+EXPORTED int get_image_num_lbls(MODEL_PTR ptr, int imgId);
 EXPORTED void get_num_wkr_lbls(MODEL_PTR ptr, int *num);
 EXPORTED void get_num_img_lbls(MODEL_PTR ptr, int *num);
 
@@ -35,4 +89,15 @@ EXPORTED int get_model_param_len(MODEL_PTR ptr);
 EXPORTED int get_worker_param_len(MODEL_PTR ptr);
 EXPORTED int get_image_param_len(MODEL_PTR ptr);
 
+EXPORTED int get_stats_len(MODEL_PTR ptr);
+EXPORTED void get_stats(MODEL_PTR ptr, double *stats);
+EXPORTED void reset_stats(MODEL_PTR ptr);
+
+EXPORTED void fit_batch(const char *model, double *mdlPrm, int numProbs,
+                        long long *lblOffsets, int *numImgs, int *numWkrs,
+                        int *labels, int numIter, double tol, int seed,
+                        long long *imgOffsets, double *imgPrm,
+                        long long *wkrOffsets, double *wkrPrm, double *info,
+                        int nthreads);
+
 #endif
@@ -1,4 +1,14 @@
 #include <cmath>
+#include <ctime>
+#include <stdexcept>
+#include <stdint.h>
+#include <atomic>
+#include <thread>
+#include <vector>
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
 #include "utils.hpp"
 
 using namespace std;
@@ -25,3 +35,65 @@ double cdf(double x)
 
   }
 }
+
+double now_ns()
+{
+  timespec ts;
+  clock_gettime(CLOCK_MONOTONIC, &ts);
+  return double(ts.tv_sec)*1e9 + double(ts.tv_nsec);
+}
+
+void *map_file(const char *filename, long long *size, bool writable)
+{
+  int fd = open(filename, writable ? O_RDWR : O_RDONLY);
+  if (fd < 0)
+    throw io_error(string("Unable to open file ") + filename + ".");
+  struct stat st;
+  fstat(fd, &st);
+  *size = st.st_size;
+  int prot = writable ? PROT_READ|PROT_WRITE : PROT_READ;
+  void *addr = mmap(0, st.st_size, prot, MAP_SHARED, fd, 0);
+  close(fd); // the mapping keeps the file open
+  if (addr == MAP_FAILED)
+    throw io_error(string("Unable to map file ") + filename + ".");
+  // the labels are mostly streamed in order
+  madvise(addr, st.st_size, MADV_SEQUENTIAL);
+  return addr;
+}
+
+void unmap_file(void *addr, long long size)
+{
+  munmap(addr, size);
+}
+
+void read_ahead(const void *addr, long long len)
+{
+  // madvise needs a page aligned start
+  long pageSize = sysconf(_SC_PAGESIZE);
+  uintptr_t start = uintptr_t(addr) & ~uintptr_t(pageSize-1);
+  madvise((void*) start, uintptr_t(addr)-start+len, MADV_WILLNEED);
+}
+
+void parallel_for(int n, int nthreads, const function<void(int)> &fn)
+{
+  if(nthreads <= 0)
+    nthreads = thread::hardware_concurrency();
+  if(nthreads > n)
+    nthreads = n;
+  if(nthreads <= 1) {
+    for(int k=0; k<n; k++)
+      fn(k);
+    return;
+  }
+  atomic<int> next(0);
+  auto run = [&]() {
+    for(int k=next++; k<n; k=next++)
+      fn(k);
+  };
+  vector<thread> threads;
+  for(int t=1; t<nthreads; t++)
+    threads.push_back(thread(run));
+  run();
+  for(size_t t=0; t<threads.size(); t++)
+    threads[t].join();
+}
@@ -1,8 +1,9 @@
 #ifndef __UTILS_HPP__
 #define __UTILS_HPP__
 
-// no of chars in line buffer
-#define LINELEN 100
+#include <functional>
+#include <stdexcept>
+#include <string>
 
 // mathematical helpers
 #define PI 3.14159265
@@ -12,5 +13,25 @@
                        /sqrt(2.0*PI)*(sig)
 double cdf(double x);
 
+// monotonic wall clock in nanoseconds (used for the kernel timers)
+double now_ns();
+
+// a file could not be opened, mapped or written (other errors of the data
+// are runtime_errors)
+class io_error : public std::runtime_error {
+public:
+  io_error(const std::string &what) : std::runtime_error(what) {}
+};
+
+// memory-maps a whole file (read-only unless writable), setting its size
+void *map_file(const char *filename, long long *size, bool writable=false);
+void unmap_file(void *addr, long long size);
+// asks the OS to read [addr, addr+len) of a mapping ahead of its use
+void read_ahead(const void *addr, long long len);
+
+// calls fn(k) for k in [0, n) on up to nthreads threads (one per core if
+// nthreads <= 0), handing out the indices as the threads become free
+void parallel_for(int n, int nthreads, const std::function<void(int)> &fn);
+
 
 #endif
@@ -0,0 +1,46 @@
+"""
+Checks that importing the package is fast and defers its heavy dependencies
+(SciPy, yaml and the shared library) until they are used. Runs with pytest or
+as a script:
+
+  python test_import_time.py
+"""
+import sys
+import json
+import subprocess
+from os.path import dirname, abspath
+
+# the import of the package (NumPy included) must take less than this (s)
+IMPORT_BUDGET = 0.5
+
+# run in a fresh interpreter, so that nothing is imported already
+_CHECK = """
+import sys, time, json
+t0 = time.time()
+import cubam, cubam.utils
+took = time.time()-t0
+loaded = [m for m in ['scipy', 'yaml'] if m in sys.modules]
+if 'cubamcpp' in open('/proc/self/maps').read():
+  loaded.append('cubamcpp')
+print json.dumps({ 'time' : took, 'loaded' : loaded })
+"""
+
+def import_stats():
+  """
+  Returns the time taken by `import cubam` in a new interpreter and the list
+  of deferred modules it loaded.
+  """
+  out = subprocess.check_output([sys.executable, '-c', _CHECK],
+                                cwd=dirname(abspath(__file__)))
+  stats = json.loads(out.strip().splitlines()[-1])
+  return stats['time'], stats['loaded']
+
+def test_import_time():
+  took, loaded = import_stats()
+  assert loaded == [], "Importing cubam loaded %s" % ', '.join(loaded)
+  assert took < IMPORT_BUDGET, \
+    "Importing cubam took %.3fs (budget %.3fs)" % (took, IMPORT_BUDGET)
+
+if __name__ == '__main__':
+  test_import_time()
+  print "import cubam: %.3fs" % import_stats()[0]
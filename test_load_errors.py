@@ -0,0 +1,55 @@
+"""
+Checks that bad data files raise Python exceptions rather than aborting the
+interpreter. Runs with pytest or as a script:
+
+  python test_load_errors.py
+"""
+import os
+import tempfile
+from cubam import Binary1dSignalModel, LabelStore
+from cubam.Model import build_label_store
+
+# a header of 2 images, 2 workers and 3 labels, with a bad body each
+BAD_FILES = {
+  'malformed' : "2 2 3\n0 0 1\n0 1\n1 0 1\n",
+  'badId' : "2 2 3\n0 0 1\n0 5 1\n1 0 1\n",
+  'badCount' : "2 2 3\n0 0 1\n1 0 1\n",
+}
+
+def _write(text):
+  fd, filename = tempfile.mkstemp(suffix='.txt')
+  os.write(fd, text)
+  os.close(fd)
+  return filename
+
+def _raises(exc, fn, *args):
+  try:
+    fn(*args)
+  except exc:
+    return True
+  return False
+
+def test_bad_files():
+  for (name, text) in sorted(BAD_FILES.iteritems()):
+    filename = _write(text)
+    try:
+      m = Binary1dSignalModel()
+      assert _raises(ValueError, m.load_data, filename), name
+      # a failed load leaves the model without data, ready for another
+      m.load_data_array([[0, 0, 1]], 1, 1)
+      assert m.get_num_lbls() == 1, name
+      assert _raises(ValueError, LabelStore().load_data, filename), name
+      assert _raises(ValueError, build_label_store, filename,
+                     filename + '.store'), name
+    finally:
+      os.remove(filename)
+
+def test_missing_file():
+  assert _raises(IOError, Binary1dSignalModel().load_data, '/nonexistent')
+  assert _raises(IOError, Binary1dSignalModel().load_data_mapped,
+                 '/nonexistent')
+
+if __name__ == '__main__':
+  test_bad_files()
+  test_missing_file()
+  print "ok"